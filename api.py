@@ -2,19 +2,37 @@
 FastAPI后端接口
 提供jsondata和output文件夹的JSON文件增删改查功能，以及批量计算接口
 """
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 import json
 import os
+import asyncio
+import functools
+import threading
+import time
 from pathlib import Path
 import pandas as pd
+import numpy as np
 from io import BytesIO
-from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
 
 # 导入计算模块
-from calculate import batch_calculate_and_save, reload_data_cache
+from calculate import (
+    batch_calculate_and_save, reload_data_file, reload_data_files, data_key_for_filename,
+    recalculate_stale, get_stale_indicators, diff_data_cells, propagate_data_change, get_dataset,
+    get_batch_plan, get_indicator_result, get_data_version, refresh_changed_datasets, query_results, compute_cells, INDICATORS,
+    materialize_output, output_names, results_path, pin_snapshot,
+)
+from jobs import JobManager, FINISHED_STATES
+import columnar_store
+import atomic_io
+import table_export
+import response_cache
+import scenarios
+import uncertainty
+import metrics
 
 app = FastAPI(title="PDQ数据管理API", version="1.0.0")
 
@@ -27,10 +45,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """记录各接口的请求耗时（按路由模板统计，如 /api/jsondata/{filename}）"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.observe(
+            "pdq_http_request_seconds", time.perf_counter() - start,
+            method=request.method, route=route.path if route is not None else "unmatched", status=status
+        )
+
 # 数据目录路径
 JSONDATA_DIR = Path("jsondata")
 OUTPUT_DIR = Path("output")
 
+# 批量计算可选的计算引擎
+BATCH_ENGINES = ("cell", "vectorized", "process")
+
+# 批量计算任务队列（同一时间只执行一个任务）
+job_manager = JobManager()
+
+# 计算事件流检查新事件的间隔和心跳间隔（秒）
+EVENT_POLL_INTERVAL = 0.2
+EVENT_KEEPALIVE_INTERVAL = 15
+
 # 确保目录存在
 JSONDATA_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
@@ -42,6 +87,18 @@ class FileUpdateRequest(BaseModel):
     data: Dict[str, Any]
 
 
+class CellUpdate(BaseModel):
+    """单元格更新"""
+    year: str
+    country: str
+    value: Any = None
+
+
+class CellPatchRequest(BaseModel):
+    """单元格批量更新请求模型"""
+    cells: List[CellUpdate]
+
+
 class AddDataRequest(BaseModel):
     """添加数据请求模型"""
     year: Optional[str] = None  # 添加年份时使用
@@ -59,6 +116,41 @@ class CalculateResponse(BaseModel):
     """计算响应模型"""
     status: str
     message: str
+    indicators: List[str] = []  # 本次将重新计算的指标
+    job_id: Optional[str] = None  # 计算任务ID，可通过 /api/calculate/jobs/{job_id} 查询进度
+
+
+class CellRef(BaseModel):
+    """(年份, 国家) 单元格"""
+    year: str
+    country: str
+
+
+class ComputeRequest(BaseModel):
+    """按需计算请求模型"""
+    indicator: str
+    cells: List[CellRef] = []  # 单值指标可省略
+    components: bool = True  # 是否返回上游中间结果
+
+
+class WeightScenarioRequest(BaseModel):
+    """权重情景请求模型：weights和grid_step二选一"""
+    weights: List[Dict[str, float]] = []  # [{"W_OA": 0.4, "W_OD": 0.4, "W_OP": 0.2}, ...]
+    grid_step: Optional[float] = None  # 权重网格步长，如0.05（三个权重之和为1的所有组合）
+    years: Optional[List[str]] = None
+    countries: Optional[List[str]] = None
+    keep: int = 100  # 返回R值和排名的情景数（其余情景只计入排名统计）
+
+
+class UncertaintyRequest(BaseModel):
+    """不确定性分析请求模型"""
+    samples: int = 1000
+    noise: Optional[Dict[str, float]] = None  # {数据键: 相对标准差}，默认见uncertainty.DEFAULT_NOISE
+    indicators: Optional[List[str]] = None  # 默认R、R_oa、R_od
+    model: str = "lognormal"  # lognormal / normal
+    confidence: float = 0.95
+    seed: int = 0
+    workers: Optional[int] = None  # 进程数
 
 
 class ExcelImportResponse(BaseModel):
@@ -69,17 +161,43 @@ class ExcelImportResponse(BaseModel):
     added_countries: List[str] = []
     updated_cells: int = 0
     errors: List[str] = []
+    invalidated: List[str] = []  # 因数据变化而失效的指标
+
+
+class SheetImportResult(BaseModel):
+    """工作簿中单个工作表的导入结果"""
+    sheet: str
+    filename: str
+    added_years: List[str] = []
+    added_countries: List[str] = []
+    updated_cells: int = 0
+    errors: List[str] = []
+
+
+class WorkbookImportResponse(BaseModel):
+    """多工作表导入响应模型"""
+    status: str
+    message: str
+    sheets: List[SheetImportResult] = []
+    invalidated: List[str] = []  # 因数据变化而失效的指标
 
 
 # ==================== 辅助函数 ====================
 def read_json_file(file_path: Path) -> Dict[str, Any]:
-    """读取JSON文件"""
+    """读取JSON文件（jsondata中的文件有最新的列式存储时直接从列式存储读取）"""
+    if file_path.parent == JSONDATA_DIR:
+        data = columnar_store.load(file_path)
+        if data is not None:
+            return columnar_store.to_dict(data)
+    
     if not file_path.exists():
         raise HTTPException(status_code=404, detail=f"文件不存在: {file_path.name}")
     
     try:
         with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+            data = json.load(f)
+        metrics.record_read(str(file_path), file_path.stat().st_size)
+        return data
     except json.JSONDecodeError as e:
         raise HTTPException(status_code=400, detail=f"JSON格式错误: {str(e)}")
     except Exception as e:
@@ -87,47 +205,183 @@ def read_json_file(file_path: Path) -> Dict[str, Any]:
 
 
 def write_json_file(file_path: Path, data: Dict[str, Any]):
-    """写入JSON文件，写入前创建备份"""
+    """
+    写入JSON文件：只序列化一次，旧文件按字节备份为.bak（并保留最近若干个历史版本），
+    新内容写入临时文件后原子替换，写入中途失败时原文件保持不变
+    """
     try:
-        # 先验证数据可以序列化
-        try:
-            json_str = json.dumps(data, ensure_ascii=False, indent=2)
-        except (TypeError, ValueError) as e:
-            raise HTTPException(status_code=500, detail=f"数据无法序列化为JSON: {str(e)}")
-        
-        # 创建备份（只有在文件存在时才备份）
-        backup_path = file_path.with_suffix('.json.bak')
-        if file_path.exists():
-            try:
-                # 读取现有文件作为备份
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-                # 写入备份
-                with open(backup_path, 'w', encoding='utf-8') as f:
-                    json.dump(existing_data, f, ensure_ascii=False, indent=2)
-            except Exception as backup_error:
-                print(f"警告: 创建备份失败: {backup_error}")
-                # 备份失败不影响主流程，继续执行
-        
-        # 写入新文件
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(json_str)
-    except HTTPException:
-        raise
+        json_str = json.dumps(data, ensure_ascii=False, indent=2)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"数据无法序列化为JSON: {str(e)}")
+    
+    try:
+        atomic_io.write_with_backup(file_path, json_str)
     except Exception as e:
-        # 如果写入失败，尝试从备份恢复
-        backup_path = file_path.with_suffix('.json.bak')
-        if backup_path.exists():
-            try:
-                print(f"错误: 写入文件失败，尝试从备份恢复: {str(e)}")
-                with open(backup_path, 'r', encoding='utf-8') as f:
-                    backup_data = json.load(f)
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(backup_data, f, ensure_ascii=False, indent=2)
-                print(f"✓ 已从备份恢复 {file_path.name}")
-            except Exception as restore_error:
-                print(f"✗ 从备份恢复失败: {restore_error}")
         raise HTTPException(status_code=500, detail=f"写入文件失败: {str(e)}")
+    finally:
+        response_cache.invalidate(file_path)
+
+
+def read_excel_sheets(contents: bytes, sheet_name=None):
+    """解析上传的Excel文件（依次尝试openpyxl和xlrd引擎）；sheet_name为None时返回 {工作表名: DataFrame}"""
+    try:
+        return pd.read_excel(BytesIO(contents), sheet_name=sheet_name, engine='openpyxl')
+    except Exception:
+        try:
+            return pd.read_excel(BytesIO(contents), sheet_name=sheet_name, engine='xlrd')
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Excel文件解析失败: {str(e)}")
+
+
+def check_year_column(df: pd.DataFrame, sheet: Optional[str] = None):
+    """验证第一列是年份列"""
+    first_col = str(df.columns[0]).strip().lower()
+    if first_col not in ['年份', 'year', '年']:
+        prefix = f"工作表'{sheet}'" if sheet else "Excel"
+        raise HTTPException(
+            status_code=400, 
+            detail=f"{prefix}第一列必须是'年份'列，当前为: {df.columns[0]}"
+        )
+
+
+def _excel_year_str(value) -> Optional[str]:
+    """Excel年份单元格转换为年份字符串，空值返回None"""
+    if pd.isna(value):
+        return None
+    if isinstance(value, (int, float, np.integer)):
+        return str(int(value)) if value == int(value) else str(value)
+    return str(value).strip()
+
+
+def _convert_excel_cell(value):
+    """单个非数值列单元格转换为JSON值，空值返回None"""
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, str):
+        if value.strip() == '':
+            return None
+        # 尝试转换为数字，失败时保持原值
+        try:
+            if '.' in value:
+                number = float(value)
+                return int(number) if number == int(number) else number
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(value, (bool, np.bool_, int, np.integer)):
+        return int(value)
+    try:
+        number = float(value)
+        return int(number) if number == int(number) else number
+    except (ValueError, TypeError):
+        return str(value)
+
+
+def _excel_column_values(column: pd.Series):
+    """
+    把一列Excel数据转换为JSON值，返回 (值数组(object), 有效掩码)。
+    数值列整列向量化处理：缺失值跳过，整数形式的浮点数转为int；其他列逐个单元格转换。
+    """
+    if pd.api.types.is_bool_dtype(column.dtype):
+        column = column.astype(np.int64)
+    if pd.api.types.is_integer_dtype(column.dtype) and not column.isna().any():
+        values = column.to_numpy(dtype=np.int64)
+        return values.astype(object), np.ones(len(values), dtype=bool)
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        numbers = column.to_numpy(dtype=np.float64, na_value=np.nan)
+        mask = ~np.isnan(numbers)
+        if np.isinf(numbers).any():
+            raise ValueError("包含无穷大的数值")
+        result = numbers.astype(object)
+        integral = mask & (numbers == np.floor(numbers))
+        small = integral & (np.abs(numbers) < 2 ** 63)
+        result[small] = numbers[small].astype(np.int64).astype(object)
+        for i in np.flatnonzero(integral & ~small):
+            result[i] = int(numbers[i])
+        return result, mask
+    result = np.array([_convert_excel_cell(value) for value in column.tolist()] + [None], dtype=object)[:-1]
+    mask = np.array([value is not None for value in result], dtype=bool)
+    return result, mask
+
+
+def merge_excel_sheet(df: pd.DataFrame, data: Dict[str, Any]):
+    """
+    把Excel工作表（第一列为年份，其余各列为国家）合并到 年份->国家->值 数据中（原地修改data）。
+    返回 (新增年份, 新增国家, 更新的单元格数, 错误列表)。
+    """
+    errors = []
+    year_column = df.columns[0]
+    country_columns = list(df.columns[1:])
+    countries = [str(col).strip() for col in country_columns]
+    
+    # 年份列
+    years = []
+    for index, value in enumerate(df[year_column].tolist()):
+        year_str = _excel_year_str(value)
+        if year_str is None:
+            errors.append(f"第{index+2}行: 年份为空，已跳过")
+        elif not year_str:
+            errors.append(f"第{index+2}行: 年份无效，已跳过")
+            year_str = None
+        years.append(year_str)
+    
+    # 各国家列按列转换
+    values = np.empty((len(df), len(countries)), dtype=object)
+    mask = np.zeros((len(df), len(countries)), dtype=bool)
+    for j, column in enumerate(country_columns):
+        try:
+            values[:, j], mask[:, j] = _excel_column_values(df.iloc[:, j + 1])
+        except Exception as e:
+            errors.append(f"{countries[j]}列: 处理失败 ({str(e)})，已跳过")
+    
+    row_valid = np.array([year is not None for year in years], dtype=bool)
+    mask &= row_valid[:, None]
+    
+    existing_years = set(data.keys())
+    added_years = set()
+    added_countries = set()
+    for i in np.flatnonzero(row_valid):
+        year_str = years[i]
+        columns = np.flatnonzero(mask[i])
+        if year_str not in existing_years:
+            added_years.add(year_str)
+        row = data.get(year_str)
+        if not isinstance(row, dict):
+            row = data[year_str] = {}
+        updates = {countries[j]: values[i, j] for j in columns}
+        if year_str in existing_years:
+            added_countries.update(updates.keys() - row.keys())
+        row.update(updates)
+    
+    return sorted(added_years), sorted(added_countries), int(mask.sum()), errors
+
+
+def reload_changed_file(filename: str) -> List[str]:
+    """jsondata文件修改后只重新加载该文件，并清除依赖它的指标缓存，返回失效的指标"""
+    key = data_key_for_filename(filename)
+    if key is None:
+        # 不参与计算的文件，无需刷新缓存
+        return []
+    try:
+        return reload_data_file(key)
+    except Exception as e:
+        # 如果重新加载失败，记录错误但不影响API响应
+        print(f"警告: 重新加载数据缓存失败: {e}")
+        return []
+
+
+# 修改jsondata文件的接口是普通函数（在线程池中执行，增量计算不阻塞事件循环），
+# 读取、修改、写入及随后的增量计算整体加锁，同一时间只有一个写入
+_jsondata_write_lock = threading.Lock()
+
+
+def _serialized_write(func):
+    """jsondata写入接口的装饰器：持有写入锁执行"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _jsondata_write_lock:
+            return func(*args, **kwargs)
+    return wrapper
 
 
 # ==================== jsondata API ====================
@@ -145,18 +399,19 @@ async def list_jsondata_files():
 
 
 @app.get("/api/jsondata/{filename}")
-async def get_jsondata_file(filename: str):
-    """读取jsondata文件夹中的JSON文件"""
+async def get_jsondata_file(filename: str, request: Request):
+    """读取jsondata文件夹中的JSON文件（支持ETag/If-None-Match条件请求和gzip压缩，文件未变化时不重新读取）"""
     file_path = JSONDATA_DIR / filename
     if not filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
     
-    data = read_json_file(file_path)
-    return {"filename": filename, "data": data}
+    entry = response_cache.get(file_path, lambda: {"filename": filename, "data": read_json_file(file_path)})
+    return response_cache.respond(entry, request.headers)
 
 
 @app.put("/api/jsondata/{filename}")
-async def update_jsondata_file(filename: str, request: FileUpdateRequest):
+@_serialized_write
+def update_jsondata_file(filename: str, request: FileUpdateRequest):
     """更新jsondata文件夹中的JSON文件（完全覆盖）"""
     if not filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
@@ -167,20 +422,105 @@ async def update_jsondata_file(filename: str, request: FileUpdateRequest):
     if not isinstance(request.data, dict):
         raise HTTPException(status_code=400, detail="数据必须是JSON对象")
     
+    # 写入前与快照中的数据比较（数据集尚未读取时此时读取的还是修改前的文件）
+    key = data_key_for_filename(filename)
+    cells = diff_data_cells(get_dataset(key), request.data) if key is not None else None
+    
     write_json_file(file_path, request.data)
     
-    # 重新加载数据缓存，因为文件已被修改
-    try:
-        reload_data_cache()
-    except Exception as e:
-        # 如果重新加载失败，记录错误但不影响API响应
-        print(f"警告: 重新加载数据缓存失败: {e}")
+    # 只修改了单元格的值时做单元格级增量计算，直接更新受影响的输出单元格
+    if key is not None:
+        if cells is not None:
+            try:
+                changes = propagate_data_change(key, request.data, cells)
+            except Exception as e:
+                print(f"警告: 增量计算失败: {e}")
+                changes = None
+            if changes is not None:
+                return {
+                    "message": f"文件 {filename} 已更新",
+                    "filename": filename,
+                    "invalidated": [],
+                    "changed_cells": changes["cells"],
+                    "changed_constants": changes["constants"],
+                }
     
-    return {"message": f"文件 {filename} 已更新", "filename": filename}
+    # 重新加载该文件，只清除依赖它的指标缓存
+    invalidated = reload_changed_file(filename)
+    
+    return {"message": f"文件 {filename} 已更新", "filename": filename, "invalidated": invalidated}
+
+
+@app.patch("/api/jsondata/{filename}")
+@_serialized_write
+def patch_jsondata_cells(filename: str, request: CellPatchRequest):
+    """
+    批量更新jsondata文件中的单元格（只改已有年份、已有国家的值，不改变文件结构）。
+    只重算依赖这些单元格的指标单元格，返回各指标变化的单元格数
+    """
+    if not filename.endswith('.json'):
+        raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
+    if not request.cells:
+        raise HTTPException(status_code=400, detail="没有要更新的单元格")
+    
+    file_path = JSONDATA_DIR / filename
+    key = data_key_for_filename(filename)
+    if key is None:
+        data = read_json_file(file_path)
+    else:
+        if not file_path.exists():
+            raise HTTPException(status_code=404, detail=f"文件不存在: {filename}")
+        # 先把在外部被修改的数据文件读入新快照（依赖它们的指标随之失效），再在快照数据的副本上修改，
+        # 之后的增量计算与快照中的数据比较，不会把外部修改当作已处理
+        refresh_changed_datasets()
+        data = {year: dict(row) if isinstance(row, dict) else row
+                for year, row in columnar_store.to_dict(get_dataset(key)).items()}
+    
+    changed = []
+    for cell in request.cells:
+        year_data = data.get(cell.year)
+        if not isinstance(year_data, dict):
+            raise HTTPException(status_code=404, detail=f"年份 {cell.year} 不存在")
+        if cell.country not in year_data:
+            raise HTTPException(status_code=404, detail=f"{cell.year}年不存在国家 {cell.country}")
+        if year_data[cell.country] != cell.value:
+            year_data[cell.country] = cell.value
+            changed.append((cell.year, cell.country))
+    changed = list(dict.fromkeys(changed))
+    
+    if not changed:
+        return {"filename": filename, "updated": 0, "changed_cells": {}, "changed_constants": {}, "invalidated": []}
+    
+    write_json_file(file_path, data)
+    
+    changes = None
+    if key is not None:
+        try:
+            changes = propagate_data_change(key, data, changed)
+        except Exception as e:
+            print(f"警告: 增量计算失败: {e}")
+    if changes is not None:
+        return {
+            "filename": filename,
+            "updated": len(changed),
+            "changed_cells": {name: len(cells) for name, cells in changes["cells"].items()},
+            "changed_constants": changes["constants"],
+            "invalidated": [],
+        }
+    
+    # 缓存不完整无法增量计算时，只清除依赖该文件的指标缓存
+    return {
+        "filename": filename,
+        "updated": len(changed),
+        "changed_cells": {},
+        "changed_constants": {},
+        "invalidated": reload_changed_file(filename),
+    }
 
 
 @app.post("/api/jsondata/{filename}/add")
-async def add_jsondata_data(filename: str, request: AddDataRequest):
+@_serialized_write
+def add_jsondata_data(filename: str, request: AddDataRequest):
     """向jsondata文件中添加数据（添加年份或国家）"""
     if not filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
@@ -212,17 +552,15 @@ async def add_jsondata_data(filename: str, request: AddDataRequest):
     
     write_json_file(file_path, data)
     
-    # 重新加载数据缓存
-    try:
-        reload_data_cache()
-    except Exception as e:
-        print(f"警告: 重新加载数据缓存失败: {e}")
+    # 重新加载该文件，只清除依赖它的指标缓存
+    invalidated = reload_changed_file(filename)
     
-    return {"message": "数据已添加", "filename": filename}
+    return {"message": "数据已添加", "filename": filename, "invalidated": invalidated}
 
 
 @app.delete("/api/jsondata/{filename}/delete")
-async def delete_jsondata_data(filename: str, request: DeleteDataRequest):
+@_serialized_write
+def delete_jsondata_data(filename: str, request: DeleteDataRequest):
     """从jsondata文件中删除数据（删除年份或国家）"""
     if not filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
@@ -253,17 +591,15 @@ async def delete_jsondata_data(filename: str, request: DeleteDataRequest):
     
     write_json_file(file_path, data)
     
-    # 重新加载数据缓存
-    try:
-        reload_data_cache()
-    except Exception as e:
-        print(f"警告: 重新加载数据缓存失败: {e}")
+    # 重新加载该文件，只清除依赖它的指标缓存
+    invalidated = reload_changed_file(filename)
     
-    return {"message": "数据已删除", "filename": filename}
+    return {"message": "数据已删除", "filename": filename, "invalidated": invalidated}
 
 
 @app.post("/api/jsondata/{filename}/import-excel", response_model=ExcelImportResponse)
-async def import_excel_data(filename: str, file: UploadFile = File(...)):
+@_serialized_write
+def import_excel_data(filename: str, file: UploadFile = File(...)):
     """从Excel文件批量导入数据到jsondata文件"""
     try:
         if not filename.endswith('.json'):
@@ -278,194 +614,36 @@ async def import_excel_data(filename: str, file: UploadFile = File(...)):
         
         file_path = JSONDATA_DIR / filename
         
-        # 读取现有数据（失败时从备份恢复）
-        original_data = None
+        # 读取现有数据（写入是原子的，导入失败时原文件保持不变，无需另存副本）
         try:
             data = read_json_file(file_path)
-            # 保存原始数据的深拷贝作为备份
-            import copy
-            original_data = copy.deepcopy(data)
         except HTTPException as e:
             if e.status_code == 404:
                 # 如果文件不存在，创建空数据
                 data = {}
-                original_data = {}
             else:
                 raise
         
         # 读取Excel文件
-        contents = await file.read()
+        contents = file.file.read()
         if len(contents) == 0:
             raise HTTPException(status_code=400, detail="上传的文件为空")
         
-        # 尝试不同的引擎解析Excel
-        df = None
-        try:
-            df = pd.read_excel(BytesIO(contents), engine='openpyxl')
-        except Exception:
-            try:
-                df = pd.read_excel(BytesIO(contents), engine='xlrd')
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Excel文件解析失败: {str(e)}")
-        
+        df = read_excel_sheets(contents, sheet_name=0)
         if df is None or df.empty:
             raise HTTPException(status_code=400, detail="Excel文件为空或无法读取")
         
         # 验证Excel格式：第一列必须是年份列
-        first_col = str(df.columns[0]).strip().lower()
-        if first_col not in ['年份', 'year', '年']:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Excel第一列必须是'年份'列，当前为: {df.columns[0]}"
-            )
-        
-        # 统计信息
-        added_years = []
-        added_countries = []
-        updated_cells = 0
-        errors = []
-        
-        # 获取列名
-        year_column = df.columns[0]
-        country_columns = list(df.columns[1:])
-        
-        # 遍历Excel数据
-        for index, row in df.iterrows():
-            try:
-                # 获取年份值
-                year_value = row[year_column]
-                if pd.isna(year_value):
-                    errors.append(f"第{index+2}行: 年份为空，已跳过")
-                    continue
-                
-                # 转换年份为字符串
-                if isinstance(year_value, (int, float)):
-                    year_str = str(int(year_value)) if year_value == int(year_value) else str(year_value)
-                else:
-                    year_str = str(year_value).strip()
-                
-                if not year_str:
-                    errors.append(f"第{index+2}行: 年份无效，已跳过")
-                    continue
-                
-                # 判断年份是否存在
-                year_exists = year_str in data
-                
-                # 如果年份不存在，创建新年份
-                if not year_exists:
-                    data[year_str] = {}
-                    added_years.append(year_str)
-                
-                # 遍历所有国家列
-                for country_col in country_columns:
-                    try:
-                        country_name = str(country_col).strip()
-                        cell_value = row[country_col]
-                        
-                        # 跳过空值
-                        if pd.isna(cell_value):
-                            continue
-                        
-                        # 处理数值：将numpy类型转换为Python原生类型
-                        if isinstance(cell_value, str):
-                            if cell_value.strip() == '':
-                                continue
-                            # 尝试转换为数字
-                            try:
-                                if '.' in cell_value:
-                                    final_value = float(cell_value)
-                                    if final_value == int(final_value):
-                                        final_value = int(final_value)
-                                else:
-                                    final_value = int(cell_value)
-                            except ValueError:
-                                final_value = cell_value  # 保持原值
-                        else:
-                            # 处理numpy/int64/float64等类型
-                            import numpy as np
-                            if pd.isna(cell_value):
-                                continue
-                            # 转换为Python原生类型
-                            if isinstance(cell_value, (np.integer, int)):
-                                final_value = int(cell_value)
-                            elif isinstance(cell_value, (np.floating, float)):
-                                final_value = float(cell_value)
-                                # 如果是整数形式的浮点数，转为整数
-                                if final_value == int(final_value):
-                                    final_value = int(final_value)
-                            else:
-                                # 其他类型，尝试转换
-                                try:
-                                    final_value = float(cell_value)
-                                    if final_value == int(final_value):
-                                        final_value = int(final_value)
-                                except (ValueError, TypeError):
-                                    final_value = str(cell_value)
-                        
-                        # 判断国家是否存在
-                        country_exists_in_year = country_name in data[year_str]
-                        
-                        # 如果年份存在但国家不存在，新增国家列
-                        if year_exists and not country_exists_in_year:
-                            added_countries.append(country_name)
-                        
-                        # 更新或添加数据
-                        data[year_str][country_name] = final_value
-                        updated_cells += 1
-                    except Exception as e:
-                        errors.append(f"第{index+2}行, {country_name}列: 处理失败 ({str(e)})")
-                        continue
-            except Exception as e:
-                errors.append(f"第{index+2}行: 处理失败 ({str(e)})")
-                continue
+        check_year_column(df)
         
-        # 去重统计信息
-        added_years = sorted(list(set(added_years)))
-        added_countries = sorted(list(set(added_countries)))
+        # 按列批量转换并合并到现有数据
+        added_years, added_countries, updated_cells, errors = merge_excel_sheet(df, data)
         
-        # 验证数据是否可以序列化为JSON（在保存前验证）
-        try:
-            import json
-            # 尝试序列化，确保所有值都是JSON兼容的
-            json.dumps(data, ensure_ascii=False)
-        except (TypeError, ValueError) as e:
-            # 如果序列化失败，尝试修复数据
-            print(f"警告: 数据序列化失败，尝试修复: {str(e)}")
-            # 递归转换所有numpy类型
-            def convert_to_native_types(obj):
-                import numpy as np
-                if isinstance(obj, dict):
-                    return {k: convert_to_native_types(v) for k, v in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_to_native_types(item) for item in obj]
-                elif isinstance(obj, (np.integer, int)):
-                    return int(obj)
-                elif isinstance(obj, (np.floating, float)):
-                    val = float(obj)
-                    return int(val) if val == int(val) else val
-                elif isinstance(obj, np.ndarray):
-                    return obj.tolist()
-                elif pd.isna(obj):
-                    return None
-                else:
-                    return obj
-            
-            data = convert_to_native_types(data)
-            
-            # 再次验证
-            try:
-                json.dumps(data, ensure_ascii=False)
-            except (TypeError, ValueError) as e2:
-                raise HTTPException(status_code=500, detail=f"数据格式错误，无法保存: {str(e2)}")
-        
-        # 保存文件（只有在验证通过后才保存）
+        # 保存文件（序列化失败时不会写入）
         write_json_file(file_path, data)
         
-        # 重新加载数据缓存
-        try:
-            reload_data_cache()
-        except Exception as e:
-            print(f"警告: 重新加载数据缓存失败: {e}")
+        # 重新加载该文件，只清除依赖它的指标缓存
+        invalidated = reload_changed_file(filename)
         
         # 构建返回消息
         message_parts = []
@@ -490,7 +668,8 @@ async def import_excel_data(filename: str, file: UploadFile = File(...)):
             added_years=added_years,
             added_countries=added_countries,
             updated_cells=updated_cells,
-            errors=errors[:20]  # 最多返回20个错误
+            errors=errors[:20],  # 最多返回20个错误
+            invalidated=invalidated
         )
     
     except HTTPException:
@@ -500,53 +679,149 @@ async def import_excel_data(filename: str, file: UploadFile = File(...)):
         error_detail = traceback.format_exc()
         print(f"Excel导入错误: {error_detail}")
         
-        # 如果导入失败，尝试恢复原始数据
-        if original_data is not None and file_path.exists():
+        raise HTTPException(status_code=500, detail=f"导入过程发生错误: {str(e)}")
+
+
+@app.post("/api/jsondata/workbook/import", response_model=WorkbookImportResponse)
+@_serialized_write
+def import_excel_workbook(file: UploadFile = File(...)):
+    """
+    从一个Excel工作簿导入多个jsondata文件：每个工作表对应一个文件（工作表名为文件名，可省略.json）。
+    所有工作表验证通过后才写入，任一文件写入失败时已写入的文件恢复原内容；全部写入后只刷新一次缓存。
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="未提供文件名")
+    if not (file.filename.endswith('.xlsx') or file.filename.endswith('.xls')):
+        raise HTTPException(status_code=400, detail="文件必须是Excel格式(.xlsx或.xls)")
+    
+    contents = file.file.read()
+    if len(contents) == 0:
+        raise HTTPException(status_code=400, detail="上传的文件为空")
+    sheets = read_excel_sheets(contents)
+    
+    # 工作表与jsondata文件对应，未知的工作表整体拒绝（避免误写）
+    targets = []
+    unknown = []
+    for sheet, df in sheets.items():
+        name = str(sheet).strip()
+        filename = name if name.endswith('.json') else f"{name}.json"
+        if data_key_for_filename(filename) is None and not (JSONDATA_DIR / filename).exists():
+            unknown.append(name)
+            continue
+        if df.empty:
+            continue
+        check_year_column(df, name)
+        targets.append((name, filename, df))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"以下工作表没有对应的数据文件: {', '.join(unknown)}")
+    if not targets:
+        raise HTTPException(status_code=400, detail="Excel文件为空或无法读取")
+    
+    # 合并并序列化全部文件，出错时不写入任何文件
+    results = []
+    payloads = []
+    for name, filename, df in targets:
+        file_path = JSONDATA_DIR / filename
+        try:
+            data = read_json_file(file_path)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            data = {}
+        added_years, added_countries, updated_cells, errors = merge_excel_sheet(df, data)
+        try:
+            json_str = json.dumps(data, ensure_ascii=False, indent=2)
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=500, detail=f"{filename} 无法序列化为JSON: {str(e)}")
+        payloads.append((file_path, json_str))
+        results.append(SheetImportResult(
+            sheet=name, filename=filename, added_years=added_years, added_countries=added_countries,
+            updated_cells=updated_cells, errors=errors[:20]
+        ))
+    
+    # 依次写入；失败时把已写入的文件恢复为原内容
+    written = []
+    try:
+        for file_path, json_str in payloads:
+            original = file_path.read_bytes() if file_path.exists() else None
+            atomic_io.write_with_backup(file_path, json_str)
+            response_cache.invalidate(file_path)
+            written.append((file_path, original))
+    except Exception as e:
+        for file_path, original in reversed(written):
             try:
-                print(f"尝试恢复原始数据...")
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(original_data, f, ensure_ascii=False, indent=2)
-                print(f"✓ 已恢复原始数据到 {file_path.name}")
+                if original is None:
+                    file_path.unlink()
+                else:
+                    atomic_io.atomic_write(file_path, original)
+                response_cache.invalidate(file_path)
             except Exception as restore_error:
-                print(f"✗ 恢复原始数据失败: {restore_error}")
-                # 尝试从备份恢复
-                backup_path = file_path.with_suffix('.json.bak')
-                if backup_path.exists():
-                    try:
-                        with open(backup_path, 'r', encoding='utf-8') as f:
-                            backup_data = json.load(f)
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            json.dump(backup_data, f, ensure_ascii=False, indent=2)
-                        print(f"✓ 已从备份恢复 {file_path.name}")
-                    except Exception as backup_restore_error:
-                        print(f"✗ 从备份恢复也失败: {backup_restore_error}")
-        
-        raise HTTPException(status_code=500, detail=f"导入过程发生错误: {str(e)}")
+                print(f"警告: 恢复文件失败 {file_path}: {restore_error}")
+        raise HTTPException(status_code=500, detail=f"写入文件失败，已恢复原内容: {str(e)}")
+    
+    # 只刷新一次缓存
+    keys = [key for key in (data_key_for_filename(r.filename) for r in results) if key is not None]
+    try:
+        invalidated = reload_data_files(keys)
+    except Exception as e:
+        print(f"警告: 重新加载数据缓存失败: {e}")
+        invalidated = []
+    
+    updated_cells = sum(r.updated_cells for r in results)
+    error_count = sum(len(r.errors) for r in results)
+    message = f"导入{len(results)}个文件，更新{updated_cells}个数据单元格"
+    if error_count:
+        message += f"；遇到{error_count}个错误"
+    return WorkbookImportResponse(status="success", message=message, sheets=results, invalidated=invalidated)
 
 
 # ==================== output API ====================
+def output_file(filename: str) -> Path:
+    """
+    output文件的路径：计算结果保存在结果文件中，旧格式的JSON文件在这里按需生成。
+    先检查文件名（必须以.json结尾，且是结果文件中的指标或已有的文件），检查通过后才写出文件。
+    """
+    if not filename.endswith('.json'):
+        raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
+    file_path = OUTPUT_DIR / filename
+    if file_path.name != filename or file_path.stem not in output_names() and not file_path.exists():
+        raise HTTPException(status_code=404, detail=f"文件不存在: {filename}")
+    materialize_output(file_path.stem)
+    return file_path
+
+
+def output_filenames() -> List[str]:
+    """所有输出文件名：结果文件中的指标和output文件夹中已有的JSON文件"""
+    names = {f"{name}.json" for name in output_names()}
+    names.update(file_path.name for file_path in OUTPUT_DIR.glob("*.json"))
+    return sorted(names)
+
+
 @app.get("/api/output/files")
 async def list_output_files():
-    """列出output文件夹中的所有JSON文件"""
+    """列出所有输出文件（结果文件中尚未生成JSON文件的指标，size为null、modified为结果文件的修改时间）"""
+    artifact_path = Path(results_path())
+    results_modified = artifact_path.stat().st_mtime if artifact_path.exists() else None
     files = []
-    for file_path in OUTPUT_DIR.glob("*.json"):
-        files.append({
-            "filename": file_path.name,
-            "size": file_path.stat().st_size,
-            "modified": file_path.stat().st_mtime
-        })
-    return {"files": sorted(files, key=lambda x: x["filename"])}
+    for filename in output_filenames():
+        file_path = OUTPUT_DIR / filename
+        if file_path.exists():
+            files.append({
+                "filename": filename,
+                "size": file_path.stat().st_size,
+                "modified": file_path.stat().st_mtime
+            })
+        else:
+            files.append({"filename": filename, "size": None, "modified": results_modified})
+    return {"files": files}
 
 
 @app.get("/api/output/{filename}")
-async def get_output_file(filename: str):
-    """读取output文件夹中的JSON文件"""
-    file_path = OUTPUT_DIR / filename
-    if not filename.endswith('.json'):
-        raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
-    
-    data = read_json_file(file_path)
-    return {"filename": filename, "data": data}
+async def get_output_file(filename: str, request: Request):
+    """读取output文件夹中的JSON文件（支持ETag/If-None-Match条件请求和gzip压缩，文件未变化时不重新读取）"""
+    file_path = output_file(filename)
+    entry = response_cache.get(file_path, lambda: {"filename": filename, "data": read_json_file(file_path)})
+    return response_cache.respond(entry, request.headers)
 
 
 @app.put("/api/output/{filename}")
@@ -572,7 +847,7 @@ async def add_output_data(filename: str, request: AddDataRequest):
     if not filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
     
-    file_path = OUTPUT_DIR / filename
+    file_path = output_file(filename)
     data = read_json_file(file_path)
     
     # 处理单值函数（如r_open_t1.json格式为{"value": 0.4036}）
@@ -611,7 +886,7 @@ async def delete_output_data(filename: str, request: DeleteDataRequest):
     if not filename.endswith('.json'):
         raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
     
-    file_path = OUTPUT_DIR / filename
+    file_path = output_file(filename)
     data = read_json_file(file_path)
     
     # 处理单值函数
@@ -644,172 +919,460 @@ async def delete_output_data(filename: str, request: DeleteDataRequest):
 
 
 # ==================== 计算API ====================
+def _batch_job_func(incremental: bool, engine: str, workers: Optional[int]):
+    """构造在任务线程中执行的计算函数"""
+    def run(progress):
+        if incremental:
+            return recalculate_stale(progress=progress)
+        if engine == "process":
+            return batch_calculate_and_save(engine=engine, max_workers=workers, progress=progress)
+        return batch_calculate_and_save(engine=engine, progress=progress)
+    return run
+
+
+def _batch_job_plan(incremental: bool):
+    """任务开始时确定要计算的指标及单元格数"""
+    def plan():
+        names = get_stale_indicators() if incremental else list(INDICATORS)
+        return get_batch_plan(names)
+    return plan
+
+
 @app.post("/api/calculate/batch", response_model=CalculateResponse)
-async def execute_batch_calculate(background_tasks: BackgroundTasks):
-    """执行批量计算"""
+async def execute_batch_calculate(incremental: bool = False, engine: str = "cell", workers: Optional[int] = None):
+    """
+    提交批量计算任务；incremental=true时只重新计算并输出因数据修改而失效的指标
+    engine: cell（逐单元）/ vectorized（向量化）/ process（多进程按年份分块），workers为进程数
+    任务按提交顺序逐个执行；全量计算会取消尚未完成的旧任务，重复提交相同的排队任务会合并
+    """
+    if engine not in BATCH_ENGINES:
+        raise HTTPException(status_code=400, detail=f"不支持的计算引擎: {engine}，可选: {', '.join(BATCH_ENGINES)}")
+    
     try:
-        # 在后台任务中执行计算，避免阻塞
-        background_tasks.add_task(batch_calculate_and_save)
+        # 在外部被修改的数据文件先重新加载，依赖它的指标标记为需要重新计算
+        refresh_changed_datasets()
+        indicators = []
+        if incremental:
+            indicators = get_stale_indicators()
+            if not indicators:
+                return CalculateResponse(status="skipped", message="数据未变化，无需重新计算")
+        
+        params = {"incremental": incremental, "engine": engine, "workers": workers}
+        job, created = job_manager.submit(
+            "incremental" if incremental else "batch",
+            params,
+            _batch_job_func(incremental, engine, workers),
+            _batch_job_plan(incremental),
+            # 全量计算取代排队和运行中的批量、增量计算（不影响不确定性分析）
+            supersede=() if incremental else ("batch", "incremental")
+        )
+        
+        if incremental:
+            message = f"增量计算已加入队列，将重新计算{len(indicators)}个指标"
+        else:
+            message = "批量计算已加入队列，正在后台执行"
+        if not created:
+            message = "相同的计算任务已在队列中"
         
         return CalculateResponse(
-            status="started",
-            message="批量计算已开始，正在后台执行"
+            status=job.status,
+            message=message,
+            indicators=indicators,
+            job_id=job.id
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"启动计算失败: {str(e)}")
 
 
+@app.post("/api/calculate/uncertainty", response_model=CalculateResponse)
+async def execute_uncertainty(request: UncertaintyRequest):
+    """
+    提交蒙特卡洛不确定性分析任务：按相对误差扰动输入数据，统计各单元格指标的均值、标准差和置信区间，
+    结果写入 output/uncertainty/<指标>.json。与批量计算共用任务队列，可通过任务接口查询进度或取消。
+    """
+    params = request.dict()
+    try:
+        # 参数错误在提交时报告，而不是在任务中失败
+        uncertainty.validate(params["samples"], params["noise"], params["indicators"], params["model"], params["confidence"])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def run(progress):
+        return uncertainty.run(progress=progress, **params)
+    
+    def plan():
+        return [("uncertainty", request.samples)]
+    
+    job, created = job_manager.submit("uncertainty", params, run, plan)
+    return CalculateResponse(
+        status=job.status,
+        message="不确定性分析已加入队列" if created else "相同的分析任务已在队列中",
+        job_id=job.id
+    )
+
+
+@app.get("/api/calculate/uncertainty/{indicator}")
+async def get_uncertainty_result(indicator: str, request: Request):
+    """读取最近一次不确定性分析的结果：年份->国家->{mean, std, lower, upper}"""
+    file_path = Path(uncertainty.OUTPUT_DIR) / f"{indicator}.json"
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail=f"没有{indicator}的不确定性分析结果")
+    entry = response_cache.get(file_path, lambda: read_json_file(file_path))
+    return response_cache.respond(entry, request.headers)
+
+
 @app.get("/api/calculate/status")
 async def get_calculate_status():
-    """获取计算状态（简单版本，实际可以使用更复杂的状态管理）"""
-    # 这里可以扩展为更复杂的状态管理，比如使用Redis或数据库
-    # 目前返回简单的状态信息
+    """获取计算状态：正在运行的任务，没有则为最近提交的任务"""
+    job = job_manager.current()
+    if job is None:
+        return {
+            "status": "idle",
+            "message": "尚未提交计算任务",
+            "stale_indicators": get_stale_indicators()
+        }
+    status = job.to_dict()
+    status["stale_indicators"] = get_stale_indicators()
+    return status
+
+
+@app.get("/api/calculate/data-version")
+async def get_calculate_data_version():
+    """
+    当前数据版本，以及各输出文件由哪个版本的数据计算得到。
+    outputs_current为true表示所有输出都来自当前数据且没有待重新计算的指标。
+    """
+    return get_data_version()
+
+
+@app.get("/api/calculate/jobs")
+async def list_calculate_jobs():
+    """列出最近的计算任务"""
+    return {"jobs": [job.to_dict() for job in reversed(job_manager.list())]}
+
+
+@app.get("/api/calculate/jobs/{job_id}")
+async def get_calculate_job(job_id: str):
+    """获取指定计算任务的状态和进度"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job.to_dict()
+
+
+@app.post("/api/calculate/jobs/{job_id}/cancel")
+async def cancel_calculate_job(job_id: str):
+    """取消计算任务（排队中的任务直接取消，运行中的任务在下一个进度检查点中止）"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job.to_dict()
+
+
+def _format_sse(event_id: int, event: str, data: Dict[str, Any]) -> str:
+    """格式化一条Server-Sent Events消息"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+
+
+def _indicator_event_data(snapshot, name: str):
+    """任务计算时固定使用的快照中该指标的结果（与任务写出的结果相同，不受之后的数据修改影响）"""
+    with pin_snapshot(snapshot):
+        return get_indicator_result(name)
+
+
+async def _job_event_stream(job, start: int, include_data: bool):
+    """按顺序推送任务事件，任务结束后关闭连接"""
+    cursor = start
+    idle = 0.0
+    while True:
+        events = job.events
+        while cursor < len(events):
+            item = events[cursor]
+            data = item["data"]
+            if include_data and item["event"] == "indicator" and data["name"] in INDICATORS:
+                result = await asyncio.to_thread(_indicator_event_data, item.get("snapshot"), data["name"])
+                data = dict(data, data=result)
+            yield _format_sse(cursor, item["event"], data)
+            cursor += 1
+            idle = 0.0
+        if job.status in FINISHED_STATES and cursor >= len(job.events):
+            return
+        if idle >= EVENT_KEEPALIVE_INTERVAL:
+            yield ": keep-alive\n\n"
+            idle = 0.0
+        await asyncio.sleep(EVENT_POLL_INTERVAL)
+        idle += EVENT_POLL_INTERVAL
+
+
+@app.get("/api/calculate/jobs/{job_id}/events")
+async def stream_calculate_job_events(job_id: str, include_data: bool = False,
+                                      last_event_id: Optional[str] = Header(None)):
+    """
+    以Server-Sent Events推送计算任务进度：
+    start（计算计划）、indicator（每个指标完成，含耗时；include_data=true时附带该指标的年份×国家结果）、end（任务结束）。
+    断线重连时浏览器自动带上Last-Event-ID，从下一条事件继续推送。
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    start = 0
+    if last_event_id is not None and last_event_id.isdigit():
+        start = int(last_event_id) + 1
+    return StreamingResponse(
+        _job_event_stream(job, start, include_data),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== 结果查询API ====================
+def _split_param(value: Optional[str]) -> Optional[List[str]]:
+    """逗号分隔的查询参数转换为列表，未提供时返回None"""
+    if value is None:
+        return None
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _parse_years(value: Optional[str]) -> Optional[List[int]]:
+    """年份参数：逗号分隔的年份或范围，如 "2000-2010,2015"；未提供时返回None"""
+    items = _split_param(value)
+    if items is None:
+        return None
+    years = []
+    try:
+        for item in items:
+            start, sep, end = item.partition('-')
+            if sep:
+                years.extend(range(int(start), int(end) + 1))
+            else:
+                years.append(int(item))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"年份格式错误: {value}（示例: 2000-2010,2015）")
+    return years
+
+
+def _parse_year_keys(value: Optional[str]) -> Optional[List[str]]:
+    """年份参数（可包含范围）转换为数据中的年份键，未提供时返回None"""
+    years = _parse_years(value)
+    return None if years is None else [str(year) for year in years]
+
+
+def _columnar_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    """把查询结果转换为列式：year、country两列加每个逐单元指标一列，单值指标放在constants中"""
+    pairs = [(year, country) for year in result["years"] for country in result["countries"]]
+    columns = {"year": [year for year, _ in pairs], "country": [country for _, country in pairs]}
+    constants = {}
+    for name, value in result["values"].items():
+        if INDICATORS[name]['kind'] == 'constant':
+            constants[name] = value
+        elif value is None:
+            columns[name] = [None] * len(pairs)
+        else:
+            columns[name] = [value.get(year, {}).get(country) for year, country in pairs]
+    return {"columns": columns, "constants": constants}
+
+
+@app.get("/api/results/query")
+async def query_indicator_results(
+    indicators: Optional[str] = None,
+    years: Optional[str] = None,
+    countries: Optional[str] = None,
+    format: str = "nested",
+):
+    """
+    查询指标结果的切片（从内存中的计算结果读取，不读取output文件）。
+    indicators、countries为逗号分隔的列表，years可以包含范围（如 2000-2010），均可省略（表示全部）；
+    format为nested（指标->年份->国家->值）或columnar（列式）。
+    """
+    if format not in ("nested", "columnar"):
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}（可选 nested / columnar）")
+    names = _split_param(indicators)
+    if names is not None:
+        unknown = [name for name in names if name not in INDICATORS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知指标: {', '.join(unknown)}")
+    
+    result = await asyncio.to_thread(query_results, names, _parse_years(years), _split_param(countries))
+    response = {
+        "years": result["years"],
+        "countries": result["countries"],
+        "stale": result["stale"],
+        "data_version": result["data_version"],
+    }
+    if format == "columnar":
+        response.update(_columnar_result(result))
+    else:
+        response["values"] = result["values"]
+    return response
+
+
+@app.post("/api/results/compute")
+async def compute_indicator_cells(request: ComputeRequest):
+    """
+    按需计算指标在指定 (年份, 国家) 上的值及其上游中间结果，不运行批量计算、不写输出文件。
+    只计算所需的上游指标和全局归一化常量，结果保留在内存缓存中，重复请求直接命中。
+    """
+    if request.indicator not in INDICATORS:
+        raise HTTPException(status_code=400, detail=f"未知指标: {request.indicator}")
+    cells = [(cell.year, cell.country) for cell in request.cells]
+    if INDICATORS[request.indicator]['kind'] == 'cell' and not cells:
+        raise HTTPException(status_code=400, detail="逐单元指标需要提供cells")
+    if not cells:
+        cells = [(None, None)]
+    
+    result = await asyncio.to_thread(compute_cells, request.indicator, cells, request.components)
+    return {"indicator": request.indicator, "kind": INDICATORS[request.indicator]['kind'], **result}
+
+
+def _matrix_to_dict(matrix, years: List[str], countries: List[str], missing=None) -> Dict[str, Dict[str, Any]]:
+    """年份×国家矩阵转换为 年份->国家->值（NaN或等于missing的值为None）"""
+    rows = matrix.tolist()
     return {
-        "status": "unknown",
-        "message": "如需准确状态，请检查output文件夹的文件修改时间"
+        year: {
+            country: None if (value != value or value == missing) else value
+            for country, value in zip(countries, row)
+        }
+        for year, row in zip(years, rows)
     }
 
 
-# ==================== 导出Excel功能 ====================
-@app.get("/api/jsondata/{filename}/export-excel")
-async def export_jsondata_to_excel(filename: str):
-    """导出单个jsondata文件为Excel"""
+@app.post("/api/scenarios/weights")
+async def run_weight_scenarios(request: WeightScenarioRequest):
+    """
+    权重情景：用给定的一组或多组权重（或权重网格）重新计算所有单元格的R及各年排名，不修改weight.json、不写任何文件。
+    R_oa_bar、R_od_bar、R_op_bar与权重无关，直接复用已有的计算结果。
+    """
     try:
-        if not filename.endswith('.json'):
-            raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
-        
-        file_path = JSONDATA_DIR / filename
-        
-        # 读取JSON数据
-        try:
-            data = read_json_file(file_path)
-        except HTTPException as e:
-            if e.status_code == 404:
-                raise HTTPException(status_code=404, detail=f"文件不存在: {filename}")
-            raise
-        
-        # 转换为DataFrame
-        if not data or len(data) == 0:
-            raise HTTPException(status_code=400, detail="文件数据为空")
-        
-        # 检查是否是单值文件
-        if 'value' in data and len(data) == 1:
-            # 单值文件，创建一个简单的表格
-            df = pd.DataFrame([{'函数名': filename.replace('.json', ''), '值': data['value']}])
+        if request.grid_step is not None:
+            weights = scenarios.weight_grid(request.grid_step)
         else:
-            # 多值文件，转换为DataFrame
-            # 收集所有年份和所有国家
-            years = sorted(data.keys())
-            all_countries = set()
-            for year_data in data.values():
-                if isinstance(year_data, dict):
-                    all_countries.update(year_data.keys())
-            
-            all_countries = sorted(list(all_countries))
-            
-            # 构建DataFrame
-            rows = []
-            for year in years:
-                row = {'年份': year}
-                if isinstance(data[year], dict):
-                    for country in all_countries:
-                        row[country] = data[year].get(country, None)
-                rows.append(row)
-            
-            df = pd.DataFrame(rows)
-        
-        # 创建Excel文件
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='数据')
-        
-        output.seek(0)
-        
-        # 返回文件流
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename.replace('.json', '')}.xlsx"
-            }
-        )
+            weights = scenarios.weight_matrix(request.weights)
+        if len(weights) > scenarios.MAX_SCENARIOS:
+            raise ValueError(f"情景数超过上限{scenarios.MAX_SCENARIOS}")
+        year_list = _parse_years(",".join(request.years)) if request.years else None
+        result = await asyncio.to_thread(scenarios.run, weights, year_list, request.countries, max(request.keep, 0))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print(f"导出Excel错误: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"导出Excel失败: {str(e)}")
+    years, countries = result["years"], result["countries"]
+    stats = result["rank_stats"]
+    valid = stats["max"] > 0
+    return {
+        "years": years,
+        "countries": countries,
+        "scenario_count": len(weights),
+        "scenarios": [
+            {
+                "weights": dict(zip(scenarios.WEIGHT_KEYS, result["weights"][i].tolist())),
+                "values": _matrix_to_dict(result["values"][i], years, countries),
+                "ranks": _matrix_to_dict(result["ranks"][i], years, countries, missing=0),
+            }
+            for i in range(len(result["values"]))
+        ],
+        "rank_stats": {
+            "min": _matrix_to_dict(np.where(valid, stats["min"], 0), years, countries, missing=0),
+            "max": _matrix_to_dict(stats["max"], years, countries, missing=0),
+            "mean": _matrix_to_dict(np.where(valid, stats["mean"], np.nan), years, countries),
+        },
+    }
 
 
-@app.get("/api/output/{filename}/export-excel")
-async def export_output_to_excel(filename: str):
-    """导出单个output文件为Excel"""
-    try:
-        if not filename.endswith('.json'):
-            raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
-        
-        file_path = OUTPUT_DIR / filename
-        
-        # 读取JSON数据
+# ==================== 运行指标 ====================
+@app.get("/metrics")
+async def get_prometheus_metrics():
+    """Prometheus格式的运行指标：指标计算耗时和单元格数、缓存命中、数据读取耗时、文件读写字节数、接口耗时"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/metrics")
+async def get_metrics_summary():
+    """运行指标的JSON摘要（耗时分布给出次数、总和、平均和最大值，按总耗时从大到小排列）"""
+    return metrics.summary()
+
+
+# ==================== 导出功能 ====================
+def _read_export_data(file_path: Path):
+    """读取要导出的文件；jsondata文件直接使用列式存储（按行生成，不转换为整个字典）"""
+    if not file_path.name.endswith('.json'):
+        raise HTTPException(status_code=400, detail="文件名必须以.json结尾")
+    data = columnar_store.load(file_path) if file_path.parent == JSONDATA_DIR else None
+    if data is None:
         try:
             data = read_json_file(file_path)
         except HTTPException as e:
             if e.status_code == 404:
-                raise HTTPException(status_code=404, detail=f"文件不存在: {filename}")
+                raise HTTPException(status_code=404, detail=f"文件不存在: {file_path.name}")
             raise
-        
-        # 转换为DataFrame
-        if not data or len(data) == 0:
-            raise HTTPException(status_code=400, detail="文件数据为空")
-        
-        # 检查是否是单值文件
-        if 'value' in data and len(data) == 1:
-            # 单值文件
-            df = pd.DataFrame([{'函数名': filename.replace('.json', ''), '值': data['value']}])
-        else:
-            # 多值文件
-            years = sorted(data.keys())
-            all_countries = set()
-            for year_data in data.values():
-                if isinstance(year_data, dict):
-                    all_countries.update(year_data.keys())
-            
-            all_countries = sorted(list(all_countries))
-            
-            rows = []
-            for year in years:
-                row = {'年份': year}
-                if isinstance(data[year], dict):
-                    for country in all_countries:
-                        row[country] = data[year].get(country, None)
-                rows.append(row)
-            
-            df = pd.DataFrame(rows)
-        
-        # 创建Excel文件
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='数据')
-        
-        output.seek(0)
-        
-        return StreamingResponse(
-            output,
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename.replace('.json', '')}.xlsx"
-            }
-        )
+    if not data or len(data) == 0:
+        raise HTTPException(status_code=400, detail="文件数据为空")
+    return data
+
+
+def export_file(file_path: Path, fmt: str = "xlsx", years: Optional[str] = None, countries: Optional[str] = None):
+    """把一个JSON数据文件流式导出为Excel/CSV/Parquet，可只导出部分年份（可包含范围，如2018-2019）和国家（逗号分隔）"""
+    if fmt not in table_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {fmt}（可选 {', '.join(table_export.FORMATS)}）")
+    if fmt == "parquet" and not table_export.parquet_available():
+        raise HTTPException(status_code=400, detail="导出Parquet需要安装pyarrow")
     
-    except HTTPException:
-        raise
-    except Exception as e:
-        import traceback
-        error_detail = traceback.format_exc()
-        print(f"导出Excel错误: {error_detail}")
-        raise HTTPException(status_code=500, detail=f"导出Excel失败: {str(e)}")
+    data = _read_export_data(file_path)
+    extension, media_type = table_export.FORMATS[fmt]
+    return StreamingResponse(
+        table_export.stream(fmt, file_path.stem, data, _parse_year_keys(years), _split_param(countries)),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={file_path.stem}.{extension}"}
+    )
+
+
+@app.get("/api/output/workbook/export")
+def export_output_workbook(years: Optional[str] = None, countries: Optional[str] = None):
+    """把所有output文件导出为一个Excel工作簿，每个指标一个工作表（逐个读取文件，逐行写入；需定义在 /api/output/{filename}/export 之前）"""
+    files = [output_file(filename) for filename in output_filenames()]
+    if not files:
+        raise HTTPException(status_code=404, detail="没有可导出的计算结果")
+    year_list, country_list = _parse_year_keys(years), _split_param(countries)
+    
+    def sheets():
+        for file_path in files:
+            try:
+                data = read_json_file(file_path)
+            except HTTPException as e:
+                print(f"警告: 导出时跳过 {file_path.name}: {e.detail}")
+                continue
+            if data:
+                header, rows = table_export.table(file_path.stem, data, year_list, country_list)
+                yield file_path.stem, header, rows
+    
+    return StreamingResponse(
+        table_export.stream_xlsx(sheets()),
+        media_type=table_export.FORMATS["xlsx"][1],
+        headers={"Content-Disposition": "attachment; filename=output.xlsx"}
+    )
+
+
+@app.get("/api/jsondata/{filename}/export-excel")
+def export_jsondata_to_excel(filename: str, years: Optional[str] = None, countries: Optional[str] = None):
+    """导出单个jsondata文件为Excel"""
+    return export_file(JSONDATA_DIR / filename, "xlsx", years, countries)
+
+
+@app.get("/api/output/{filename}/export-excel")
+def export_output_to_excel(filename: str, years: Optional[str] = None, countries: Optional[str] = None):
+    """导出单个output文件为Excel"""
+    return export_file(output_file(filename), "xlsx", years, countries)
+
+
+@app.get("/api/jsondata/{filename}/export")
+def export_jsondata(filename: str, format: str = "xlsx", years: Optional[str] = None, countries: Optional[str] = None):
+    """导出单个jsondata文件（format: xlsx / csv / parquet）"""
+    return export_file(JSONDATA_DIR / filename, format, years, countries)
+
+
+@app.get("/api/output/{filename}/export")
+def export_output(filename: str, format: str = "xlsx", years: Optional[str] = None, countries: Optional[str] = None):
+    """导出单个output文件（format: xlsx / csv / parquet）"""
+    return export_file(output_file(filename), format, years, countries)
 
 
 if __name__ == "__main__":
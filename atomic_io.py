@@ -0,0 +1,131 @@
+# 文件的原子写入与历史版本
+# 新内容先写入同目录下的临时文件并fsync，再用os.replace原子替换目标文件，写入中途崩溃不会留下损坏的文件；
+# 替换前把旧文件按字节复制为.bak，原来的.bak移入历史目录，每个文件保留最近若干个历史版本。
+import os
+import shutil
+import tempfile
+
+import metrics
+
+# 每个文件保留的历史版本数（不含.bak），为0时只保留.bak
+HISTORY_SIZE = 5
+
+# 历史版本目录名（位于被写文件所在目录下）
+HISTORY_DIR = ".history"
+
+
+def _fsync_dir(directory):
+    """把目录项的变化（新建、重命名）写入磁盘"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, data, fsync=True):
+    """
+    原子写入文件：data为str（按UTF-8编码）或bytes。
+    fsync为False时不等待写入磁盘（仍保证其他进程读到的是完整的旧文件或新文件）。
+    """
+    path = os.fspath(path)
+    directory = os.path.dirname(path) or '.'
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    if fsync:
+        _fsync_dir(directory)
+    metrics.record_write(path, len(data))
+
+
+def backup_path(path):
+    """文件的最近一次备份：<文件名>.bak"""
+    return os.fspath(path) + '.bak'
+
+
+def history_dir(path):
+    return os.path.join(os.path.dirname(os.fspath(path)) or '.', HISTORY_DIR)
+
+
+def history_versions(path):
+    """文件的历史版本路径，从旧到新排列（不含.bak）"""
+    name = os.path.basename(os.fspath(path))
+    directory = history_dir(path)
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return []
+    versions = []
+    for entry in entries:
+        # 历史版本命名为 <文件名>.<版本时间(纳秒)>
+        prefix, _, stamp = entry.rpartition('.')
+        if prefix == name and stamp.isdigit():
+            versions.append((int(stamp), os.path.join(directory, entry)))
+    return [p for _, p in sorted(versions)]
+
+
+def _rotate_history(path, history):
+    """把现有的.bak移入历史目录，历史版本超过history个时删除最旧的"""
+    bak = backup_path(path)
+    if not os.path.exists(bak):
+        return
+    if history <= 0:
+        return
+    directory = history_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    stamp = os.stat(bak).st_mtime_ns
+    target = os.path.join(directory, f"{os.path.basename(os.fspath(path))}.{stamp}")
+    while os.path.exists(target):
+        stamp += 1
+        target = os.path.join(directory, f"{os.path.basename(os.fspath(path))}.{stamp}")
+    os.replace(bak, target)
+    for old in history_versions(path)[:-history]:
+        try:
+            os.unlink(old)
+        except OSError:
+            pass
+
+
+def backup(path, history=HISTORY_SIZE, fsync=True):
+    """
+    备份现有文件：原来的.bak移入历史目录，再把文件按字节复制为新的.bak（保留修改时间，先写临时文件再替换）。
+    文件不存在时不做任何事。
+    """
+    path = os.fspath(path)
+    if not os.path.exists(path):
+        return
+    _rotate_history(path, history)
+    bak = backup_path(path)
+    tmp_path = bak + '.tmp'
+    shutil.copy2(path, tmp_path)
+    if fsync:
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, bak)
+
+
+def write_with_backup(path, data, history=HISTORY_SIZE):
+    """备份现有文件后原子写入新内容；备份失败只打印警告，不影响写入"""
+    try:
+        backup(path, history)
+    except Exception as e:
+        print(f"警告: 创建备份失败 {path}: {e}")
+    atomic_write(path, data)
@@ -0,0 +1,493 @@
+# 性能基准测试
+# 按与jsondata相同的结构生成指定规模（年份数×国家数）的合成数据，在临时目录中运行（不读写项目的jsondata、output和cache），
+# 分别计时：数据加载（reload_data_cache后首次读取JSON / 列式存储）、每个指标、各引擎的batch_calculate_and_save，
+# 以及通过TestClient调用的主要API接口。结果写成JSON报告（记录提交号和环境），
+# 可与之前提交的报告比较，变慢超过阈值的项目记为性能回归（退出码1）。
+#
+# python benchmark.py run [--sizes 29x9,60x100] [--engines cell,vectorized,process] [--repeat 3] [--output 报告.json] [--compare 基准报告.json]
+# python benchmark.py compare 基准报告.json 新报告.json [--threshold 0.2]
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import calculate
+import columnar_store
+import result_store
+from jobs import COMPLETED, FINISHED_STATES
+
+# 报告格式版本（格式变化时递增，不同版本的报告不能比较）
+REPORT_VERSION = 1
+
+# 默认测试规模：年份数×国家数（第一个与当前jsondata相当）
+DEFAULT_SIZES = "29x9,60x100"
+
+# 默认测试的计算引擎
+DEFAULT_ENGINES = "cell,vectorized,process"
+
+# 每项计时的重复次数（报告中取中位数）
+DEFAULT_REPEAT = 3
+
+# 默认回归阈值：比基准慢20%以上
+DEFAULT_THRESHOLD = 0.2
+
+# 低于该差值（秒）的变化视为噪声，不记为回归
+DEFAULT_MIN_DELTA = 0.005
+
+# 合成数据中scientist、retraction缺失值（null）的比例
+DEFAULT_MISSING = 0.05
+
+# 合成数据的起始年份
+FIRST_YEAR = 1996
+
+# 默认报告目录
+REPORT_DIR = "benchmarks"
+
+# 项目目录（临时目录中运行时用于查询git提交号）
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ==================== 合成数据 ====================
+def parse_size(text):
+    """'29x9' -> (29, 9)"""
+    try:
+        years, countries = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"规模格式应为 年份数x国家数: {text}")
+    if years < 2 or countries < 1:
+        raise ValueError(f"至少需要2个年份和1个国家: {text}")
+    return years, countries
+
+
+def _panel(years, countries, matrix, missing=None):
+    """(年份数×国家数) 矩阵 -> 年份->国家->值，missing为缺失位置的布尔矩阵"""
+    result = {}
+    for i, year in enumerate(years):
+        row = {}
+        for j, country in enumerate(countries):
+            value = matrix[i, j].item()
+            row[country] = None if missing is not None and missing[i, j] else value
+        result[year] = row
+    return result
+
+
+def generate_datasets(n_years, n_countries, seed=0, missing=DEFAULT_MISSING):
+    """
+    生成一套合成数据：数据键 -> 内容，结构和取值范围与jsondata相同
+    （年份->国家->值 面板、world_total的世界合计、weight权重）。相同参数生成的数据相同。
+    """
+    rng = np.random.default_rng(seed)
+    years = [str(FIRST_YEAR + i) for i in range(n_years)]
+    countries = [f"C{j:04d}" for j in range(n_countries)]
+    shape = (n_years, n_countries)
+
+    # 发文总量按国家规模和逐年增长生成
+    scale = rng.lognormal(11, 1.2, n_countries)
+    growth = np.cumprod(rng.uniform(1.0, 1.08, shape), axis=0)
+    total = np.maximum(1, scale * growth).round().astype(np.int64)
+    oa = (total * rng.uniform(0.1, 0.6, shape)).round().astype(np.int64)
+    cooperation = (total * rng.uniform(0.1, 0.5, shape)).round().astype(np.int64)
+    scientist = rng.integers(1, 3000, shape)
+    retraction = rng.integers(0, 200, shape)
+
+    datasets = {
+        "total": _panel(years, countries, total),
+        "OA": _panel(years, countries, oa),
+        "cooperation": _panel(years, countries, cooperation),
+        "FWCI": _panel(years, countries, rng.uniform(0.5, 1.6, shape).round(2)),
+        "F2": _panel(years, countries, rng.uniform(1, 4, shape).round(2)),
+        "F3": _panel(years, countries, rng.uniform(0.4, 1.2, shape)),
+        "OP": _panel(years, countries, rng.uniform(0.2, 0.9, shape).round(2)),
+        "alpha_L": _panel(years, countries, rng.uniform(0.9, 1.1, shape)),
+        "alpha_F": _panel(years, countries, rng.uniform(0.9, 1.1, shape)),
+        "alpha_I": _panel(years, countries, rng.uniform(0.9, 1.1, shape)),
+        "scientist": _panel(years, countries, scientist, rng.random(shape) < missing),
+        "retraction": _panel(years, countries, retraction, rng.random(shape) < missing),
+        "world_total": {
+            year: {
+                "world_oa_total": int(oa[i].sum() * 2),
+                "world_total": int(total[i].sum() * 2),
+                "world_retraction": None,
+                "word_scientist": int(scientist[i].sum() * 2),
+            }
+            for i, year in enumerate(years)
+        },
+        "weight": {"W_OA": 0.4, "W_OD": 0.4, "W_OP": 0.2},
+    }
+    return datasets
+
+
+def write_datasets(directory, datasets):
+    """按calculate.json_files中的文件名写入目录（格式与jsondata中的文件相同）"""
+    for key, path in calculate.json_files.items():
+        target = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'w', encoding='utf-8') as f:
+            json.dump(datasets[key], f, ensure_ascii=False, indent=2)
+
+
+@contextlib.contextmanager
+def workspace(n_years, n_countries, seed=0, missing=DEFAULT_MISSING):
+    """在临时目录中生成合成数据并切换工作目录（jsondata、output、cache均为相对路径），结束后删除"""
+    directory = tempfile.mkdtemp(prefix="pdq-bench-")
+    previous = os.getcwd()
+    try:
+        write_datasets(directory, generate_datasets(n_years, n_countries, seed, missing))
+        os.chdir(directory)
+        calculate.reload_data_cache()
+        yield directory
+    finally:
+        os.chdir(previous)
+        calculate.reload_data_cache()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# ==================== 计时 ====================
+@contextlib.contextmanager
+def quiet():
+    """屏蔽被测函数的进度输出"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def summarize(samples):
+    """多次运行的耗时（秒）-> {"median", "min", "max", "runs"}"""
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "runs": len(samples),
+    }
+
+
+def measure(func, repeat, setup=None):
+    """运行func repeat次（每次之前调用setup，不计时），返回耗时统计"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def _clear_caches():
+    """丢弃已读取的数据和计算结果缓存，并关闭持久化缓存，保证每次都是完整计算"""
+    result_store.ENABLED = False
+    calculate.reload_data_cache()
+
+
+def _remove_columnar_store():
+    shutil.rmtree(columnar_store.STORE_DIR, ignore_errors=True)
+    calculate.reload_data_cache()
+
+
+def bench_loading(repeat):
+    """数据加载：reload_data_cache本身、首次读取JSON（同时生成列式存储）、从列式存储读取"""
+    def load():
+        calculate.preload_datasets()
+    return {
+        "reload.reload_data_cache": measure(calculate.reload_data_cache, repeat),
+        "reload.load_json": measure(load, repeat, setup=_remove_columnar_store),
+        "reload.load_columnar": measure(load, repeat, setup=calculate.reload_data_cache),
+    }
+
+
+def bench_indicators(repeat):
+    """
+    逐个指标计时：单线程按拓扑顺序计算全部指标（关闭持久化缓存），
+    每个指标从开始到完成的时间由进度回调记录（包括写出输出文件）。
+    """
+    samples = {}
+
+    def run():
+        started = {}
+
+        def progress(name, done, total):
+            if done == 0:
+                started[name] = time.perf_counter()
+            elif done == total:
+                samples.setdefault(name, []).append(time.perf_counter() - started[name])
+        with quiet():
+            calculate.run_indicator_graph(max_workers=1, progress=progress)
+
+    for _ in range(repeat):
+        _clear_caches()
+        calculate.preload_datasets()
+        run()
+    return {f"indicator.{name}": summarize(samples[name]) for name in calculate.topological_order() if name in samples}
+
+
+def bench_batch(engines, repeat):
+    """各引擎batch_calculate_and_save端到端计时（关闭持久化缓存），以及持久化缓存全部命中时的逐单元引擎"""
+    timings = {}
+    for engine in engines:
+        def run(engine=engine):
+            with quiet():
+                calculate.batch_calculate_and_save(engine=engine)
+        timings[f"batch.{engine}"] = measure(run, repeat, setup=_clear_caches)
+
+    def warm_store():
+        result_store.ENABLED = True
+        with quiet():
+            calculate.batch_calculate_and_save()
+        calculate.reload_data_cache()
+
+    def run_cached():
+        with quiet():
+            calculate.batch_calculate_and_save()
+    warm_store()
+    timings["batch.cell_store_hit"] = measure(run_cached, repeat, setup=calculate.reload_data_cache)
+    result_store.ENABLED = False
+    return timings
+
+
+def _wait_for_job(client, job_id, timeout=600):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/calculate/jobs/{job_id}").json()
+        if job["status"] in FINISHED_STATES:
+            return job
+        time.sleep(0.01)
+    raise TimeoutError(f"计算任务超时: {job_id}")
+
+
+def bench_api(repeat):
+    """通过TestClient调用主要API接口（完成一次批量计算后执行，output中已有结果）"""
+    from fastapi.testclient import TestClient
+    import api
+    import response_cache
+
+    years, countries = calculate.get_batch_axes()
+    last_year = str(years[-1])
+    sample_cells = [{"year": str(y), "country": c} for y in years[-2:] for c in countries[:5]]
+    timings = {}
+
+    with TestClient(api.app) as client, quiet():
+        def request(method, url, expected=200, **kwargs):
+            def call():
+                response = client.request(method, url, **kwargs)
+                if response.status_code != expected:
+                    raise RuntimeError(f"{method} {url} 返回 {response.status_code}: {response.text[:200]}")
+                return response
+            return call
+
+        def case(name, func, setup=None):
+            timings[f"api.{name}"] = measure(func, repeat, setup=setup)
+
+        def batch_via_api():
+            job_id = client.post("/api/calculate/batch", params={"engine": "vectorized"}).json()["job_id"]
+            job = _wait_for_job(client, job_id)
+            if job["status"] != COMPLETED:
+                raise RuntimeError(f"计算任务失败: {job['message']}")
+
+        etag = request("GET", "/api/jsondata/total.json")().headers["etag"]
+        toggle = iter(range(10 ** 9))
+
+        case("GET /api/jsondata/files", request("GET", "/api/jsondata/files"))
+        case("GET /api/jsondata/{file} (cold)", request("GET", "/api/jsondata/total.json"),
+             setup=response_cache.invalidate)
+        case("GET /api/jsondata/{file} (cached)", request("GET", "/api/jsondata/total.json"))
+        case("GET /api/jsondata/{file} (gzip)",
+             request("GET", "/api/jsondata/total.json", headers={"Accept-Encoding": "gzip"}))
+        case("GET /api/jsondata/{file} (304)",
+             request("GET", "/api/jsondata/total.json", 304, headers={"If-None-Match": etag}))
+        case("GET /api/output/{file} (cold)", request("GET", "/api/output/R.json"), setup=response_cache.invalidate)
+        case("GET /api/results/query", request("GET", "/api/results/query", params={"indicators": "R,R_oa,R_od"}))
+        case("GET /api/results/query (columnar)",
+             request("GET", "/api/results/query", params={"indicators": "R,R_oa,R_od", "format": "columnar"}))
+        case("POST /api/results/compute",
+             request("POST", "/api/results/compute", json={"indicator": "R", "cells": sample_cells}))
+        case("POST /api/scenarios/weights (grid 0.05)",
+             request("POST", "/api/scenarios/weights", json={"grid_step": 0.05, "keep": 10}))
+        case("PATCH /api/jsondata/{file}",
+             lambda: request("PATCH", "/api/jsondata/OP.json", json={
+                 "cells": [{"year": last_year, "country": countries[0], "value": 0.5 + next(toggle) % 2 * 0.1}]
+             })())
+        case("GET /api/output/{file}/export (csv)", request("GET", "/api/output/R.json/export", params={"format": "csv"}))
+        case("GET /api/output/{file}/export (xlsx)", request("GET", "/api/output/R.json/export", params={"format": "xlsx"}))
+        case("GET /api/jsondata/{file}/export (xlsx)",
+             request("GET", "/api/jsondata/total.json/export", params={"format": "xlsx"}))
+        case("POST /api/calculate/batch (vectorized)", batch_via_api, setup=_clear_caches)
+    return timings
+
+
+def run_size(n_years, n_countries, engines, repeat, seed=0, include_api=True):
+    """在一个规模上运行全部基准测试，返回该规模的报告条目"""
+    with workspace(n_years, n_countries, seed):
+        timings = {}
+        timings.update(bench_loading(repeat))
+        timings.update(bench_indicators(repeat))
+        timings.update(bench_batch(engines, repeat))
+        if include_api:
+            # API接口读取的是逐单元引擎的输出
+            _clear_caches()
+            with quiet():
+                calculate.batch_calculate_and_save()
+            timings.update(bench_api(repeat))
+    return {
+        "size": f"{n_years}x{n_countries}",
+        "years": n_years,
+        "countries": n_countries,
+        "cells": n_years * n_countries,
+        "timings": timings,
+    }
+
+
+# ==================== 报告 ====================
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """报告中记录的提交号和运行环境"""
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run(sizes, engines, repeat, seed=0, include_api=True):
+    """运行所有规模，返回报告"""
+    report = {
+        "version": REPORT_VERSION,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "settings": {"engines": list(engines), "repeat": repeat, "seed": seed},
+        "results": [],
+    }
+    for n_years, n_countries in sizes:
+        print(f"基准测试: {n_years}年 × {n_countries}国家")
+        entry = run_size(n_years, n_countries, engines, repeat, seed, include_api)
+        for name, timing in entry["timings"].items():
+            print(f"  {name:<48} {timing['median'] * 1000:10.2f} ms")
+        report["results"].append(entry)
+    return report
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, min_delta=DEFAULT_MIN_DELTA):
+    """
+    按规模和计时项比较两份报告的中位数耗时。
+    返回 [{"size", "name", "baseline", "current", "ratio", "regression"}]；
+    current比baseline慢threshold以上（且差值超过min_delta秒）时regression为True。只比较两份报告都有的项目。
+    """
+    if baseline.get("version") != current.get("version"):
+        raise ValueError(f"报告格式版本不同: {baseline.get('version')} / {current.get('version')}")
+    base_sizes = {entry["size"]: entry["timings"] for entry in baseline["results"]}
+    rows = []
+    for entry in current["results"]:
+        base_timings = base_sizes.get(entry["size"])
+        if base_timings is None:
+            continue
+        for name, timing in entry["timings"].items():
+            if name not in base_timings:
+                continue
+            old, new = base_timings[name]["median"], timing["median"]
+            ratio = new / old if old > 0 else float("inf")
+            rows.append({
+                "size": entry["size"],
+                "name": name,
+                "baseline": old,
+                "current": new,
+                "ratio": ratio,
+                "regression": ratio > 1 + threshold and new - old > min_delta,
+            })
+    return rows
+
+
+def print_comparison(rows, baseline, current):
+    def commit(report):
+        return (report["environment"].get("commit") or "unknown")[:10]
+    print(f"基准: {commit(baseline)}  当前: {commit(current)}")
+    for row in rows:
+        mark = "✗ 回归" if row["regression"] else ""
+        print(f"  [{row['size']}] {row['name']:<48} {row['baseline'] * 1000:10.2f} ms -> "
+              f"{row['current'] * 1000:10.2f} ms  ({row['ratio']:.2f}x) {mark}")
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        print(f"✗ {len(regressions)}项性能回归")
+    else:
+        print("✓ 没有性能回归")
+    return regressions
+
+
+def _load_report(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _default_output(report):
+    commit = (report["environment"].get("commit") or "unknown")[:10]
+    if report["environment"].get("dirty"):
+        commit += "-dirty"
+    return os.path.join(PROJECT_DIR, REPORT_DIR, f"{commit}.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDQ计算和API的性能基准测试")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="运行基准测试并写出报告")
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="逗号分隔的 年份数x国家数")
+    run_parser.add_argument("--engines", default=DEFAULT_ENGINES, help="逗号分隔的批量计算引擎")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="每项计时的重复次数")
+    run_parser.add_argument("--seed", type=int, default=0, help="合成数据的随机种子")
+    run_parser.add_argument("--no-api", action="store_true", help="不测试API接口")
+    run_parser.add_argument("--output", help=f"报告路径（默认 {REPORT_DIR}/<提交号>.json）")
+    run_parser.add_argument("--compare", help="与该基准报告比较，有回归时退出码为1")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="回归阈值（0.2表示慢20%%）")
+    run_parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA, help="忽略小于该秒数的变化")
+
+    compare_parser = commands.add_parser("compare", help="比较两份报告")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA)
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        baseline, current = _load_report(args.baseline), _load_report(args.current)
+    else:
+        engines = [engine for engine in args.engines.split(",") if engine]
+        unknown = [engine for engine in engines if engine not in ("cell", "vectorized", "process")]
+        if unknown:
+            parser.error(f"不支持的计算引擎: {', '.join(unknown)}")
+        try:
+            sizes = [parse_size(size) for size in args.sizes.split(",") if size]
+        except ValueError as e:
+            parser.error(str(e))
+        current = run(sizes, engines, args.repeat, args.seed, include_api=not args.no_api)
+        output = args.output or _default_output(current)
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"✓ 报告已写入 {output}")
+        if not args.compare:
+            return 0
+        baseline = _load_report(args.compare)
+
+    regressions = print_comparison(compare(baseline, current, args.threshold, args.min_delta), baseline, current)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,18 @@
 import json
 import os
 import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from functools import lru_cache
+from contextlib import contextmanager
+from collections.abc import Mapping
+
+import result_store
+import columnar_store
+import atomic_io
+import metrics
+import result_artifact
 
 # 读取所有json文件存储到字典中
 json_files = {
@@ -22,75 +33,412 @@ json_files = {
     "F3": "jsondata/F3.json"
 }
 
-# ==================== 数据预加载和缓存 ====================
-# 预加载所有JSON文件到内存
-_data_cache = {}
+# ==================== 数据快照和缓存 ====================
+# 已加载的数据和在其上计算的结果缓存组成一个快照。快照发布后数据不再修改，
+# 修改数据时总是生成新版本的快照再整体替换，计算开始时固定使用当时的快照，
+# 因此计算过程中修改数据不会让一次计算混用新旧数据，读取方也无需加锁。
+# 数据集在第一次访问时才读取，导入本模块不读取任何文件。
+def _file_stamp(path):
+    """文件的修改时间和大小，用于发现外部修改；文件不存在返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
-# 缓存计算结果
-_cache = {
-    'constants': {},  # 单值函数的结果
-    'functions': {}    # 多参数函数的结果
-}
+class LazyDatasets(Mapping):
+    """数据键 -> 数据集，每个数据集第一次访问时才读取，之后保持不变"""
 
-def reload_data_cache():
-    """重新加载所有JSON文件到内存（当文件被修改后调用）"""
-    global _data_cache, _cache
-    _data_cache = {}
-    for key, path in json_files.items():
+    def __init__(self, paths, entries=None):
+        self._paths = paths                 # 数据键 -> 文件路径
+        self._entries = dict(entries or {}) # 数据键 -> (数据, 内容哈希, 读取时的文件修改时间和大小)
+        self._lock = threading.Lock()
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            if key not in self._paths:
+                raise KeyError(key)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    path = self._paths[key]
+                    # 先记录文件状态再读取，读取期间文件被修改时下次检查会重新加载
+                    stamp = _file_stamp(path)
+                    start = time.perf_counter()
+                    data, content_hash = _load_dataset(path)
+                    source = "columnar" if isinstance(data, columnar_store.ColumnarDataset) else "json"
+                    metrics.observe("pdq_dataset_load_seconds", time.perf_counter() - start, dataset=key, source=source)
+                    entry = self._entries[key] = (data, content_hash, stamp)
+        return entry
+
+    def __getitem__(self, key):
+        return self._entry(key)[0]
+
+    def __contains__(self, key):
+        return key in self._paths or key in self._entries
+
+    def __iter__(self):
+        yield from self._paths
+        yield from (key for key in self._entries if key not in self._paths)
+
+    def __len__(self):
+        return len(set(self._paths) | set(self._entries))
+
+    def hash_of(self, key):
+        """数据集的内容哈希（未读取时先读取）"""
+        return self._entry(key)[1]
+
+    def is_loaded(self, key):
+        return key in self._entries
+
+    def loaded(self):
+        """已读取的数据集 {数据键: 数据}"""
+        return {key: entry[0] for key, entry in self._entries.items()}
+
+    def changed_keys(self):
+        """已读取、但文件在读取后被修改过的数据键"""
+        return [key for key, entry in list(self._entries.items())
+                if key in self._paths and _file_stamp(self._paths[key]) != entry[2]]
+
+    def derive(self, drop=(), replace=None):
+        """生成新的数据集集合：沿用已读取的数据集，drop中的重新读取，replace中的直接替换"""
+        entries = {key: entry for key, entry in self._entries.items() if key not in drop}
+        entries.update(replace or {})
+        return LazyDatasets(self._paths, entries)
+
+class DataSnapshot:
+    """某一版本的输入数据及其计算结果缓存"""
+
+    def __init__(self, version, data, cache=None):
+        self.version = version
+        self.data = data        # LazyDatasets：数据键 -> 年份->国家->值，发布后只读
+        # 计算结果缓存：'constants' 单值函数的结果；'functions' 多参数函数的结果
+        self.cache = cache if cache is not None else {'constants': {}, 'functions': {}}
+        self.created_at = time.time()
+        self._digest = None
+
+    @property
+    def digest(self):
+        """所有数据集内容哈希的摘要（会读取全部数据集）"""
+        if self._digest is None:
+            self._digest = result_store.hash_data(sorted((key, self.data.hash_of(key)) for key in self.data))
+        return self._digest
+
+    def info(self):
+        return {"version": self.version, "digest": self.digest, "created_at": self.created_at}
+
+# 当前发布的快照
+_snapshot = DataSnapshot(0, LazyDatasets(json_files))
+
+# 生成新快照时持有，保证修改数据的操作依次进行（读取不加锁）
+_snapshot_lock = threading.RLock()
+
+# 各线程当前固定使用的快照
+_local = threading.local()
+
+# 各输出文件由哪个版本的数据计算得到：{指标名: 快照版本}
+_output_versions = {}
+
+# 自上次写出结果以来失效、需要重新输出的指标；None表示全部
+_stale_indicators = None
+
+def get_snapshot():
+    """返回当前发布的数据快照"""
+    return _snapshot
+
+def _active_snapshot():
+    """当前线程正在使用的快照：计算中为计算开始时固定的快照，否则为当前发布的快照"""
+    return getattr(_local, 'snapshot', None) or _snapshot
+
+def _data():
+    """当前线程使用的数据：数据键 -> 年份->国家->值"""
+    return _active_snapshot().data
+
+def _results():
+    """当前线程使用的计算结果缓存"""
+    return _active_snapshot().cache
+
+@contextmanager
+def pin_snapshot(snapshot=None):
+    """在with块内固定使用一个快照（默认当前发布的快照），块内的计算只读取该快照的数据"""
+    previous = getattr(_local, 'snapshot', None)
+    _local.snapshot = snapshot or previous or _snapshot
+    try:
+        yield _local.snapshot
+    finally:
+        _local.snapshot = previous
+
+@contextmanager
+def outputs_disabled():
+    """在with块内（当前线程）不写出计算结果，save_to_json直接返回；计算结果仍写入缓存"""
+    previous = getattr(_local, 'outputs_disabled', False)
+    _local.outputs_disabled = True
+    try:
+        yield
+    finally:
+        _local.outputs_disabled = previous
+
+def _run_pinned(snapshot, staging, func, *args):
+    """在线程池中使用指定快照执行func，登记的结果加入提交线程的暂存（见result_artifact.deferred）"""
+    with pin_snapshot(snapshot), result_artifact.deferred(staging):
+        return func(*args)
+
+def _publish_snapshot(data, cache):
+    """发布新版本的快照（调用方持有_snapshot_lock）"""
+    global _snapshot
+    _snapshot = DataSnapshot(_snapshot.version + 1, data, cache)
+    return _snapshot
+
+def get_data_version():
+    """
+    当前数据版本及各输出文件由哪个版本的数据计算得到（本进程写出的输出）。
+    输入未变化的指标不会重新计算，其输出版本可以早于当前版本；outputs_current表示没有待重新计算的指标。
+    """
+    return {
+        "data_version": _snapshot.info(),
+        "outputs": dict(_output_versions),
+        "outputs_current": not get_stale_indicators(),
+    }
+
+def _load_json_file(path):
+    """读取单个JSON数据文件，格式错误时尝试从.bak备份恢复，失败返回空字典"""
+    try:
+        if not os.path.exists(path):
+            print(f"警告: 文件不存在，跳过: {path}")
+            return {}
+        # 尝试读取文件
         try:
-            if not os.path.exists(path):
-                print(f"警告: 文件不存在，跳过: {path}")
-                _data_cache[key] = {}
-                continue
-            # 尝试读取文件
-            try:
-                with open(path, 'r', encoding='utf-8') as f:
-                    _data_cache[key] = json.load(f)
-            except json.JSONDecodeError as e:
-                # JSON格式错误，尝试从备份恢复
-                backup_path = path + '.bak'
-                if os.path.exists(backup_path):
-                    print(f"警告: {path} JSON格式错误，尝试从备份恢复...")
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            metrics.record_read(path, os.path.getsize(path))
+            return data
+        except json.JSONDecodeError as e:
+            # JSON格式错误，尝试从备份恢复
+            backup_path = path + '.bak'
+            if os.path.exists(backup_path):
+                print(f"警告: {path} JSON格式错误，尝试从备份恢复...")
+                try:
+                    with open(backup_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    # 尝试修复原文件
                     try:
-                        with open(backup_path, 'r', encoding='utf-8') as f:
-                            data = json.load(f)
-                        _data_cache[key] = data
-                        # 尝试修复原文件
-                        try:
-                            with open(path, 'w', encoding='utf-8') as wf:
-                                json.dump(data, wf, ensure_ascii=False, indent=2)
-                            print(f"      ✓ 已从备份恢复并修复文件: {path}")
-                        except:
-                            print(f"      已从备份恢复数据，但无法修复文件")
-                    except Exception as restore_error:
-                        print(f"      ✗ 从备份恢复失败: {str(restore_error)}")
-                        _data_cache[key] = {}
-                else:
-                    print(f"错误: JSON文件格式错误且无备份 {path}: {str(e)}")
-                    _data_cache[key] = {}
+                        atomic_io.atomic_write(path, json.dumps(data, ensure_ascii=False, indent=2))
+                        print(f"      ✓ 已从备份恢复并修复文件: {path}")
+                    except:
+                        print(f"      已从备份恢复数据，但无法修复文件")
+                    return data
+                except Exception as restore_error:
+                    print(f"      ✗ 从备份恢复失败: {str(restore_error)}")
+                    return {}
+            else:
+                print(f"错误: JSON文件格式错误且无备份 {path}: {str(e)}")
+                return {}
+    except Exception as e:
+        print(f"错误: 读取文件失败 {path}: {str(e)}")
+        return {}
+
+def _load_dataset(path):
+    """
+    读取一个数据集，返回 (数据, 内容哈希)。
+    列式存储与JSON文件一致时直接内存映射打开；否则读取JSON，并重建列式存储供下次使用。
+    """
+    data = columnar_store.load(path)
+    if data is not None:
+        return data, columnar_store.content_hash(data)
+    # 读取前记录源文件状态：读取期间文件被改写时存储不会被当作与新文件一致
+    source = columnar_store._source_stamp(path)
+    data = _load_json_file(path)
+    content_hash = result_store.hash_data(data)
+    if columnar_store.ENABLED and data and source is not None:
+        try:
+            columnar_store.save(path, data, content_hash, source)
         except Exception as e:
-            print(f"错误: 读取文件失败 {path}: {str(e)}")
-            _data_cache[key] = {}
-    # 清空计算结果缓存，因为数据已更新
-    _cache = {
-        'constants': {},
-        'functions': {}
-    }
+            print(f"警告: 写入列式存储失败 {path}: {e}")
+    return data, content_hash
+
+def reload_data_cache():
+    """丢弃所有已读取的数据并发布新快照（数据集在下次访问时重新读取），计算结果缓存清空"""
+    global _stale_indicators
+    with metrics.timer("pdq_reload_seconds", operation="reload_data_cache"), _snapshot_lock:
+        _publish_snapshot(LazyDatasets(json_files), None)
+        _stale_indicators = None
+
+def get_dataset(key):
+    """返回当前快照中的数据集（年份->国家->值 映射，只读；列式存储的数据集可用columnar_store.to_dict转换为字典），未知的键返回None"""
+    return _snapshot.data.get(key)
+
+def preload_datasets(keys=None):
+    """读取当前线程所用快照中的数据集（默认全部），返回该快照"""
+    snapshot = _active_snapshot()
+    for key in (keys if keys is not None else list(snapshot.data)):
+        snapshot.data[key]
+    return snapshot
+
+def _preload_inputs(names):
+    """读取这些指标及其上游指标用到的全部数据集。计算开始前调用，保证一次计算读到的是同一时刻的文件"""
+    keys = {key for name in get_indicator_ancestors(names) for key in INDICATORS[name]['inputs']}
+    preload_datasets(sorted(keys | {'total'}))
+
+def refresh_changed_datasets():
+    """
+    检查已读取的数据文件是否在外部被修改（修改时间或大小变化），被修改的文件重新读取并使依赖它的指标失效。
+    返回失效的指标列表（拓扑顺序）。
+    """
+    with metrics.timer("pdq_reload_seconds", operation="refresh_changed_datasets"):
+        keys = _snapshot.data.changed_keys()
+        for key in keys:
+            print(f"检测到数据文件被修改，重新加载: {json_files[key]}")
+        return reload_data_files(keys)
 
-# 初始加载
-reload_data_cache()
+def data_key_for_filename(filename):
+    """根据jsondata文件名（如"OP.json"）返回对应的数据键，不参与计算的文件返回None"""
+    for key, path in json_files.items():
+        if os.path.basename(path) == filename:
+            return key
+    return None
+
+def reload_data_file(key):
+    """
+    只重新加载一个数据文件，并仅清除依赖它的指标缓存（其他指标链保持缓存）。
+    返回被清除的指标列表。
+    """
+    return reload_data_files([key])
+
+def reload_data_files(keys):
+    """
+    重新加载多个数据文件，只发布一次新快照并清除依赖这些文件的指标缓存。
+    返回被清除的指标列表（拓扑顺序）。
+    """
+    keys = list(keys)
+    if not keys:
+        return []
+    with metrics.timer("pdq_reload_seconds", operation="reload_data_files"), _snapshot_lock:
+        base = _snapshot
+        data = base.data.derive(drop=keys)
+        
+        affected = get_dependent_indicators(keys)
+        # total的年份或国家发生变化时，所有输出文件的行列都会变化；旧数据未读取过时无法比较，按全部变化处理
+        if 'total' in keys:
+            if not base.data.is_loaded('total') or _axes_of(data['total']) != _axes_of(base.data['total']):
+                affected = set(INDICATORS)
+        
+        # 新快照沿用不受影响的指标缓存（这些指标在新旧数据上的结果相同）
+        cache = {
+            'constants': {k: v for k, v in base.cache['constants'].items() if k not in affected},
+            'functions': {k: v for k, v in base.cache['functions'].items() if k not in affected},
+        }
+        _publish_snapshot(data, cache)
+        if _stale_indicators is not None:
+            _stale_indicators.update(affected)
+    return [name for name in topological_order() if name in affected]
 
-# 输出文件夹
+def _axes_of(data_total):
+    """total数据的年份和首年国家，用于判断批量输出的行列是否变化"""
+    years = sorted(data_total.keys(), key=int)
+    countries = list(data_total[years[0]].keys()) if years else []
+    return years, countries
+
+def invalidate_indicators(names):
+    """清除当前快照中指定指标的计算缓存"""
+    cache = _results()
+    for name in names:
+        cache['functions'].pop(name, None)
+        cache['constants'].pop(name, None)
+
+def mark_indicators_fresh(names):
+    """标记这些指标的输出文件已是最新；使用的快照已被新数据取代时不标记（输出仍需重新计算）"""
+    global _stale_indicators
+    if _active_snapshot() is not _snapshot:
+        return
+    if _stale_indicators is None:
+        _stale_indicators = set(INDICATORS)
+    _stale_indicators.difference_update(names)
+
+def mark_indicators_stale(names):
+    """把这些指标重新标记为需要输出（计算被取消或失败时调用）"""
+    if _stale_indicators is not None:
+        _stale_indicators.update(names)
+
+def get_stale_indicators():
+    """返回需要重新输出的指标（按拓扑顺序）"""
+    if _stale_indicators is None:
+        return topological_order()
+    return [name for name in topological_order() if name in _stale_indicators]
+
+# 输出文件夹（第一次写出结果时创建）
 _output_dir = "output"
-os.makedirs(_output_dir, exist_ok=True)
+
+def results_path():
+    """结果文件路径（所有指标的输出保存在这一个文件中，见result_artifact）"""
+    return os.path.join(_output_dir, result_artifact.FILENAME)
 
 def save_to_json(func_name, data):
-    """保存计算结果到JSON文件"""
+    """
+    保存计算结果并记录结果对应的数据版本：写入结果文件（批量计算中暂存，计算结束时一次写出），
+    旧格式的output/<指标>.json在请求时才生成（result_artifact.WRITE_LEGACY为True时同时立即写出）；
+    在outputs_disabled()中时不写出
+    """
+    if getattr(_local, 'outputs_disabled', False):
+        return
+    version = _active_snapshot().version
+    result_artifact.stage(results_path(), func_name, data, version)
+    if result_artifact.WRITE_LEGACY:
+        os.makedirs(_output_dir, exist_ok=True)
+        output_path = os.path.join(_output_dir, f"{func_name}.json")
+        atomic_io.atomic_write(output_path, json.dumps(data, ensure_ascii=False, indent=2), fsync=False)
+    _output_versions[func_name] = version
+
+def materialize_output(func_name):
+    """
+    按需从结果文件生成旧格式的输出文件 output/<指标>.json（已是最新时不重写），返回文件路径；
+    结果文件中没有该指标时沿用已有的文件，都没有返回None
+    """
     output_path = os.path.join(_output_dir, f"{func_name}.json")
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    if result_artifact.materialize(results_path(), func_name, output_path):
+        return output_path
+    return None
+
+def output_names():
+    """结果文件中已保存的指标"""
+    artifact = result_artifact.open_artifact(results_path())
+    return artifact.names() if artifact is not None else []
 
 # ==================== 辅助函数 ====================
+# 缓存未命中标记，用于区分"未缓存"和"缓存的结果为None"
+_MISS = object()
+
+# 缓存命中统计：{函数名: {'hits': 命中次数, 'misses': 未命中次数}}
+_cache_stats = {}
+_cache_stats_lock = threading.Lock()
+
+def _record_cache_access(func_name, hit):
+    """记录一次缓存访问"""
+    with _cache_stats_lock:
+        stats = _cache_stats.get(func_name)
+        if stats is None:
+            stats = _cache_stats[func_name] = {'hits': 0, 'misses': 0}
+        stats['hits' if hit else 'misses'] += 1
+
+def get_cache_stats():
+    """返回各函数的缓存命中/未命中次数"""
+    return {name: dict(stats) for name, stats in _cache_stats.items()}
+
+def reset_cache_stats():
+    """清空缓存命中统计"""
+    _cache_stats.clear()
+
+@metrics.register_collector
+def _collect_metrics():
+    """导出运行指标时读取缓存命中统计、数据版本和待重新计算的指标数"""
+    samples = []
+    for name, stats in get_cache_stats().items():
+        samples.append(("pdq_cache_hits_total", {"function": name}, stats['hits']))
+        samples.append(("pdq_cache_misses_total", {"function": name}, stats['misses']))
+    samples.append(("pdq_data_version", {}, _snapshot.version))
+    samples.append(("pdq_stale_indicators", {}, len(get_stale_indicators())))
+    return samples
+
 def get_cache_key(func_name, *args):
     """生成缓存key"""
     if args:
@@ -98,32 +446,31 @@ def get_cache_key(func_name, *args):
     return func_name
 
 def get_from_cache(func_name, *args):
-    """从缓存获取值"""
-    key = get_cache_key(func_name, *args)
+    """从缓存获取值，未缓存时返回_MISS（结果为None的缓存项会返回None，不再重复计算）"""
     if args:
         year_str = str(args[0])
         country = args[1]
-        if func_name in _cache['functions']:
-            if year_str in _cache['functions'][func_name]:
-                if country in _cache['functions'][func_name][year_str]:
-                    return _cache['functions'][func_name][year_str][country]
+        year_cache = _results()['functions'].get(func_name, {}).get(year_str)
+        if year_cache is not None and country in year_cache:
+            _record_cache_access(func_name, True)
+            return year_cache[country]
     else:
-        if func_name in _cache['constants']:
-            return _cache['constants'][func_name]
-    return None
+        if func_name in _results()['constants']:
+            _record_cache_access(func_name, True)
+            return _results()['constants'][func_name]
+    _record_cache_access(func_name, False)
+    return _MISS
 
 def set_cache(func_name, value, *args):
     """设置缓存值"""
     if args:
         year_str = str(args[0])
         country = args[1]
-        if func_name not in _cache['functions']:
-            _cache['functions'][func_name] = {}
-        if year_str not in _cache['functions'][func_name]:
-            _cache['functions'][func_name][year_str] = {}
-        _cache['functions'][func_name][year_str][country] = value
+        # setdefault保证并发计算不同指标时不会互相覆盖子字典
+        func_cache = _results()['functions'].setdefault(func_name, {})
+        func_cache.setdefault(year_str, {})[country] = value
     else:
-        _cache['constants'][func_name] = value
+        _results()['constants'][func_name] = value
 
 # ==================== 基础函数 ====================
 # 计算R_op_bar的函数
@@ -134,11 +481,11 @@ def R_op_bar(year, country):
     '''
     # 检查缓存
     cached = get_from_cache('R_op_bar', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data = _data_cache['OP']
+    data = _data()['OP']
     result = data[year_str][country] / max(data[year_str].values())
     
     set_cache('R_op_bar', result, year, country)
@@ -147,11 +494,12 @@ def R_op_bar(year, country):
 # 2
 def r_open_t1():
     '''计算r_open_t1'''
-    if 'r_open_t1' in _cache['constants']:
-        return _cache['constants']['r_open_t1']
+    cached = get_from_cache('r_open_t1')
+    if cached is not _MISS:
+        return cached
     
-    data_oa = _data_cache['OA']
-    data_total = _data_cache['total']
+    data_oa = _data()['OA']
+    data_total = _data()['total']
     
     years = sorted([int(y) for y in data_oa.keys()])
     year_avg_ratios = []
@@ -179,7 +527,7 @@ def r_open_t1():
     else:
         result = max(year_avg_ratios, key=lambda x: x[1])[1]
     
-    _cache['constants']['r_open_t1'] = result
+    set_cache('r_open_t1', result)
     save_to_json('r_open_t1', {"value": result})
     return result
 
@@ -187,11 +535,11 @@ def r_open_t1():
 def r_open_t(year, country):
     '''公式：该年该国家的OA/该年该国家的total'''
     cached = get_from_cache('r_open_t', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
-    data_oa = _data_cache['OA']
-    data_total = _data_cache['total']
+    data_oa = _data()['OA']
+    data_total = _data()['total']
     year_str = str(year)
 
     if year_str not in data_oa or year_str not in data_total:
@@ -213,10 +561,11 @@ def r_open_t(year, country):
 # 4
 def P_open_t1():
     '''计算P_open_t1'''
-    if 'P_open_t1' in _cache['constants']:
-        return _cache['constants']['P_open_t1']
+    cached = get_from_cache('P_open_t1')
+    if cached is not _MISS:
+        return cached
     
-    data_oa = _data_cache['OA']
+    data_oa = _data()['OA']
     years = sorted([int(y) for y in data_oa.keys()])
     year_avg_ratios = []
     
@@ -233,7 +582,7 @@ def P_open_t1():
     
     result = max(year_avg_ratios) if year_avg_ratios else None
     
-    _cache['constants']['P_open_t1'] = result
+    set_cache('P_open_t1', result)
     save_to_json('P_open_t1', {"value": result})
     return result
 
@@ -241,11 +590,11 @@ def P_open_t1():
 def P_open_t(year, country):
     '''计算P_open_t'''
     cached = get_from_cache('P_open_t', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_oa = _data_cache['OA']
+    data_oa = _data()['OA']
     result = data_oa[year_str][country]
     
     set_cache('P_open_t', result, year, country)
@@ -255,7 +604,7 @@ def P_open_t(year, country):
 def R_open(year, country):
     '''计算R_open'''
     cached = get_from_cache('R_open', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     r_open_t_value = r_open_t(year, country)
@@ -277,12 +626,12 @@ def R_open(year, country):
 def r_incl_t(year, country):
     '''计算r_incl_t'''
     cached = get_from_cache('r_incl_t', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_cooperation = _data_cache['cooperation']
-    data_total = _data_cache['total']
+    data_cooperation = _data()['cooperation']
+    data_total = _data()['total']
     result = data_cooperation[year_str][country] / data_total[year_str][country]
     
     set_cache('r_incl_t', result, year, country)
@@ -291,11 +640,12 @@ def r_incl_t(year, country):
 # 7
 def r_incl_t1():
     '''计算r_incl_t1'''
-    if 'r_incl_t1' in _cache['constants']:
-        return _cache['constants']['r_incl_t1']
+    cached = get_from_cache('r_incl_t1')
+    if cached is not _MISS:
+        return cached
     
-    data_cooperation = _data_cache['cooperation']
-    data_total = _data_cache['total']
+    data_cooperation = _data()['cooperation']
+    data_total = _data()['total']
     
     years = sorted([int(y) for y in data_cooperation.keys()])
     year_avg_ratios = []
@@ -325,7 +675,7 @@ def r_incl_t1():
     
     result = max(year_avg_ratios) if year_avg_ratios else None
     
-    _cache['constants']['r_incl_t1'] = result
+    set_cache('r_incl_t1', result)
     save_to_json('r_incl_t1', {"value": result})
     return result
 
@@ -333,11 +683,11 @@ def r_incl_t1():
 def P_incl_t(year, country):
     '''计算P_incl_t'''
     cached = get_from_cache('P_incl_t', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_cooperation = _data_cache['cooperation']
+    data_cooperation = _data()['cooperation']
     result = data_cooperation[year_str][country]
     
     set_cache('P_incl_t', result, year, country)
@@ -346,10 +696,11 @@ def P_incl_t(year, country):
 # 9
 def P_incl_t1():
     '''计算P_incl_t1'''
-    if 'P_incl_t1' in _cache['constants']:
-        return _cache['constants']['P_incl_t1']
+    cached = get_from_cache('P_incl_t1')
+    if cached is not _MISS:
+        return cached
     
-    data_cooperation = _data_cache['cooperation']
+    data_cooperation = _data()['cooperation']
     years = sorted([int(y) for y in data_cooperation.keys()])
     year_avg_values = []
     
@@ -368,7 +719,7 @@ def P_incl_t1():
     
     result = max(year_avg_values) if year_avg_values else None
     
-    _cache['constants']['P_incl_t1'] = result
+    set_cache('P_incl_t1', result)
     save_to_json('P_incl_t1', {"value": result})
     return result
 
@@ -376,7 +727,7 @@ def P_incl_t1():
 def R_incl(year, country):
     '''计算R_incl'''
     cached = get_from_cache('R_incl', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     r_incl_t_value = r_incl_t(year, country)
@@ -398,7 +749,7 @@ def R_incl(year, country):
 def R_oa(year, country):
     '''计算R_oa'''
     cached = get_from_cache('R_oa', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     R_open_value = R_open(year, country)
@@ -412,40 +763,43 @@ def R_oa(year, country):
     set_cache('R_oa', result, year, country)
     return result
 
+# 计算R_oa_bar的归一化分母
+def R_oa_bar_max_of_max():
+    '''计算R_oa的历年最大值'''
+    cached = get_from_cache('R_oa_bar_max_of_max')
+    if cached is not _MISS:
+        return cached
+    
+    data_oa = _data()['OA']
+    years = sorted([int(y) for y in data_oa.keys()])
+    year_max_R_oa = []
+    
+    for y in years:
+        year_str = str(y)
+        countries = list(data_oa[year_str].keys())
+        
+        country_R_oa_values = []
+        for c in countries:
+            r_oa_val = R_oa(y, c)
+            if r_oa_val is not None:
+                country_R_oa_values.append(r_oa_val)
+        
+        if country_R_oa_values:
+            max_R_oa = max(country_R_oa_values)
+            year_max_R_oa.append(max_R_oa)
+    
+    max_of_max = max(year_max_R_oa) if year_max_R_oa else None
+    set_cache('R_oa_bar_max_of_max', max_of_max)
+    return max_of_max
+
 # 计算R_oa_bar的函数
 def R_oa_bar(year, country):
     '''计算R_oa_bar'''
     cached = get_from_cache('R_oa_bar', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
-    # 检查是否有缓存的历年最大值
-    cache_key_max = 'R_oa_bar_max_of_max'
-    if cache_key_max in _cache['constants']:
-        max_of_max = _cache['constants'][cache_key_max]
-    else:
-        # 计算历年最大值
-        data_oa = _data_cache['OA']
-        years = sorted([int(y) for y in data_oa.keys()])
-        year_max_R_oa = []
-        
-        for y in years:
-            year_str = str(y)
-            countries = list(data_oa[year_str].keys())
-            
-            country_R_oa_values = []
-            for c in countries:
-                r_oa_val = R_oa(y, c)
-                if r_oa_val is not None:
-                    country_R_oa_values.append(r_oa_val)
-            
-            if country_R_oa_values:
-                max_R_oa = max(country_R_oa_values)
-                year_max_R_oa.append(max_R_oa)
-        
-        max_of_max = max(year_max_R_oa) if year_max_R_oa else None
-        _cache['constants'][cache_key_max] = max_of_max
-    
+    max_of_max = R_oa_bar_max_of_max()
     R_oa_current = R_oa(year, country)
     
     if R_oa_current is None or max_of_max is None or max_of_max == 0:
@@ -460,13 +814,13 @@ def R_oa_bar(year, country):
 def f1(year, country):
     '''计算f1'''
     cached = get_from_cache('f1', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_int = int(year) if isinstance(year, str) else year
     year_str = str(year)
     
-    data_fwci = _data_cache['FWCI']
+    data_fwci = _data()['FWCI']
     
     if year_str not in data_fwci or country not in data_fwci[year_str]:
         result = None
@@ -478,8 +832,8 @@ def f1(year, country):
         elif year_int < 2014:
             result = fwci_value
         else:
-            data_scientist = _data_cache['scientist']
-            data_world_total = _data_cache['world_total']
+            data_scientist = _data()['scientist']
+            data_world_total = _data()['world_total']
             
             if year_str not in data_scientist or country not in data_scientist[year_str]:
                 result = None
@@ -514,11 +868,11 @@ def f1(year, country):
 def f2(year, country):
     '''计算f2'''
     cached = get_from_cache('f2', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_f2 = _data_cache['F2']
+    data_f2 = _data()['F2']
     result = data_f2[year_str][country] / 4
     
     set_cache('f2', result, year, country)
@@ -528,11 +882,11 @@ def f2(year, country):
 def f3(year, country):
     '''计算f3'''
     cached = get_from_cache('f3', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_f3 = _data_cache['F3']
+    data_f3 = _data()['F3']
     result = data_f3[year_str][country]
     
     set_cache('f3', result, year, country)
@@ -542,7 +896,7 @@ def f3(year, country):
 def S_od_t(year, country):
     '''计算S_od_t'''
     cached = get_from_cache('S_od_t', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
@@ -556,7 +910,7 @@ def S_od_t(year, country):
     else:
         avg_f = (f1_value + f2_value + f3_value) / 3
         
-        data_total = _data_cache['total']
+        data_total = _data()['total']
         
         if year_str not in data_total or country not in data_total[year_str]:
             result = None
@@ -574,10 +928,11 @@ def S_od_t(year, country):
 # 14
 def S_od_t1():
     '''计算S_od_t1'''
-    if 'S_od_t1' in _cache['constants']:
-        return _cache['constants']['S_od_t1']
+    cached = get_from_cache('S_od_t1')
+    if cached is not _MISS:
+        return cached
     
-    data_total = _data_cache['total']
+    data_total = _data()['total']
     years = sorted([int(y) for y in data_total.keys()])
     year_avg_values = []
     
@@ -601,7 +956,7 @@ def S_od_t1():
     
     result = max(year_avg_values) if year_avg_values else None
     
-    _cache['constants']['S_od_t1'] = result
+    set_cache('S_od_t1', result)
     save_to_json('S_od_t1', {"value": result})
     return result
 
@@ -609,14 +964,14 @@ def S_od_t1():
 def A_od_t(year, country):
     '''计算A_od_t'''
     cached = get_from_cache('A_od_t', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_world_total = _data_cache['world_total']
-    data_alpha_L = _data_cache['alpha_L']
-    data_alpha_F = _data_cache['alpha_F']
-    data_alpha_I = _data_cache['alpha_I']
+    data_world_total = _data()['world_total']
+    data_alpha_L = _data()['alpha_L']
+    data_alpha_F = _data()['alpha_F']
+    data_alpha_I = _data()['alpha_I']
     
     result = data_world_total[year_str]['world_oa_total'] * \
              data_alpha_L[year_str][country] * \
@@ -629,17 +984,18 @@ def A_od_t(year, country):
 # 16
 def A_od_t1():
     '''计算A_od_t1'''
-    if 'A_od_t1' in _cache['constants']:
-        return _cache['constants']['A_od_t1']
+    cached = get_from_cache('A_od_t1')
+    if cached is not _MISS:
+        return cached
     
-    data_world_total = _data_cache['world_total']
+    data_world_total = _data()['world_total']
     years = sorted([int(y) for y in data_world_total.keys()])
     
     if not years:
         result = None
     else:
         first_year = str(years[0])
-        data_alpha_L = _data_cache['alpha_L']
+        data_alpha_L = _data()['alpha_L']
         
         if first_year not in data_alpha_L:
             result = None
@@ -669,7 +1025,7 @@ def A_od_t1():
             
             result = max(year_avg_values) if year_avg_values else None
     
-    _cache['constants']['A_od_t1'] = result
+    set_cache('A_od_t1', result)
     save_to_json('A_od_t1', {"value": result})
     return result
 
@@ -677,7 +1033,7 @@ def A_od_t1():
 def R_od(year, country):
     '''计算R_od'''
     cached = get_from_cache('R_od', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     S_od_t_value = S_od_t(year, country)
@@ -696,40 +1052,43 @@ def R_od(year, country):
     set_cache('R_od', result, year, country)
     return result
 
+# 计算R_od_bar的归一化分母
+def R_od_bar_max_of_max():
+    '''计算R_od的历年最大值'''
+    cached = get_from_cache('R_od_bar_max_of_max')
+    if cached is not _MISS:
+        return cached
+    
+    data_total = _data()['total']
+    years = sorted([int(y) for y in data_total.keys()])
+    year_max_R_od = []
+    
+    for y in years:
+        year_str = str(y)
+        countries = list(data_total[year_str].keys())
+        
+        country_R_od_values = []
+        for c in countries:
+            r_od_val = R_od(y, c)
+            if r_od_val is not None:
+                country_R_od_values.append(r_od_val)
+        
+        if country_R_od_values:
+            max_R_od = max(country_R_od_values)
+            year_max_R_od.append(max_R_od)
+    
+    max_of_max = max(year_max_R_od) if year_max_R_od else None
+    set_cache('R_od_bar_max_of_max', max_of_max)
+    return max_of_max
+
 # 计算R_od_bar的函数
 def R_od_bar(year, country):
     '''计算R_od_bar'''
     cached = get_from_cache('R_od_bar', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
-    # 检查是否有缓存的历年最大值
-    cache_key_max = 'R_od_bar_max_of_max'
-    if cache_key_max in _cache['constants']:
-        max_of_max = _cache['constants'][cache_key_max]
-    else:
-        # 计算历年最大值
-        data_total = _data_cache['total']
-        years = sorted([int(y) for y in data_total.keys()])
-        year_max_R_od = []
-        
-        for y in years:
-            year_str = str(y)
-            countries = list(data_total[year_str].keys())
-            
-            country_R_od_values = []
-            for c in countries:
-                r_od_val = R_od(y, c)
-                if r_od_val is not None:
-                    country_R_od_values.append(r_od_val)
-            
-            if country_R_od_values:
-                max_R_od = max(country_R_od_values)
-                year_max_R_od.append(max_R_od)
-        
-        max_of_max = max(year_max_R_od) if year_max_R_od else None
-        _cache['constants'][cache_key_max] = max_of_max
-    
+    max_of_max = R_od_bar_max_of_max()
     R_od_current = R_od(year, country)
     
     if R_od_current is None or max_of_max is None or max_of_max == 0:
@@ -743,11 +1102,11 @@ def R_od_bar(year, country):
 def R(year, country):
     '''计算R'''
     cached = get_from_cache('R', year, country)
-    if cached is not None:
+    if cached is not _MISS:
         return cached
     
     year_str = str(year)
-    data_weight = _data_cache['weight']
+    data_weight = _data()['weight']
     R_oa_bar_value = R_oa_bar(year, country)
     R_od_bar_value = R_od_bar(year, country)
     R_op_bar_value = R_op_bar(year, country)
@@ -762,59 +1121,754 @@ def R(year, country):
     set_cache('R', result, year, country)
     return result
 
-# ==================== 批量计算和保存函数 ====================
-def batch_calculate_and_save():
-    """批量计算所有函数的所有(year, country)组合，并保存到JSON文件"""
-    # 获取所有年份和国家
-    data_total = _data_cache['total']
+# ==================== 指标依赖图 ====================
+class CalculationCancelled(Exception):
+    """批量计算被取消（由进度回调抛出）"""
+
+def _report_progress(progress, func_name, done, total):
+    """
+    报告计算进度：progress(func_name, done, total)，done/total为该指标已完成/总单元格数。
+    回调可以抛出CalculationCancelled来中止计算。
+    """
+    if progress is not None:
+        progress(func_name, done, total)
+
+
+# 每个指标登记其计算函数、读取的jsondata键和直接依赖的上游指标
+# kind: "cell" 按(year, country)逐单元计算并输出文件；"constant" 单值函数（save为False时不输出文件）
+# row_inputs: 单元格会用到同一年所有国家（或world_total该年）数据的输入，其中任一单元变化时整年需重算
+INDICATORS = {
+    'r_open_t':  {'func': r_open_t,  'kind': 'cell',     'inputs': ['OA', 'total'], 'deps': []},
+    'P_open_t':  {'func': P_open_t,  'kind': 'cell',     'inputs': ['OA'], 'deps': []},
+    'r_open_t1': {'func': r_open_t1, 'kind': 'constant', 'inputs': ['OA', 'total'], 'deps': []},
+    'P_open_t1': {'func': P_open_t1, 'kind': 'constant', 'inputs': ['OA'], 'deps': []},
+    'R_open':    {'func': R_open,    'kind': 'cell',     'inputs': [],
+                  'deps': ['r_open_t', 'P_open_t', 'r_open_t1', 'P_open_t1']},
+    'r_incl_t':  {'func': r_incl_t,  'kind': 'cell',     'inputs': ['cooperation', 'total'], 'deps': []},
+    'P_incl_t':  {'func': P_incl_t,  'kind': 'cell',     'inputs': ['cooperation'], 'deps': []},
+    'r_incl_t1': {'func': r_incl_t1, 'kind': 'constant', 'inputs': ['cooperation', 'total'], 'deps': []},
+    'P_incl_t1': {'func': P_incl_t1, 'kind': 'constant', 'inputs': ['cooperation'], 'deps': []},
+    'R_incl':    {'func': R_incl,    'kind': 'cell',     'inputs': [],
+                  'deps': ['r_incl_t', 'P_incl_t', 'r_incl_t1', 'P_incl_t1']},
+    'R_oa':      {'func': R_oa,      'kind': 'cell',     'inputs': [], 'deps': ['R_open', 'R_incl']},
+    'R_oa_bar_max_of_max': {'func': R_oa_bar_max_of_max, 'kind': 'constant', 'inputs': ['OA'], 'deps': ['R_oa'],
+                            'save': False},
+    'R_oa_bar':  {'func': R_oa_bar,  'kind': 'cell',     'inputs': [], 'deps': ['R_oa', 'R_oa_bar_max_of_max']},
+    'f1':        {'func': f1,        'kind': 'cell',     'inputs': ['FWCI', 'scientist', 'world_total'], 'deps': [],
+                  'row_inputs': ['scientist', 'world_total']},
+    'f2':        {'func': f2,        'kind': 'cell',     'inputs': ['F2'], 'deps': []},
+    'f3':        {'func': f3,        'kind': 'cell',     'inputs': ['F3'], 'deps': []},
+    'S_od_t':    {'func': S_od_t,    'kind': 'cell',     'inputs': ['total'], 'deps': ['f1', 'f2', 'f3']},
+    'S_od_t1':   {'func': S_od_t1,   'kind': 'constant', 'inputs': ['total'], 'deps': ['S_od_t']},
+    'A_od_t':    {'func': A_od_t,    'kind': 'cell',     'inputs': ['world_total', 'alpha_L', 'alpha_F', 'alpha_I'],
+                  'deps': [], 'row_inputs': ['world_total']},
+    'A_od_t1':   {'func': A_od_t1,   'kind': 'constant', 'inputs': ['world_total', 'alpha_L'], 'deps': ['A_od_t']},
+    'R_od':      {'func': R_od,      'kind': 'cell',     'inputs': [],
+                  'deps': ['S_od_t', 'A_od_t', 'S_od_t1', 'A_od_t1']},
+    'R_od_bar_max_of_max': {'func': R_od_bar_max_of_max, 'kind': 'constant', 'inputs': ['total'], 'deps': ['R_od'],
+                            'save': False},
+    'R_od_bar':  {'func': R_od_bar,  'kind': 'cell',     'inputs': [], 'deps': ['R_od', 'R_od_bar_max_of_max']},
+    'R_op_bar':  {'func': R_op_bar,  'kind': 'cell',     'inputs': ['OP'], 'deps': [], 'row_inputs': ['OP']},
+    'R':         {'func': R,         'kind': 'cell',     'inputs': ['weight'],
+                  'deps': ['R_oa_bar', 'R_od_bar', 'R_op_bar']},
+}
+
+def get_indicator_ancestors(targets):
+    """返回目标指标及其所有上游指标的集合"""
+    result = set()
+    stack = list(targets)
+    while stack:
+        name = stack.pop()
+        if name not in INDICATORS:
+            raise KeyError(f"未知指标: {name}")
+        if name in result:
+            continue
+        result.add(name)
+        stack.extend(INDICATORS[name]['deps'])
+    return result
+
+def get_dependent_indicators(keys):
+    """返回直接或间接依赖给定jsondata键的所有指标"""
+    keys = set(keys)
+    result = {name for name, info in INDICATORS.items() if keys & set(info['inputs'])}
+    changed = True
+    while changed:
+        changed = False
+        for name, info in INDICATORS.items():
+            if name not in result and result & set(info['deps']):
+                result.add(name)
+                changed = True
+    return result
+
+def topological_order(names=None):
+    """对指标依赖图做拓扑排序（同层按INDICATORS中的登记顺序），检测到环时抛出ValueError"""
+    if names is None:
+        names = set(INDICATORS)
+    pending = {name: set(INDICATORS[name]['deps']) & names for name in INDICATORS if name in names}
+    order = []
+    while pending:
+        ready = [name for name, deps in pending.items() if not deps]
+        if not ready:
+            raise ValueError(f"指标依赖图存在环: {sorted(pending)}")
+        for name in ready:
+            order.append(name)
+            del pending[name]
+        for deps in pending.values():
+            deps.difference_update(ready)
+    return order
+
+def get_batch_axes():
+    """批量计算使用的年份（整数）和国家列表：total中的所有年份 × total首年的国家"""
+    data_total = _data()['total']
     years = sorted([int(y) for y in data_total.keys()])
     countries = list(data_total[str(years[0])].keys())
-    
-    print(f"开始批量计算: {len(years)}年 × {len(countries)}国家 = {len(years) * len(countries)}个组合")
-    
-    # 需要计算的函数列表（按依赖顺序）
-    functions_to_calculate = [
-        ('r_open_t', r_open_t),
-        ('P_open_t', P_open_t),
-        ('R_open', R_open),
-        ('r_incl_t', r_incl_t),
-        ('P_incl_t', P_incl_t),
-        ('R_incl', R_incl),
-        ('R_oa', R_oa),
-        ('f1', f1),
-        ('f2', f2),
-        ('f3', f3),
-        ('S_od_t', S_od_t),
-        ('A_od_t', A_od_t),
-        ('R_od', R_od),
-        ('R_oa_bar', R_oa_bar),
-        ('R_od_bar', R_od_bar),
-        ('R_op_bar', R_op_bar),
-        ('R', R),
-    ]
-    
-    # 计算每个函数的所有组合
-    for func_name, func in functions_to_calculate:
-        print(f"计算 {func_name}...")
-        results = {}
+    return years, countries
+
+def get_indicator_input_hash(func_name):
+    """指标的输入哈希：其所有上游指标读取的数据集内容哈希 + 批量输出的年份和国家"""
+    keys = sorted({key for name in get_indicator_ancestors([func_name]) for key in INDICATORS[name]['inputs']})
+    years, countries = get_batch_axes()
+    material = json.dumps(
+        [result_store.CACHE_VERSION, func_name, [[key, _active_snapshot().data.hash_of(key)] for key in keys], years, countries],
+        ensure_ascii=False
+    )
+    return result_store.hash_data(material)
+
+def _restore_cell_cache(func_name, stored):
+    """
+    把持久化缓存中的逐单元指标写入内存缓存，返回与输出文件相同的结果；
+    抛出异常的单元格不写入缓存（与逐单元路径一样，再次读取时重新计算并抛出异常）
+    """
+    failed = {tuple(cell) for cell in stored["failed"]}
+    _results()['functions'][func_name] = {
+        year: {c: value for c, value in row.items() if (year, c) not in failed}
+        for year, row in stored["results"].items()
+    }
+    return stored["results"]
+
+def _load_persisted_indicator(func_name):
+    """从持久化缓存读取指标结果并写入内存缓存和输出文件，命中返回True"""
+    info = INDICATORS[func_name]
+    found, value = result_store.load(func_name, get_indicator_input_hash(func_name))
+    if not found:
+        return False
+    if info['kind'] == 'constant':
+        _results()['constants'][func_name] = value
+        if info.get('save', True):
+            save_to_json(func_name, {"value": value})
+    else:
+        save_to_json(func_name, _restore_cell_cache(func_name, value))
+    return True
+
+def persist_indicator(func_name):
+    """
+    把内存缓存中的指标结果写入持久化缓存（抛出异常的常量不保存）。
+    逐单元指标保存 {"results": 输出结果, "failed": 抛出异常的[年份, 国家]}：
+    抛出异常的单元格不在内存缓存中，输出结果中为None
+    """
+    info = INDICATORS[func_name]
+    if info['kind'] == 'constant':
+        if func_name not in _results()['constants']:
+            return
+        value = _results()['constants'][func_name]
+    else:
+        years, countries = get_batch_axes()
+        func_cache = _results()['functions'].get(func_name, {})
+        value = {
+            "results": {str(y): {c: func_cache.get(str(y), {}).get(c) for c in countries} for y in years},
+            "failed": [[str(y), c] for y in years for c in countries if c not in func_cache.get(str(y), {})],
+        }
+    result_store.store(func_name, get_indicator_input_hash(func_name), value)
+
+def get_batch_plan(names):
+    """批量计算的进度计划：[(指标名, 单元格数)]，单值指标计为1"""
+    years, countries = get_batch_axes()
+    cells = len(years) * len(countries)
+    return [(name, cells if INDICATORS[name]['kind'] == 'cell' else 1) for name in topological_order(set(names))]
+
+def get_indicator_result(func_name):
+    """
+    读取本次运行中已计算完成的指标结果（与输出文件内容相同），用于在批量计算过程中逐指标推送结果。
+    尚未计算时返回None。
+    """
+    if INDICATORS[func_name]['kind'] == 'constant':
+        if func_name not in _results()['constants']:
+            return None
+        return {"value": _results()['constants'][func_name]}
+    func_cache = _results()['functions'].get(func_name)
+    if func_cache is None:
+        return None
+    years, countries = get_batch_axes()
+    return {
+        str(year): {country: func_cache.get(str(year), {}).get(country) for country in countries}
+        for year in years
+    }
+
+def saved_indicators():
+    """会写出输出文件的指标（拓扑顺序）"""
+    return [name for name in topological_order() if INDICATORS[name].get('save', True)]
+
+def _cached_slice(func_name, years, countries):
+    """从内存缓存读取指标的一个切片，缺少任一单元格时返回_MISS"""
+    if INDICATORS[func_name]['kind'] == 'constant':
+        constants = _results()['constants']
+        return constants[func_name] if func_name in constants else _MISS
+    func_cache = _results()['functions'].get(func_name)
+    if func_cache is None:
+        return _MISS
+    result = {}
+    for year in years:
+        year_cache = func_cache.get(str(year))
+        if year_cache is None:
+            return _MISS
+        row = result[str(year)] = {}
+        for country in countries:
+            if country not in year_cache:
+                return _MISS
+            row[country] = year_cache[country]
+    return result
+
+def _warm_from_store(func_name):
+    """从持久化缓存读取指标结果写入内存缓存（不写输出文件），命中返回True"""
+    found, value = result_store.load(func_name, get_indicator_input_hash(func_name))
+    if not found:
+        return False
+    if INDICATORS[func_name]['kind'] == 'constant':
+        _results()['constants'][func_name] = value
+    else:
+        _restore_cell_cache(func_name, value)
+    return True
+
+def _read_output(func_name):
+    """读取已保存的指标结果：优先从结果文件读取，没有时读取旧格式的输出文件；都没有返回None"""
+    artifact = result_artifact.open_artifact(results_path())
+    if artifact is not None and func_name in artifact:
+        return artifact.get(func_name)
+    try:
+        with open(os.path.join(_output_dir, f"{func_name}.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _read_output_slice(func_name, years, countries):
+    """从已保存的结果读取指标切片（可能不是当前数据的结果），没有时返回None"""
+    data = _read_output(func_name)
+    if data is None:
+        return None
+    if INDICATORS[func_name]['kind'] == 'constant':
+        return data.get("value")
+    return {str(y): {c: data.get(str(y), {}).get(c) for c in countries} for y in years}
+
+def query_results(names=None, years=None, countries=None):
+    """
+    读取指标结果的切片：names为指标名（默认全部输出指标），years/countries默认为批量计算的全部年份和国家
+    （不在批量计算范围内的年份和国家忽略）。
+    结果依次从内存缓存、持久化缓存读取，都没有时读取输出文件（此时该指标列入stale，结果可能不是当前数据的）。
+    返回 {"years", "countries", "values": {指标名: 年份->国家->值 或 单值}, "stale": [...], "data_version"}。
+    """
+    with pin_snapshot() as snapshot:
+        _preload_inputs(names or saved_indicators())
+        batch_years, batch_countries = get_batch_axes()
+        if years is not None:
+            wanted = {int(y) for y in years}
+            batch_years = [y for y in batch_years if y in wanted]
+        if countries is not None:
+            wanted = set(countries)
+            batch_countries = [c for c in batch_countries if c in wanted]
         
-        for year in years:
-            year_str = str(year)
-            results[year_str] = {}
+        values = {}
+        stale = []
+        for name in (names or saved_indicators()):
+            if name not in INDICATORS:
+                raise KeyError(f"未知指标: {name}")
+            value = _cached_slice(name, batch_years, batch_countries)
+            if value is _MISS and _warm_from_store(name):
+                value = _cached_slice(name, batch_years, batch_countries)
+            if value is _MISS:
+                value = _read_output_slice(name, batch_years, batch_countries)
+                stale.append(name)
+            values[name] = value
+        return {
+            "years": [str(y) for y in batch_years],
+            "countries": batch_countries,
+            "values": values,
+            "stale": stale,
+            "data_version": snapshot.version,
+        }
+
+def _cell_component(func_name, year, country):
+    """已计算的中间结果：逐单元指标取该单元格的值，单值指标取常量；尚未计算时返回None"""
+    if INDICATORS[func_name]['kind'] == 'constant':
+        return _results()['constants'].get(func_name)
+    return _results()['functions'].get(func_name, {}).get(str(year), {}).get(country)
+
+def compute_cells(func_name, cells, components=True):
+    """
+    按需计算指标在若干 (年份, 国家) 上的值：沿函数链只计算所需的上游指标和全局归一化常量，
+    结果写入当前快照的缓存，之后的请求直接命中；内存中没有的上游指标先尝试从持久化缓存读取。
+    不写出任何输出（计算的常量在之后的批量计算中写出）。
+    返回 {"results": [{"year", "country", "value", "components": {上游指标: 值}}], "data_version"}，
+    计算出错的单元格带error字段；单值指标的cells为 [(None, None)]。
+    """
+    if func_name not in INDICATORS:
+        raise KeyError(f"未知指标: {func_name}")
+    info = INDICATORS[func_name]
+    ancestors = topological_order(get_indicator_ancestors([func_name]))
+    with pin_snapshot() as snapshot, outputs_disabled():
+        _preload_inputs([func_name])
+        for name in ancestors:
+            in_memory = name in (_results()['constants'] if INDICATORS[name]['kind'] == 'constant' else _results()['functions'])
+            if not in_memory:
+                _warm_from_store(name)
+        
+        results = []
+        for year, country in cells:
+            entry = {"year": None if year is None else str(year), "country": country}
+            try:
+                entry["value"] = info['func']() if info['kind'] == 'constant' else info['func'](int(year), country)
+            except Exception as e:
+                entry["value"] = None
+                entry["error"] = f"{type(e).__name__}: {e}"
+            if components:
+                entry["components"] = {
+                    name: _cell_component(name, year, country) for name in ancestors if name != func_name
+                }
+            results.append(entry)
+        return {"results": results, "data_version": snapshot.version}
+
+def _run_indicator(func_name, years, countries, progress=None):
+    """计算一个指标节点：逐单元指标计算所有组合并保存，单值指标直接调用；持久化缓存命中时直接复用"""
+    info = INDICATORS[func_name]
+    func = info['func']
+    total = len(years) * len(countries) if info['kind'] == 'cell' else 1
+    _report_progress(progress, func_name, 0, total)
+    start = time.perf_counter()
+    
+    if _load_persisted_indicator(func_name):
+        print(f"  {func_name} 命中持久化缓存")
+        metrics.observe("pdq_indicator_seconds", time.perf_counter() - start, indicator=func_name, source="store")
+        _report_progress(progress, func_name, total, total)
+        return _results()['constants'][func_name] if info['kind'] == 'constant' else get_indicator_result(func_name)
+    
+    if info['kind'] == 'constant':
+        try:
+            value = func()
+        except Exception as e:
+            print(f"  错误: {func_name} - {e}")
+            value = None
+        else:
+            # 常量已在缓存中（如按需计算时算出但未写出）时，补写输出
+            if info.get('save', True) and _output_versions.get(func_name) != _active_snapshot().version:
+                save_to_json(func_name, {"value": value})
+            persist_indicator(func_name)
+        metrics.observe("pdq_indicator_seconds", time.perf_counter() - start, indicator=func_name, source="computed")
+        metrics.inc("pdq_indicator_cells_total", 1, indicator=func_name)
+        _report_progress(progress, func_name, 1, 1)
+        return value
+    
+    results = {}
+    for i, year in enumerate(years):
+        year_str = str(year)
+        results[year_str] = {}
+        
+        for country in countries:
+            try:
+                value = func(year, country)
+                results[year_str][country] = value
+            except Exception as e:
+                print(f"  错误: {year}年 {country} - {e}")
+                results[year_str][country] = None
+        _report_progress(progress, func_name, (i + 1) * len(countries), total)
+    
+    # 保存到JSON
+    save_to_json(func_name, results)
+    persist_indicator(func_name)
+    metrics.observe("pdq_indicator_seconds", time.perf_counter() - start, indicator=func_name, source="computed")
+    metrics.inc("pdq_indicator_cells_total", total, indicator=func_name)
+    return results
+
+def run_indicator_graph(targets=None, max_workers=4, names=None, progress=None):
+    """
+    按依赖图调度计算：拓扑排序后，依赖已完成的节点提交到线程池并发执行，
+    相互独立的分支（OA、OD、R_op_bar）可同时计算，每个节点每次运行只计算一次。
+    targets: 只计算这些指标及其上游指标；为None时计算全部
+    names: 直接指定要计算的节点集合，集合外的上游指标从缓存读取（缺失时按需计算）
+    progress: 进度回调，见_report_progress
+    返回 {指标名: 计算结果}
+    """
+    with pin_snapshot() as snapshot, result_artifact.deferred() as staging:
+        if names is None:
+            names = get_indicator_ancestors(targets) if targets else set(INDICATORS)
+        names = set(names)
+        order = topological_order(names)
+        _preload_inputs(names)
+    
+        # 开始计算前标记为已更新，计算过程中再次失效的指标会重新加入
+        mark_indicators_fresh(names)
+        years, countries = get_batch_axes()
+    
+        waiting = {name: set(INDICATORS[name]['deps']) & names for name in order}
+        results = {}
+    
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                running = {}
+            
+                def submit_ready():
+                    for name in order:
+                        if name in waiting and not waiting[name]:
+                            del waiting[name]
+                            print(f"计算 {name}...")
+                            future = executor.submit(_run_pinned, snapshot, staging, _run_indicator,
+                                                     name, years, countries, progress)
+                            running[future] = name
             
+                submit_ready()
+                while running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name = running.pop(future)
+                        results[name] = future.result()
+                        for deps in waiting.values():
+                            deps.discard(name)
+                        if INDICATORS[name]['kind'] == 'cell':
+                            print(f"  ✓ {name} 计算完成并已保存")
+                    submit_ready()
+        except BaseException:
+            # 取消或失败时，未完成的指标仍需重新输出
+            mark_indicators_stale(names - set(results))
+            raise
+    
+        return results
+
+# ==================== 多进程按年份分块计算 ====================
+def get_process_stages(names=None):
+    """
+    把逐单元指标划分为若干阶段：依赖"需要全部单元格才能求出的常量"（如S_od_t1、max_of_max）的指标
+    必须等上一阶段全部年份算完、由主进程求出常量后才能计算。
+    返回 (stages, constant_stages)：stages[i]为第i阶段的逐单元指标（拓扑顺序），
+    constant_stages[i]为第i阶段开始前由主进程计算的常量。
+    """
+    if names is None:
+        names = set(INDICATORS)
+    stage_of = {}
+    for name in topological_order(names):
+        info = INDICATORS[name]
+        deps = [dep for dep in info['deps'] if dep in names]
+        if info['kind'] == 'constant':
+            # 只依赖原始数据的常量在第0阶段前计算；依赖逐单元指标的常量在其依赖全部完成后计算
+            cell_deps = [stage_of[dep] + 1 for dep in deps if INDICATORS[dep]['kind'] == 'cell']
+            stage_of[name] = max(cell_deps + [stage_of[dep] for dep in deps if INDICATORS[dep]['kind'] == 'constant'] + [0])
+        else:
+            stage_of[name] = max([stage_of[dep] for dep in deps] + [0])
+    
+    stage_count = max(stage_of.values()) + 1 if stage_of else 0
+    stages = [[] for _ in range(stage_count)]
+    constant_stages = [[] for _ in range(stage_count)]
+    for name in topological_order(names):
+        if INDICATORS[name]['kind'] == 'constant':
+            constant_stages[stage_of[name]].append(name)
+        else:
+            stages[stage_of[name]].append(name)
+    return stages, constant_stages
+
+def _init_process_worker(version, data):
+    """子进程初始化：使用主进程传入的快照数据，保证与主进程计算的是同一份数据"""
+    global _snapshot
+    _snapshot = DataSnapshot(version, LazyDatasets({}, {key: (value, None, None) for key, value in data.items()}))
+
+def _compute_year_chunk(years, countries, names, constants, upstream):
+    """
+    子进程中计算一组年份的逐单元指标。
+    constants: 主进程已算好的常量；upstream: 本组年份中上一阶段指标的结果
+    返回 {指标名: ({year_str: {country: value}}, 抛出异常的[(year_str, country)])}
+    """
+    global _snapshot
+    _snapshot = DataSnapshot(_snapshot.version, _snapshot.data, {
+        'constants': dict(constants),
+        'functions': upstream,
+    })
+    results = {}
+    for func_name in names:
+        func = INDICATORS[func_name]['func']
+        rows = {}
+        failed = []
+        for year in years:
+            row = {}
             for country in countries:
                 try:
-                    value = func(year, country)
-                    results[year_str][country] = value
+                    row[country] = func(year, country)
                 except Exception as e:
                     print(f"  错误: {year}年 {country} - {e}")
-                    results[year_str][country] = None
+                    row[country] = None
+                    failed.append((str(year), country))
+            rows[str(year)] = row
+        results[func_name] = (rows, failed)
+    return results
+
+def run_process_batch(targets=None, max_workers=None, chunk_size=None, progress=None):
+    """
+    多进程批量计算：先在主进程中计算全局归一化常量，再把面板按年份分块交给进程池并行计算，
+    各块结果按年份顺序合并后写入与串行计算相同的输出文件（输出顺序确定）。
+    max_workers: 进程数，默认CPU核数；chunk_size: 每块年份数，默认平均分给各进程
+    progress: 进度回调（按年份分块完成情况报告）
+    """
+    with pin_snapshot() as snapshot, result_artifact.deferred():
+        names = get_indicator_ancestors(targets) if targets else set(INDICATORS)
+        _preload_inputs(names)
+        years, countries = get_batch_axes()
+        stages, constant_stages = get_process_stages(names)
+        mark_indicators_fresh(names)
+    
+        workers = max_workers or os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = max(1, math.ceil(len(years) / workers))
+        chunks = [years[i:i + chunk_size] for i in range(0, len(years), chunk_size)]
+        print(f"多进程计算: {workers}个进程, {len(chunks)}个年份分块, {len(stages)}个阶段")
+    
+        completed = set()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_process_worker,
+                                     initargs=(snapshot.version, snapshot.data.loaded())) as executor:
+                for stage_names, stage_constants in zip(stages, constant_stages):
+                    # 主进程计算本阶段需要的常量（依赖的单元格已在缓存中）
+                    for name in stage_constants:
+                        print(f"计算 {name}...")
+                        _run_indicator(name, years, countries, progress)
+                        completed.add(name)
+                    # 持久化缓存命中的指标无需计算
+                    hits = [name for name in stage_names if _load_persisted_indicator(name)]
+                    for name in hits:
+                        print(f"  {name} 命中持久化缓存")
+                        _report_progress(progress, name, len(years) * len(countries), len(years) * len(countries))
+                        completed.add(name)
+                    stage_names = [name for name in stage_names if name not in hits]
+                    if not stage_names:
+                        continue
+                
+                    constants = dict(_results()['constants'])
+                    upstream_names = {dep for name in stage_names for dep in INDICATORS[name]['deps']
+                                      if INDICATORS[dep]['kind'] == 'cell' and dep not in stage_names}
+                    futures = []
+                    for chunk in chunks:
+                        upstream = {
+                            dep: {str(y): dict(_results()['functions'].get(dep, {}).get(str(y), {})) for y in chunk}
+                            for dep in upstream_names
+                        }
+                        futures.append(executor.submit(_compute_year_chunk, chunk, countries,
+                                                       stage_names, constants, upstream))
+                
+                    # 按分块顺序合并，保证输出顺序与串行计算一致；
+                    # 与逐单元计算一样，抛出异常的单元格不写入缓存（之后的常量再次计算时同样抛出异常）
+                    done_years = 0
+                    for chunk, future in zip(chunks, futures):
+                        for name, (rows, failed) in future.result().items():
+                            func_cache = _results()['functions'].setdefault(name, {})
+                            for year_str, row in rows.items():
+                                func_cache.setdefault(year_str, {}).update(row)
+                            for year_str, country in failed:
+                                del func_cache[year_str][country]
+                        done_years += len(chunk)
+                        for name in stage_names:
+                            _report_progress(progress, name, done_years * len(countries), len(years) * len(countries))
+                
+                    for name in stage_names:
+                        func_cache = _results()['functions'][name]
+                        results = {str(y): {c: func_cache[str(y)].get(c) for c in countries} for y in years}
+                        save_to_json(name, results)
+                        persist_indicator(name)
+                        metrics.inc("pdq_indicator_cells_total", len(years) * len(countries), indicator=name)
+                        completed.add(name)
+                        print(f"  ✓ {name} 计算完成并已保存")
+        except BaseException:
+            # 取消或失败时，未完成的指标仍需重新输出
+            mark_indicators_stale(names - completed)
+            raise
+
+# ==================== 批量计算和保存函数 ====================
+def batch_calculate_and_save(engine="cell", targets=None, max_workers=4, chunk_size=None, progress=None):
+    """
+    批量计算所有函数的所有(year, country)组合，并保存到JSON文件
+    engine: "cell" 逐单元计算；"vectorized" 使用calculate_vec的整面板矩阵计算（输出相同）；
+            "process" 按年份分块在进程池中并行计算（输出相同）
+    targets: 只计算指定指标及其上游指标
+    max_workers: 逐单元计算时并发执行独立分支的线程数；"process"模式下为进程数
+    chunk_size: "process"模式下每个分块的年份数
+    progress: 进度回调 progress(func_name, done, total)，可抛出CalculationCancelled中止计算
+    """
+    with metrics.timer("pdq_batch_seconds", engine=engine):
+        refresh_changed_datasets()
+        if engine == "vectorized":
+            import calculate_vec
+            return calculate_vec.batch_calculate_and_save(targets=targets, progress=progress)
         
-        # 保存到JSON
-        save_to_json(func_name, results)
-        print(f"  ✓ {func_name} 计算完成并已保存")
-    
-    print("\n所有计算完成！")
+        if engine == "process":
+            years, countries = get_batch_axes()
+            print(f"开始批量计算: {len(years)}年 × {len(countries)}国家 = {len(years) * len(countries)}个组合")
+            run_process_batch(targets=targets, max_workers=max_workers, chunk_size=chunk_size, progress=progress)
+            print("\n所有计算完成！")
+            return
+        
+        years, countries = get_batch_axes()
+        print(f"开始批量计算: {len(years)}年 × {len(countries)}国家 = {len(years) * len(countries)}个组合")
+        
+        run_indicator_graph(targets=targets, max_workers=max_workers, progress=progress)
+        
+        print("\n所有计算完成！")
+
+def recalculate_stale(max_workers=4, progress=None):
+    """只重新计算并输出自上次计算以来失效的指标（包括在外部被修改的数据文件影响的指标），返回重新计算的指标列表"""
+    refresh_changed_datasets()
+    names = get_stale_indicators()
+    if not names:
+        print("没有需要重新计算的指标")
+        return []
+    
+    print(f"增量计算: {', '.join(names)}")
+    run_indicator_graph(names=names, max_workers=max_workers, progress=progress)
+    print("\n增量计算完成！")
+    return names
+
+# ==================== 单元格增量计算 ====================
+def diff_data_cells(old_data, new_data):
+    """
+    比较同一数据文件修改前后的内容，返回值发生变化的(year, key)列表。
+    年份或国家结构发生变化（增删年份/国家、非 年份->字典 结构）时返回None。
+    """
+    if not isinstance(old_data, Mapping) or not isinstance(new_data, Mapping):
+        return None
+    if old_data.keys() != new_data.keys():
+        return None
+    changed = []
+    for year_str, new_row in new_data.items():
+        old_row = old_data[year_str]
+        if not isinstance(old_row, dict) or not isinstance(new_row, dict):
+            return None
+        if old_row.keys() != new_row.keys():
+            return None
+        for country, value in new_row.items():
+            if old_row[country] != value:
+                changed.append((year_str, country))
+    return changed
+
+def _is_indicator_warm(name):
+    """指标的缓存和输出文件是否都是最新的（单元格增量计算的前提）"""
+    if _stale_indicators is None or name in _stale_indicators:
+        return False
+    if INDICATORS[name]['kind'] == 'constant':
+        return name in _results()['constants']
+    return name in _results()['functions']
+
+def _patch_output(func_name, cells):
+    """只更新已保存结果中发生变化的单元格"""
+    data = _read_output(func_name)
+    # 复制后再修改，不改动已打开的结果文件
+    results = {year: dict(row) for year, row in data.items()} if data else {}
+    for year_str, country in cells:
+        results.setdefault(year_str, {})[country] = \
+            _results()['functions'].get(func_name, {}).get(year_str, {}).get(country)
+    save_to_json(func_name, results)
+
+def propagate_data_change(key, new_data, cells):
+    """
+    单元格级增量计算：数据文件key中cells这些(year, country)的值改为new_data后，
+    沿依赖图只重算受影响的单元格和依赖该年汇总值的归一化常量，并只重写发生变化的输出。
+    返回 {'cells': {指标: [[year, country], ...]}, 'constants': {常量: 新值}}；
+    受影响指标的缓存不完整时无法做增量计算，返回None（调用方应改用reload_data_file）。
+    """
+    global _snapshot
+    with _snapshot_lock:
+        base = _snapshot
+        affected = get_dependent_indicators([key])
+        if not all(_is_indicator_warm(name) for name in affected):
+            return None
+        
+        # 在未发布的新快照上重算，正在使用旧快照的计算和读取不受影响；受影响指标的缓存先复制再修改
+        # 调用方已把new_data写入文件，记录文件当前状态，之后的外部修改检查不会把它当作外部修改
+        data = base.data.derive(replace={
+            key: (new_data, result_store.hash_data(new_data), _file_stamp(json_files[key]))
+        })
+        cache = {
+            'constants': dict(base.cache['constants']),
+            'functions': {
+                name: ({y: dict(row) for y, row in value.items()} if name in affected else value)
+                for name, value in base.cache['functions'].items()
+            },
+        }
+        snapshot = DataSnapshot(base.version + 1, data, cache)
+        with pin_snapshot(snapshot), result_artifact.deferred():
+            result = _propagate_cells(key, cells, affected)
+        _snapshot = snapshot
+    return result
+
+def _propagate_cells(key, cells, affected):
+    """在当前线程固定的快照上重算受影响的单元格和常量，返回值见propagate_data_change"""
+    years, countries = get_batch_axes()
+    axis_years = {str(y) for y in years}
+    axis_countries = set(countries)
+    changed_years = {year_str for year_str, _ in cells}
+    
+    changed_cells = {}
+    changed_constants = {}
+    for name in topological_order(affected):
+        info = INDICATORS[name]
+        deps_changed = any(dep in changed_constants or changed_cells.get(dep) for dep in info['deps'])
+        
+        if info['kind'] == 'constant':
+            if key not in info['inputs'] and not deps_changed:
+                continue
+            old_value = _results()['constants'].pop(name, None)
+            try:
+                new_value = info['func']()
+            except Exception as e:
+                print(f"  错误: {name} - {e}")
+                new_value = None
+            if new_value != old_value:
+                changed_constants[name] = new_value
+            continue
+        
+        # 确定需要重算的单元格
+        if any(dep in changed_constants for dep in info['deps']):
+            dirty = {(str(y), c) for y in years for c in countries}
+        else:
+            dirty = set()
+            if key in info['inputs']:
+                if key in info.get('row_inputs', []):
+                    dirty.update((y, c) for y in changed_years if y in axis_years for c in countries)
+                else:
+                    dirty.update((y, c) for y, c in cells if y in axis_years and c in axis_countries)
+            for dep in info['deps']:
+                dirty.update(changed_cells.get(dep, ()))
+        if not dirty:
+            continue
+        
+        func_cache = _results()['functions'].setdefault(name, {})
+        old_values = {}
+        for year_str, country in dirty:
+            old_values[(year_str, country)] = func_cache.get(year_str, {}).pop(country, None)
+        
+        changed = []
+        for year_str, country in sorted(dirty):
+            try:
+                value = info['func'](int(year_str), country)
+            except Exception as e:
+                print(f"  错误: {year_str}年 {country} - {e}")
+                value = None
+            if value != old_values[(year_str, country)]:
+                changed.append((year_str, country))
+        if changed:
+            changed_cells[name] = changed
+            _patch_output(name, changed)
+    
+    # 受影响指标的输入哈希已变化，更新持久化缓存
+    for name in affected:
+        persist_indicator(name)
+    
+    return {
+        'cells': {name: [list(cell) for cell in changed] for name, changed in changed_cells.items()},
+        'constants': changed_constants,
+    }
 
 if __name__ == "__main__":
-    batch_calculate_and_save()
+    import sys
+    batch_calculate_and_save(sys.argv[1] if len(sys.argv) > 1 else "cell")
@@ -0,0 +1,488 @@
+# 向量化整面板计算引擎
+# 将jsondata中的 年份->国家->值 字典载入为 年份×国家 的稠密NumPy矩阵（缺失值为NaN），
+# 每个指标作为一个数组表达式对整个面板一次性求值，结果与calculate.py逐单元计算一致。
+import numpy as np
+
+import calculate
+import columnar_store
+import metrics
+import result_artifact
+
+# 以 年份×国家 矩阵形式载入的数据集
+PANEL_KEYS = [
+    "OA", "total", "cooperation", "FWCI", "scientist",
+    "F2", "F3", "OP", "alpha_L", "alpha_F", "alpha_I",
+]
+
+# world_total中按年份取用的列
+WORLD_COLUMNS = ["world_oa_total", "word_scientist"]
+
+# 逐单元指标（与batch_calculate_and_save的输出文件一一对应，按依赖顺序排列）
+CELL_FUNCTIONS = [
+    'r_open_t', 'P_open_t', 'R_open',
+    'r_incl_t', 'P_incl_t', 'R_incl',
+    'R_oa', 'f1', 'f2', 'f3',
+    'S_od_t', 'A_od_t', 'R_od',
+    'R_oa_bar', 'R_od_bar', 'R_op_bar', 'R',
+]
+
+# 单值指标（逐单元路径中通过save_to_json单独保存的常量）
+CONSTANT_FUNCTIONS = ['r_open_t1', 'P_open_t1', 'r_incl_t1', 'P_incl_t1', 'S_od_t1', 'A_od_t1']
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class Panel:
+    '''
+    年份×国家面板数据。
+    values[key]: float64矩阵，缺失或非数值为NaN
+    present[key]: 该(年份, 国家)键是否存在于原始字典中（值可能为null）
+    is_int[key]: 原始值是否为整数（输出时保持与逐单元路径相同的JSON类型）
+    '''
+
+    def __init__(self, data_cache=None):
+        if data_cache is None:
+            data_cache = calculate._data()
+
+        # 年份轴：所有面板数据集年份的并集；国家轴：以total首年的国家顺序为准，其余国家按出现顺序追加
+        year_set = set()
+        for key in PANEL_KEYS + ['world_total']:
+            year_set.update(data_cache.get(key, {}).keys())
+        self.years = sorted(year_set, key=int)
+
+        countries = []
+        seen = set()
+        data_total = data_cache.get('total', {})
+        base_years = sorted(data_total.keys(), key=int)
+        sources = [data_total[base_years[0]]] if base_years else []
+        for key in PANEL_KEYS:
+            data = data_cache.get(key, {})
+            if isinstance(data, columnar_store.ColumnarDataset):
+                # 列式存储的国家索引就是按出现顺序排列的国家，无需逐年展开
+                sources.append(data.countries)
+            else:
+                sources.extend(data.values())
+        for year_data in sources:
+            if not isinstance(year_data, (dict, list)):
+                continue
+            for country in year_data:
+                if country not in seen:
+                    seen.add(country)
+                    countries.append(country)
+        self.countries = countries
+
+        self.year_index = {y: i for i, y in enumerate(self.years)}
+        self.country_index = {c: j for j, c in enumerate(self.countries)}
+        self.year_numbers = np.array([int(y) for y in self.years], dtype=np.int64)
+
+        # 批量输出使用的行列：total中的年份 × total首年的国家
+        self.output_years = base_years
+        self.output_countries = list(data_total[base_years[0]].keys()) if base_years else []
+
+        self.values = {}
+        self.present = {}
+        self.is_int = {}
+        for key in PANEL_KEYS:
+            self._load_matrix(key, data_cache.get(key, {}))
+
+        self.world = {}
+        self.world_is_int = {}
+        data_world_total = data_cache.get('world_total', {})
+        self.world_present = np.array([y in data_world_total for y in self.years], dtype=bool)
+        for column in WORLD_COLUMNS:
+            values = np.full(len(self.years), np.nan)
+            is_int = np.zeros(len(self.years), dtype=bool)
+            for y, year_data in data_world_total.items():
+                if not isinstance(year_data, dict):
+                    continue
+                value = year_data.get(column)
+                if _is_number(value):
+                    i = self.year_index[y]
+                    values[i] = value
+                    is_int[i] = isinstance(value, int)
+            self.world[column] = values
+            self.world_is_int[column] = is_int
+
+        self.weight = dict(data_cache.get('weight', {}))
+
+    def _load_matrix(self, key, data):
+        shape = (len(self.years), len(self.countries))
+        values = np.full(shape, np.nan)
+        present = np.zeros(shape, dtype=bool)
+        is_int = np.zeros(shape, dtype=bool)
+        if isinstance(data, columnar_store.ColumnarDataset):
+            # 列式存储：按年份、国家索引整块复制矩阵
+            rows = np.array([self.year_index.get(y, -1) for y in data.years], dtype=np.int64)
+            cols = np.array([self.country_index[c] for c in data.countries], dtype=np.int64)
+            keep = rows >= 0
+            flags = np.asarray(data.flags)[keep]
+            target = np.ix_(rows[keep], cols)
+            valid = (flags & columnar_store.VALID) != 0
+            values[target] = np.where(valid, np.asarray(data.values)[keep], np.nan)
+            present[target] = (flags & columnar_store.PRESENT) != 0
+            is_int[target] = (flags & columnar_store.INT) != 0
+            self.values[key] = values
+            self.present[key] = present
+            self.is_int[key] = is_int
+            return
+        for y, year_data in data.items():
+            if not isinstance(year_data, dict) or y not in self.year_index:
+                continue
+            i = self.year_index[y]
+            for country, value in year_data.items():
+                j = self.country_index[country]
+                present[i, j] = True
+                if _is_number(value):
+                    values[i, j] = value
+                    is_int[i, j] = isinstance(value, int)
+        self.values[key] = values
+        self.present[key] = present
+        self.is_int[key] = is_int
+
+
+# ==================== 数组辅助函数 ====================
+def _valid(*arrays):
+    '''所有数组在该位置都不是NaN'''
+    mask = ~np.isnan(arrays[0])
+    for arr in arrays[1:]:
+        mask = mask & ~np.isnan(arr)
+    return mask
+
+
+def _safe_div(numerator, denominator):
+    '''逐元素相除，分母为0或任一操作数缺失时结果为NaN'''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = numerator / denominator
+    return np.where(denominator == 0, np.nan, result)
+
+
+def _row_mean(values):
+    '''
+    沿最后一个轴（国家）对非NaN值求均值，全部缺失时为NaN。
+    逐列顺序累加，保证与Python内置sum()的浮点求和顺序一致。
+    '''
+    total = np.zeros(values.shape[:-1])
+    count = np.zeros(values.shape[:-1])
+    for j in range(values.shape[-1]):
+        column = values[..., j]
+        ok = ~np.isnan(column)
+        total += np.where(ok, column, 0.0)
+        count += ok
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+    return np.where(count > 0, mean, np.nan)
+
+
+def _nanmax(values, axis=None):
+    '''忽略NaN的最大值，全部缺失时为NaN'''
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, -np.inf)
+    result = filled.max(axis=axis)
+    return np.where(valid.any(axis=axis), result, np.nan)
+
+
+def _max_of_row_means(values):
+    '''每年求国家均值，再取历年最大值（对应逐单元路径中的 *_t1 常量）'''
+    return _nanmax(_row_mean(values), axis=-1)
+
+
+def _normalize(values, constant):
+    '''按常量归一化，常量缺失或为0时整体为NaN'''
+    constant = np.asarray(constant, dtype=float)[..., None, None]
+    return _safe_div(values, constant)
+
+
+def _cell_axes(value):
+    '''标量（可带前置轴）扩展出年份、国家两个轴，便于与矩阵广播'''
+    return np.asarray(value)[..., None, None]
+
+
+def _any_in(error, domain):
+    '''domain范围内是否有单元格出错（沿年份、国家两个轴）'''
+    return (error & domain).any(axis=(-2, -1))
+
+
+def _division_error(numerators, constants):
+    '''
+    逐单元路径中 值/常量 的除零错误：所有值和常量都不为None、但某个常量为0时抛出ZeroDivisionError
+    '''
+    ok = _valid(*numerators)
+    zero = np.zeros(np.shape(ok), dtype=bool)
+    for constant in constants:
+        constant = _cell_axes(constant)
+        ok = ok & ~np.isnan(constant)
+        zero = zero | (constant == 0)
+    return ok & zero
+
+
+# ==================== 指标计算 ====================
+def compute_all(panel, values=None, errors=None):
+    '''
+    对整个面板计算所有指标。
+    values可替换panel.values中的部分矩阵（形状可带额外的前置轴），用于批量情景计算。
+    返回 (cells, constants)：cells[name]为矩阵，constants[name]为标量数组。
+    errors为字典时，写入各指标在逐单元路径中抛出异常的位置（逐单元指标为布尔矩阵，常量为布尔值）。
+
+    空值的处理与逐单元路径一致：逐单元函数遇到null时有的返回None，有的抛出异常（如 None/4）。
+    *_t1 和 *_max_of_max 常量遍历所有单元格时，只要有一个单元格抛出异常，常量本身就无法计算（None），
+    依赖它的指标整体为None；因此这里除了NaN之外，还按同样的规则记录每个单元格是否"出错"（*_error）。
+    '''
+    data = dict(panel.values)
+    if values:
+        data.update(values)
+
+    oa = data['OA']
+    total = data['total']
+    cooperation = data['cooperation']
+
+    cells = {}
+    constants = {}
+
+    # 开放获取分支
+    cells['r_open_t'] = np.where(_valid(oa, total), _safe_div(oa, total), np.nan)
+    ratio = np.where(_valid(oa, total) & (total > 0), _safe_div(oa, total), np.nan)
+    constants['r_open_t1'] = _max_of_row_means(ratio)
+    cells['P_open_t'] = oa
+    constants['P_open_t1'] = _max_of_row_means(oa)
+    cells['R_open'] = 0.5 * (_normalize(cells['r_open_t'], constants['r_open_t1']) +
+                             _normalize(cells['P_open_t'], constants['P_open_t1']))
+
+    cells['r_incl_t'] = _safe_div(cooperation, total)
+    ratio = np.where(_valid(cooperation, total) & (total > 0), _safe_div(cooperation, total), np.nan)
+    constants['r_incl_t1'] = _max_of_row_means(ratio)
+    cells['P_incl_t'] = cooperation
+    constants['P_incl_t1'] = _max_of_row_means(cooperation)
+    cells['R_incl'] = 0.5 * (_normalize(cells['r_incl_t'], constants['r_incl_t1']) +
+                             _normalize(cells['P_incl_t'], constants['P_incl_t1']))
+
+    cells['R_oa'] = np.sqrt(cells['R_open'] ** 2 + cells['R_incl'] ** 2)
+
+    # R_oa出错的单元格：缺少OA键（P_open_t），r_incl_t中的null或除零，归一化常量为0
+    open_error = ~panel.present['OA'] | \
+        _division_error([cells['r_open_t'], oa], [constants['r_open_t1'], constants['P_open_t1']])
+    incl_error = np.isnan(cells['r_incl_t']) | \
+        _division_error([cooperation], [constants['r_incl_t1'], constants['P_incl_t1']])
+    oa_error = open_error | incl_error
+
+    # 开放数据分支
+    cells['f1'] = _f1(panel, data['FWCI'], data['scientist'])
+    cells['f2'] = data['F2'] / 4
+    cells['f3'] = data['F3']
+    cells['S_od_t'] = (cells['f1'] + cells['f2'] + cells['f3']) / 3 * total
+    # f2为 F2/4（null时出错），f3原样透传（只有缺少键时出错）
+    s_error = np.isnan(data['F2']) | ~panel.present['F3']
+    s1_error = _any_in(s_error, panel.present['total'])
+    constants['S_od_t1'] = np.where(s1_error, np.nan, _max_of_row_means(cells['S_od_t']))
+
+    world_oa_total = data.get('world_oa_total', panel.world['world_oa_total'])
+    world_ok = ~np.isnan(world_oa_total)[..., :, None]
+    cells['A_od_t'] = world_oa_total[..., :, None] * data['alpha_L'] * data['alpha_F'] * data['alpha_I']
+    # A_od_t为连乘，任一项为null或缺失时出错
+    a_error = ~world_ok | np.isnan(data['alpha_L']) | np.isnan(data['alpha_F']) | np.isnan(data['alpha_I'])
+    # A_od_t1：world_oa_total不为null的年份 × alpha_L中world_total首年的国家
+    world_rows = np.flatnonzero(panel.world_present)
+    if len(world_rows):
+        a_domain = world_ok & panel.present['alpha_L'][world_rows[0]]
+    else:
+        a_domain = np.zeros(np.shape(world_ok), dtype=bool)
+    a1_error = _any_in(a_error, a_domain)
+    a_od = np.where(a_domain, cells['A_od_t'], np.nan)
+    constants['A_od_t1'] = np.where(a1_error, np.nan, _max_of_row_means(a_od))
+
+    cells['R_od'] = np.sqrt(_normalize(cells['S_od_t'], constants['S_od_t1']) ** 2 +
+                            _normalize(cells['A_od_t'], constants['A_od_t1']) ** 2)
+    od_error = s_error | a_error | _cell_axes(s1_error) | _cell_axes(a1_error) | \
+        _division_error([cells['S_od_t'], cells['A_od_t']], [constants['S_od_t1'], constants['A_od_t1']])
+
+    # 归一化到历年最大值（遍历范围内有单元格出错时无法计算）
+    oa_max_error = _any_in(oa_error, panel.present['OA'])
+    od_max_error = _any_in(od_error, panel.present['total'])
+    constants['R_oa_bar_max_of_max'] = np.where(oa_max_error, np.nan, _nanmax(cells['R_oa'], axis=(-2, -1)))
+    constants['R_od_bar_max_of_max'] = np.where(od_max_error, np.nan, _nanmax(cells['R_od'], axis=(-2, -1)))
+    cells['R_oa_bar'] = _normalize(cells['R_oa'], constants['R_oa_bar_max_of_max'])
+    cells['R_od_bar'] = _normalize(cells['R_od'], constants['R_od_bar_max_of_max'])
+
+    # 开放政策：各国该年固定值 / 该年所有国家中的最大值（该年存在空值时整年无法计算）
+    op = data['OP']
+    op_present = panel.present['OP']
+    row_incomplete = (op_present & np.isnan(op)).any(axis=-1)
+    row_max = _nanmax(np.where(op_present, op, np.nan), axis=-1)
+    row_max = np.where(row_incomplete, np.nan, row_max)
+    cells['R_op_bar'] = _safe_div(op, row_max[..., None])
+
+    weight = panel.weight
+    has_weight = all(k in weight for k in ('W_OA', 'W_OD', 'W_OP'))
+    if has_weight:
+        cells['R'] = weight['W_OA'] * cells['R_oa_bar'] + \
+                     weight['W_OD'] * cells['R_od_bar'] + \
+                     weight['W_OP'] * cells['R_op_bar']
+    else:
+        cells['R'] = np.full(np.shape(cells['R_oa_bar']), np.nan)
+
+    if errors is not None:
+        oa_bar_error = oa_error | _cell_axes(oa_max_error)
+        od_bar_error = od_error | _cell_axes(od_max_error)
+        # R_op_bar没有返回None的分支，无法计算即出错
+        op_error = np.isnan(cells['R_op_bar'])
+        bar_error = oa_bar_error | od_bar_error | op_error
+        if not has_weight:
+            bar_error = bar_error | _valid(cells['R_oa_bar'], cells['R_od_bar'], cells['R_op_bar'])
+        no_error = np.zeros(np.shape(cells['R']), dtype=bool)
+        errors.update({
+            'r_open_t': no_error, 'P_open_t': ~panel.present['OA'], 'R_open': open_error,
+            'r_incl_t': np.isnan(cells['r_incl_t']), 'P_incl_t': ~panel.present['cooperation'],
+            'R_incl': incl_error, 'R_oa': oa_error,
+            'f1': no_error, 'f2': np.isnan(data['F2']), 'f3': ~panel.present['F3'],
+            'S_od_t': s_error, 'A_od_t': a_error, 'R_od': od_error,
+            'R_oa_bar': oa_bar_error, 'R_od_bar': od_bar_error, 'R_op_bar': op_error, 'R': bar_error,
+            'S_od_t1': s1_error, 'A_od_t1': a1_error,
+            'R_oa_bar_max_of_max': oa_max_error, 'R_od_bar_max_of_max': od_max_error,
+        })
+
+    return cells, constants
+
+
+def _f1_adjusted(panel, fwci, scientist):
+    '''f1中按科学家占比修正的部分，返回 (是否修正的掩码, 修正后的值)'''
+    word_col = panel.world['word_scientist'][..., :, None]
+    au_current = _safe_div(scientist, word_col)
+    # 各国占比的均值（仅world的word_scientist > 0时存在）
+    au_ratios = np.where(word_col > 0, au_current, np.nan)
+    au_average = _row_mean(au_ratios)[..., :, None]
+
+    adjust = (panel.year_numbers[:, None] >= 2014) & _valid(scientist, word_col, au_average) & \
+             (word_col != 0) & (au_average != 0)
+    adjusted = 0.8 * fwci + 0.2 * _safe_div(au_current, au_average)
+    return adjust, adjusted
+
+
+def _f1(panel, fwci, scientist):
+    '''f1：2014年前为FWCI；2014年起按科学家占比修正'''
+    adjust, adjusted = _f1_adjusted(panel, fwci, scientist)
+    result = np.where(adjust, adjusted, fwci)
+    # 2014年起，scientist或world_total中缺少该键时无法计算
+    missing = (panel.year_numbers[:, None] >= 2014) & \
+              ~(panel.present['scientist'] & panel.world_present[:, None])
+    return np.where(missing | np.isnan(fwci), np.nan, result)
+
+
+def _int_masks(panel):
+    '''逐单元路径在哪些位置会输出整数（原样透传或整数连乘的结果）'''
+    masks = {
+        'P_open_t': panel.is_int['OA'],
+        'P_incl_t': panel.is_int['cooperation'],
+        'f3': panel.is_int['F3'],
+        'A_od_t': panel.world_is_int['world_oa_total'][:, None] & panel.is_int['alpha_L'] &
+                  panel.is_int['alpha_F'] & panel.is_int['alpha_I'],
+    }
+    # f1直接取FWCI原值的位置
+    adjust, _ = _f1_adjusted(panel, panel.values['FWCI'], panel.values['scientist'])
+    masks['f1'] = panel.is_int['FWCI'] & ~adjust
+    return masks
+
+
+def _to_year_dict(values, is_int, panel):
+    '''把矩阵转换回 年份->国家->值 字典（NaN为None）'''
+    rows = [panel.year_index[y] for y in panel.output_years]
+    cols = [panel.country_index[c] for c in panel.output_countries]
+    block = values[np.ix_(rows, cols)].tolist()
+    int_block = is_int[np.ix_(rows, cols)].tolist() if is_int is not None else None
+    result = {}
+    for r, year_str in enumerate(panel.output_years):
+        year_result = {}
+        for c, country in enumerate(panel.output_countries):
+            value = block[r][c]
+            if value != value or value in (float('inf'), float('-inf')):
+                value = None
+            elif int_block is not None and int_block[r][c]:
+                value = int(value)
+            year_result[country] = value
+        result[year_str] = year_result
+    return result
+
+
+def _to_scalar(value):
+    value = float(value)
+    if value != value or value in (float('inf'), float('-inf')):
+        return None
+    return value
+
+
+def _failed_cells(error, panel):
+    '''批量输出范围内逐单元路径会抛出异常的 (年份, 国家)'''
+    rows = [panel.year_index[y] for y in panel.output_years]
+    cols = [panel.country_index[c] for c in panel.output_countries]
+    block = np.broadcast_to(error, (len(panel.years), len(panel.countries)))[np.ix_(rows, cols)]
+    return {(panel.output_years[r], panel.output_countries[c]) for r, c in zip(*np.nonzero(block))}
+
+
+def compute_results(panel=None):
+    '''
+    计算所有指标并转换为与逐单元路径相同的字典结构，返回 (cells, constants, failed)：
+    failed[name]为逐单元指标中会抛出异常的 (年份, 国家) 集合，或常量是否抛出异常
+    '''
+    if panel is None:
+        panel = Panel()
+    errors = {}
+    cells, constants = compute_all(panel, errors=errors)
+    int_masks = _int_masks(panel)
+    cell_results = {
+        name: _to_year_dict(cells[name], int_masks.get(name), panel)
+        for name in CELL_FUNCTIONS
+    }
+    constant_results = {name: _to_scalar(value) for name, value in constants.items()}
+    failed = {name: _failed_cells(errors[name], panel) for name in CELL_FUNCTIONS}
+    failed.update({name: bool(errors.get(name, False)) for name in constants})
+    return cell_results, constant_results, failed
+
+
+def batch_calculate_and_save(targets=None, progress=None):
+    """
+    向量化批量计算所有指标，输出文件与calculate.batch_calculate_and_save相同
+    targets: 只保存指定指标及其上游指标的输出文件
+    progress: 进度回调，每保存一个指标报告一次
+    计算过程中固定使用开始时的数据快照
+    """
+    with calculate.pin_snapshot(), result_artifact.deferred():
+        names = calculate.get_indicator_ancestors(targets) if targets else set(calculate.INDICATORS)
+        calculate.preload_datasets()
+        panel = Panel()
+        print(f"开始向量化批量计算: {len(panel.output_years)}年 × {len(panel.output_countries)}国家 = "
+              f"{len(panel.output_years) * len(panel.output_countries)}个组合")
+
+        cell_results, constant_results, failed = compute_results(panel)
+        cells = len(panel.output_years) * len(panel.output_countries)
+
+        # 回填逐单元缓存，进度回调和之后的单点查询可直接读取；
+        # 与逐单元路径一样，抛出异常的单元格和常量不写入缓存（再次读取时重新计算并抛出异常）
+        for name, results in cell_results.items():
+            calculate._results()['functions'][name] = {
+                y: {c: value for c, value in row.items() if (y, c) not in failed[name]}
+                for y, row in results.items()
+            }
+        calculate._results()['constants'].update(
+            {name: value for name, value in constant_results.items() if not failed[name]}
+        )
+
+        for name, info in calculate.INDICATORS.items():
+            if info['kind'] != 'constant' or name not in names:
+                continue
+            # 逐单元路径中常量抛出异常时不写出输出文件
+            if info.get('save', True) and not failed[name]:
+                calculate.save_to_json(name, {"value": constant_results[name]})
+            calculate.mark_indicators_fresh([name])
+            metrics.inc("pdq_indicator_cells_total", 1, indicator=name)
+            calculate._report_progress(progress, name, 1, 1)
+        for name in CELL_FUNCTIONS:
+            if name not in names:
+                continue
+            calculate.save_to_json(name, cell_results[name])
+            calculate.mark_indicators_fresh([name])
+            metrics.inc("pdq_indicator_cells_total", cells, indicator=name)
+            calculate._report_progress(progress, name, cells, cells)
+            print(f"  ✓ {name} 计算完成并已保存")
+        calculate.mark_indicators_fresh(names)
+
+        print("\n所有计算完成！")
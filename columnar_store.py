@@ -0,0 +1,348 @@
+# jsondata的列式二进制存储
+# 每个数据集保存为一个目录：values.<版本>.npy（年份×国家 float64矩阵）、flags.<版本>.npy（有效位图）
+# 和meta.json（年份、国家索引、当前版本的矩阵文件名等），
+# 加载时以内存映射方式打开，耗时与年份数、国家数无关；某一年的数据在第一次访问时才转换为字典。
+# 存储由JSON文件自动生成（记录源文件的修改时间和大小，JSON被修改后自动重建），也可以反向导出为JSON文件。
+import json
+import os
+import shutil
+import sys
+import time
+import uuid
+from collections.abc import Mapping
+
+import numpy as np
+
+import atomic_io
+import result_store
+
+# 列式存储目录
+STORE_DIR = os.path.join("cache", "columnar")
+
+# 是否启用列式存储
+ENABLED = True
+
+# 存储格式变化时递增，旧格式的存储自动重建
+FORMAT_VERSION = 2
+
+# 源文件修改时间与存储写入时间相差不超过此值（纳秒）时，修改时间和大小不足以说明文件未变
+# （文件系统时间精度内可能被改写为相同大小的内容），读取时核对内容哈希
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+# flags位图
+PRESENT = 1   # 该(年份, 国家)键存在（值可能为null）
+VALID = 2     # 值为数值，保存在values中
+INT = 4       # 原始值为整数
+
+# float64能精确表示的最大整数，超过的整数按原值保存在meta中
+_MAX_EXACT_INT = 2 ** 53
+
+
+def store_path(json_path):
+    """JSON文件对应的列式存储目录"""
+    name = os.path.splitext(os.path.basename(json_path))[0]
+    return os.path.join(STORE_DIR, name)
+
+
+def _source_stamp(json_path):
+    """源JSON文件的修改时间和大小，文件不存在返回None"""
+    try:
+        st = os.stat(json_path)
+    except OSError:
+        return None
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _is_panel(data):
+    """是否为 年份->国家->标量值 结构（只有这种结构按矩阵保存）"""
+    if not isinstance(data, dict) or not data:
+        return False
+    for row in data.values():
+        if not isinstance(row, dict):
+            return False
+        for value in row.values():
+            if isinstance(value, (dict, list)):
+                return False
+    return True
+
+
+class ColumnarDataset(Mapping):
+    """
+    以内存映射矩阵为底层的只读数据集，行为与 年份->国家->值 字典相同。
+    每年的数据在第一次访问时转换为字典并保留，之后的访问与普通字典一样快。
+    """
+
+    def __init__(self, directory, meta, values, flags):
+        self.directory = directory
+        self.years = meta["years"]
+        self.countries = meta["countries"]
+        self.content_hash = meta["hash"]
+        self.values = values
+        self.flags = flags
+        self._year_index = {y: i for i, y in enumerate(self.years)}
+        self._row_orders = meta.get("row_orders", {})
+        self._extras = meta.get("extras", {})
+        self._rows = {}
+
+    def __reduce__(self):
+        # 传给子进程时只传目录，子进程重新映射文件
+        return (open_dataset, (self.directory,))
+
+    def __getitem__(self, year):
+        row = self._rows.get(year)
+        if row is None:
+            row = self._rows[year] = self._build_row(year)
+        return row
+
+    def __iter__(self):
+        return iter(self.years)
+
+    def __len__(self):
+        return len(self.years)
+
+    def __contains__(self, year):
+        return year in self._year_index
+
+    def _build_row(self, year):
+        i = self._year_index[year]
+        flags = self.flags[i].tolist()
+        values = self.values[i].tolist()
+        order = self._row_orders.get(year)
+        if order is None:
+            columns = [j for j, flag in enumerate(flags) if flag & PRESENT]
+        else:
+            country_index = {c: j for j, c in enumerate(self.countries)}
+            columns = [country_index[c] for c in order]
+        row = {}
+        for j in columns:
+            flag = flags[j]
+            if flag & VALID:
+                row[self.countries[j]] = int(values[j]) if flag & INT else values[j]
+            else:
+                row[self.countries[j]] = None
+        row.update(self._extras.get(year, {}))
+        return row
+
+    def to_dict(self):
+        """转换为普通字典"""
+        return {year: dict(self[year]) for year in self.years}
+
+
+def _panel_arrays(data):
+    """把 年份->国家->值 字典转换为 (meta, values, flags)"""
+    years = list(data.keys())
+    countries = []
+    country_index = {}
+    for row in data.values():
+        for country in row:
+            if country not in country_index:
+                country_index[country] = len(countries)
+                countries.append(country)
+
+    values = np.zeros((len(years), len(countries)), dtype=np.float64)
+    flags = np.zeros((len(years), len(countries)), dtype=np.uint8)
+    row_orders = {}
+    extras = {}
+    for i, (year, row) in enumerate(data.items()):
+        columns = [country_index[c] for c in row]
+        if columns != sorted(columns):
+            row_orders[year] = list(row.keys())
+        for country, value in row.items():
+            j = country_index[country]
+            if value is None:
+                flags[i, j] = PRESENT
+            elif isinstance(value, bool) or not isinstance(value, (int, float)) \
+                    or (isinstance(value, int) and abs(value) > _MAX_EXACT_INT):
+                flags[i, j] = PRESENT
+                extras.setdefault(year, {})[country] = value
+            else:
+                values[i, j] = value
+                flags[i, j] = PRESENT | VALID | (INT if isinstance(value, int) else 0)
+
+    meta = {
+        "kind": "panel",
+        "years": years,
+        "countries": countries,
+        "shape": [len(years), len(countries)],
+        "row_orders": row_orders,
+        "extras": extras,
+    }
+    return meta, values, flags
+
+
+def _write_json(path, data):
+    atomic_io.atomic_write(path, json.dumps(data, ensure_ascii=False), fsync=False)
+
+
+def _write_array(path, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _remove_unreferenced(directory, meta):
+    """删除meta不再引用的旧版本矩阵文件（已映射旧文件的读取方不受影响）"""
+    keep = {meta.get("values"), meta.get("flags")}
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and name not in keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def save(json_path, data, content_hash=None, source=None):
+    """
+    把JSON文件json_path的内容data保存为列式存储（记录源文件的修改时间和大小）。
+    content_hash: 已算好的内容哈希，省略时重新计算
+    source: 读取data之前记录的源文件状态（_source_stamp），省略时使用当前状态
+    矩阵写入新版本的文件，meta最后原子替换，读取方看到的总是同一版本的meta和矩阵。
+    """
+    saved_ns = time.time_ns()
+    directory = store_path(json_path)
+    os.makedirs(directory, exist_ok=True)
+    if _is_panel(data):
+        meta, values, flags = _panel_arrays(data)
+        version = uuid.uuid4().hex[:12]
+        meta["values"] = f"values.{version}.npy"
+        meta["flags"] = f"flags.{version}.npy"
+        _write_array(os.path.join(directory, meta["values"]), values)
+        _write_array(os.path.join(directory, meta["flags"]), flags)
+    else:
+        meta = {"kind": "object", "data": data}
+    meta["format"] = FORMAT_VERSION
+    meta["source"] = source or _source_stamp(json_path)
+    meta["saved_ns"] = saved_ns
+    meta["hash"] = content_hash or result_store.hash_data(data)
+    # meta最后写入，读取时以meta为准判断存储是否完整
+    _write_json(os.path.join(directory, "meta.json"), meta)
+    _remove_unreferenced(directory, meta)
+
+
+def _read_meta(directory):
+    """读取存储的meta，不存在、损坏或格式不符返回None"""
+    try:
+        with open(os.path.join(directory, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict) or meta.get("format") != FORMAT_VERSION:
+        return None
+    return meta
+
+
+def _open(directory, meta):
+    try:
+        if meta["kind"] == "object":
+            return meta["data"]
+        values = np.load(os.path.join(directory, meta["values"]), mmap_mode='r')
+        flags = np.load(os.path.join(directory, meta["flags"]), mmap_mode='r')
+        if list(values.shape) != meta["shape"] or list(flags.shape) != meta["shape"]:
+            return None
+        return ColumnarDataset(directory, meta, values, flags)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def open_dataset(directory):
+    """打开列式存储目录，返回ColumnarDataset（非面板数据返回字典）；不存在或不完整返回None"""
+    meta = _read_meta(directory)
+    if meta is None:
+        return None
+    return _open(directory, meta)
+
+
+def _source_matches(json_path, directory, meta, stamp):
+    """
+    修改时间和大小与记录相同时，判断源文件内容是否确实未变：
+    存储写入时源文件刚被修改过（在RACY_WINDOW_NS内）则核对内容哈希，
+    核对通过且源文件已足够旧时更新写入时间，之后不再核对。
+    """
+    if meta.get("saved_ns", 0) - stamp["mtime_ns"] > RACY_WINDOW_NS:
+        return True
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            current = result_store.hash_data(json.load(f))
+    except (OSError, ValueError):
+        return False
+    if current != meta.get("hash"):
+        return False
+    now = time.time_ns()
+    if now - stamp["mtime_ns"] > RACY_WINDOW_NS and _source_stamp(json_path) == stamp:
+        meta["saved_ns"] = now
+        try:
+            _write_json(os.path.join(directory, "meta.json"), meta)
+        except OSError:
+            pass
+    return True
+
+
+def load(json_path):
+    """
+    读取JSON文件对应的列式存储：存储存在且与源文件一致时返回数据，否则返回None。
+    源文件已不存在时删除存储，返回None。
+    """
+    if not ENABLED:
+        return None
+    directory = store_path(json_path)
+    stamp = _source_stamp(json_path)
+    if stamp is None:
+        shutil.rmtree(directory, ignore_errors=True)
+        return None
+    meta = _read_meta(directory)
+    if meta is None or meta.get("source") != stamp:
+        return None
+    if not _source_matches(json_path, directory, meta, stamp):
+        return None
+    return _open(directory, meta)
+
+
+def content_hash(data):
+    """数据集的内容哈希；列式数据集直接使用保存时记录的哈希"""
+    if isinstance(data, ColumnarDataset):
+        return data.content_hash
+    return result_store.hash_data(data)
+
+
+def to_dict(data):
+    """把列式数据集转换为普通字典，其他数据原样返回"""
+    if isinstance(data, ColumnarDataset):
+        return data.to_dict()
+    return data
+
+
+def export_json(json_path):
+    """把列式存储导出为JSON文件（与jsondata中的格式相同），返回是否成功"""
+    data = open_dataset(store_path(json_path))
+    if data is None:
+        return False
+    atomic_io.atomic_write(json_path, json.dumps(to_dict(data), ensure_ascii=False, indent=2))
+    # 导出的JSON与存储内容相同，更新源文件记录避免重建
+    meta_path = os.path.join(store_path(json_path), "meta.json")
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    meta["source"] = _source_stamp(json_path)
+    _write_json(meta_path, meta)
+    return True
+
+
+if __name__ == "__main__":
+    # python columnar_store.py build  [文件...]  JSON -> 列式存储（默认jsondata下所有JSON文件）
+    # python columnar_store.py export [文件...]  列式存储 -> JSON
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+    paths = sys.argv[2:] or sorted(
+        os.path.join("jsondata", name) for name in os.listdir("jsondata") if name.endswith(".json")
+    )
+    for path in paths:
+        if command == "build":
+            with open(path, 'r', encoding='utf-8') as f:
+                save(path, json.load(f))
+            print(f"✓ {path} -> {store_path(path)}")
+        elif command == "export":
+            if export_json(path):
+                print(f"✓ {store_path(path)} -> {path}")
+            else:
+                print(f"警告: 列式存储不存在，跳过: {store_path(path)}")
+        else:
+            print(f"未知命令: {command}（可选 build / export）")
+            sys.exit(1)
@@ -1,10 +1,11 @@
 import request from './request'
 
-// 执行批量计算
-export function executeBatchCalculate() {
+// 执行批量计算（incremental为true时只重新计算因数据修改而失效的指标）
+export function executeBatchCalculate(incremental = false) {
   return request({
     url: '/calculate/batch',
-    method: 'post'
+    method: 'post',
+    params: { incremental }
   })
 }
 
@@ -16,3 +17,38 @@ export function getCalculateStatus() {
   })
 }
 
+
+// 获取计算任务进度
+export function getCalculateJob(jobId) {
+  return request({
+    url: `/calculate/jobs/${jobId}`,
+    method: 'get'
+  })
+}
+
+// 取消计算任务
+export function cancelCalculateJob(jobId) {
+  return request({
+    url: `/calculate/jobs/${jobId}/cancel`,
+    method: 'post'
+  })
+}
+
+// 订阅计算任务事件流（Server-Sent Events），每个指标完成时推送一次；返回EventSource，调用close()取消订阅
+export function subscribeCalculateEvents(jobId, { onIndicator, onEnd, onError }, includeData = true) {
+  const source = new EventSource(`${request.defaults.baseURL}/calculate/jobs/${jobId}/events?include_data=${includeData}`)
+  source.addEventListener('indicator', event => {
+    onIndicator && onIndicator(JSON.parse(event.data))
+  })
+  source.addEventListener('end', event => {
+    source.close()
+    onEnd && onEnd(JSON.parse(event.data))
+  })
+  source.onerror = error => {
+    // 任务结束后服务器关闭连接，浏览器会尝试重连；已收到end事件时不再处理
+    if (source.readyState === EventSource.CLOSED) {
+      onError && onError(error)
+    }
+  }
+  return source
+}
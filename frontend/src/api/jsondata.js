@@ -25,6 +25,15 @@ export function updateJsonDataFile(filename, data) {
   })
 }
 
+// 批量更新单元格：cells为 [{ year, country, value }]
+export function patchJsonDataCells(filename, cells) {
+  return request({
+    url: `/jsondata/${filename}`,
+    method: 'patch',
+    data: { cells }
+  })
+}
+
 // 添加数据（年份或国家）
 export function addJsonDataData(filename, year, country, value) {
   return request({
@@ -60,3 +60,31 @@ export function exportOutputToExcel(filename) {
 }
 
 
+
+// 查询指标结果切片（indicators、countries为数组，years为数组或范围字符串如'2000-2010'；format为nested或columnar）
+export function queryResults({ indicators, years, countries, format = 'nested' } = {}) {
+  const join = value => (Array.isArray(value) ? value.join(',') : value)
+  return request({
+    url: '/results/query',
+    method: 'get',
+    params: { indicators: join(indicators), years: join(years), countries: join(countries), format }
+  })
+}
+
+// 按需计算指标在指定单元格上的值及上游中间结果（cells为[{ year, country }]）
+export function computeCells(indicator, cells, components = true) {
+  return request({
+    url: '/results/compute',
+    method: 'post',
+    data: { indicator, cells, components }
+  })
+}
+
+// 权重情景：weights为[{ W_OA, W_OD, W_OP }]，或通过gridStep指定权重网格；不修改weight.json
+export function runWeightScenarios({ weights = [], gridStep = null, years = null, countries = null, keep = 100 } = {}) {
+  return request({
+    url: '/scenarios/weights',
+    method: 'post',
+    data: { weights, grid_step: gridStep, years, countries, keep }
+  })
+}
@@ -0,0 +1,226 @@
+# 批量计算任务管理
+# 所有批量计算在同一个后台线程中按提交顺序执行，保证同一时间只有一个任务在写输出文件；
+# 记录每个任务的状态、逐指标进度、耗时与预计剩余时间，并支持取消；
+# 任务开始、每个指标完成和任务结束时追加事件，供流式接口按顺序推送。
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from calculate import CalculationCancelled, _active_snapshot
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+class Job:
+    """一个批量计算任务"""
+
+    def __init__(self, kind, params, func, plan_func):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.func = func              # func(progress) 执行计算
+        self.plan_func = plan_func    # plan_func() -> [(指标名, 单元格数)]，在任务开始时调用
+        self.status = QUEUED
+        self.message = ""
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.superseded_by = None
+        self.plan = []
+        self.progress = {}            # 指标名 -> [已完成, 总数]
+        self.current = None           # 最近报告进度的指标
+        self.result = None
+        self.events = []              # [{"event": 类型, "data": {...}}]，只追加；indicator事件另带计算使用的快照
+        self._indicator_started = {}  # 指标名 -> 首次报告进度的时间
+        self._last_finished = None    # 最近一个指标完成的时间
+
+    def add_event(self, event, data, **extra):
+        self.events.append({"event": event, "data": data, **extra})
+
+    def start(self):
+        self.status = RUNNING
+        self.started_at = time.time()
+
+    def report(self, func_name, done, total):
+        """进度回调：记录进度，任务被取消时中止计算"""
+        if self.cancel_requested:
+            raise CalculationCancelled(f"任务 {self.id} 已取消")
+        now = time.time()
+        previous = self.progress.get(func_name)
+        self._indicator_started.setdefault(func_name, self._last_finished or self.started_at or now)
+        self.progress[func_name] = [done, total]
+        self.current = func_name
+        if done >= total and not (previous and previous[0] >= previous[1]):
+            self._last_finished = now
+            self.add_event("indicator", {
+                "name": func_name,
+                "cells": total,
+                "seconds": now - self._indicator_started[func_name],
+                "elapsed": now - (self.started_at or now),
+                "indicators_done": sum(1 for d, t in self.progress.values() if d >= t),
+                "indicators_total": len(self.plan),
+            }, snapshot=_active_snapshot())
+
+    def finish(self, status, message):
+        self.status = status
+        self.message = message
+        self.finished_at = time.time()
+        self.add_event("end", {
+            "status": status,
+            "message": message,
+            "elapsed": self.finished_at - self.started_at if self.started_at else None,
+        })
+
+    def to_dict(self):
+        now = time.time()
+        total_units = sum(units for _, units in self.plan)
+        done_units = sum(min(self.progress.get(name, [0])[0], units) for name, units in self.plan)
+        if self.status == COMPLETED:
+            done_units = total_units
+        fraction = done_units / total_units if total_units else (1.0 if self.status == COMPLETED else 0.0)
+
+        elapsed = None
+        eta = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or now) - self.started_at
+            if self.status == RUNNING and fraction > 0:
+                eta = elapsed * (1 - fraction) / fraction
+
+        indicators = []
+        for name, units in self.plan:
+            done, _ = self.progress.get(name, [0, units])
+            indicators.append({"name": name, "done": min(done, units), "total": units})
+
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "message": self.message,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": elapsed,
+            "eta": eta,
+            "progress": fraction,
+            "current_indicator": self.current if self.status == RUNNING else None,
+            "indicators_done": sum(1 for item in indicators if item["total"] and item["done"] >= item["total"]),
+            "indicators_total": len(indicators),
+            "cells_done": done_units,
+            "cells_total": total_units,
+            "indicators": indicators,
+            "cancel_requested": self.cancel_requested,
+            "superseded_by": self.superseded_by,
+        }
+
+
+class JobManager:
+    """
+    单线程顺序执行的任务队列。
+    - 与已排队任务参数相同的请求直接返回已排队的任务（合并重复点击）
+    - supersede的任务提交时取消正在运行和排队中的旧任务（True为同类任务，也可以给出任务类型的集合），
+      旧任务的结果不会覆盖新任务；其他类型的任务（如不确定性分析）不受影响
+    """
+
+    def __init__(self, history=50):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._queue = deque()
+        self._jobs = OrderedDict()
+        self._history = history
+        self._current = None
+        self._worker = None
+
+    def submit(self, kind, params, func, plan_func, supersede=False):
+        """提交任务，返回 (任务, 是否新建)"""
+        with self._lock:
+            for queued in self._queue:
+                if queued.kind == kind and queued.params == params and not queued.cancel_requested:
+                    return queued, False
+
+            job = Job(kind, params, func, plan_func)
+            if supersede:
+                kinds = {kind} if supersede is True else set(supersede)
+                for old in list(self._queue) + ([self._current] if self._current else []):
+                    if old.kind in kinds and not old.cancel_requested:
+                        old.cancel_requested = True
+                        old.superseded_by = job.id
+            self._queue.append(job)
+            self._jobs[job.id] = job
+            self._trim_history()
+            self._ensure_worker()
+            self._wakeup.notify()
+            return job, True
+
+    def cancel(self, job_id):
+        """请求取消任务，返回任务；任务不存在返回None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status not in FINISHED_STATES:
+                job.cancel_requested = True
+            return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def current(self):
+        """正在运行的任务，没有则返回最近提交的任务"""
+        with self._lock:
+            if self._current is not None:
+                return self._current
+            if self._jobs:
+                return next(reversed(self._jobs.values()))
+            return None
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _trim_history(self):
+        while len(self._jobs) > self._history:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if oldest.status not in FINISHED_STATES:
+                break
+            del self._jobs[oldest_id]
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run_loop, name="batch-job-worker", daemon=True)
+            self._worker.start()
+
+    def _run_loop(self):
+        while True:
+            with self._lock:
+                while not self._queue:
+                    self._wakeup.wait()
+                job = self._queue.popleft()
+                if job.cancel_requested:
+                    job.finish(CANCELLED, "任务在开始前被取消")
+                    continue
+                job.start()
+                self._current = job
+
+            try:
+                job.plan = job.plan_func()
+                job.add_event("start", {"indicators": [{"name": name, "cells": units} for name, units in job.plan]})
+                job.result = job.func(job.report)
+                job.finish(COMPLETED, "计算完成")
+            except CalculationCancelled:
+                job.finish(CANCELLED, f"已被任务 {job.superseded_by} 取代" if job.superseded_by else "任务已取消")
+            except Exception as e:
+                job.finish(FAILED, f"计算失败: {e}")
+                print(f"批量计算任务 {job.id} 失败: {e}")
+            finally:
+                with self._lock:
+                    self._current = None
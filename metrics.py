@@ -0,0 +1,182 @@
+# 运行指标
+# 计数器和耗时分布按 (名称, 标签) 保存在内存中（线程安全）。calculate.py、atomic_io.py和api.py在关键位置记录：
+# 各指标计算耗时和单元格数、批量计算耗时、数据集读取耗时、每个JSON文件读写的字节数、各接口的请求耗时；
+# 计算缓存命中率等已有统计由collector在导出时读取，不在热点路径上重复记录。
+# GET /metrics 以Prometheus文本格式导出，GET /api/metrics 返回JSON摘要。
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# 耗时分布的桶上界（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# 指标名 -> (类型, 说明)；只能记录这里登记的指标
+DEFINITIONS = {
+    "pdq_indicator_seconds": ("histogram", "单个指标的计算耗时（逐单元引擎，包括写出输出文件），source为computed或store（持久化缓存命中）"),
+    "pdq_indicator_cells_total": ("counter", "各指标计算的单元格数（单值指标计为1）"),
+    "pdq_batch_seconds": ("histogram", "batch_calculate_and_save端到端耗时"),
+    "pdq_reload_seconds": ("histogram", "重新加载数据的耗时（reload_data_cache、reload_data_files、refresh_changed_datasets）"),
+    "pdq_dataset_load_seconds": ("histogram", "数据集读取耗时，source为json或columnar（列式存储）"),
+    "pdq_file_read_bytes_total": ("counter", "读取的JSON文件字节数"),
+    "pdq_file_reads_total": ("counter", "JSON文件读取次数"),
+    "pdq_file_written_bytes_total": ("counter", "写入的文件字节数"),
+    "pdq_file_writes_total": ("counter", "文件写入次数"),
+    "pdq_http_request_seconds": ("histogram", "接口请求耗时（流式响应只计到响应头）"),
+    "pdq_cache_hits_total": ("counter", "计算结果内存缓存命中次数"),
+    "pdq_cache_misses_total": ("counter", "计算结果内存缓存未命中次数"),
+    "pdq_response_cache_total": ("counter", "文件读取接口的响应缓存统计"),
+    "pdq_data_version": ("gauge", "当前数据快照版本"),
+    "pdq_stale_indicators": ("gauge", "待重新计算的指标数"),
+}
+
+_lock = threading.Lock()
+
+# (名称, 标签元组) -> 计数器/瞬时值的数值，或耗时分布 [次数, 总和, 最大值, 各桶计数]
+_values = {}
+
+# 导出时调用的函数，返回 [(名称, 标签字典, 数值)]
+_collectors = []
+
+
+def _key(name, labels):
+    if name not in DEFINITIONS:
+        raise KeyError(f"未登记的指标: {name}")
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    """计数器加amount"""
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """记录一次耗时（秒）"""
+    key = _key(name, labels)
+    with _lock:
+        entry = _values.get(key)
+        if entry is None:
+            entry = _values[key] = [0, 0.0, 0.0, [0] * len(DEFAULT_BUCKETS)]
+        entry[0] += 1
+        entry[1] += value
+        entry[2] = max(entry[2], value)
+        buckets = entry[3]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                buckets[i] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    """计时代码块并记录到耗时分布（抛出异常时也记录）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def record_read(path, size):
+    """记录一次文件读取"""
+    inc("pdq_file_reads_total", file=path)
+    inc("pdq_file_read_bytes_total", size, file=path)
+
+
+def record_write(path, size):
+    """记录一次文件写入"""
+    inc("pdq_file_writes_total", file=path)
+    inc("pdq_file_written_bytes_total", size, file=path)
+
+
+def register_collector(func):
+    """登记导出时调用的函数：func() 返回 [(名称, 标签字典, 数值)]"""
+    _collectors.append(func)
+    return func
+
+
+def reset():
+    """清空已记录的数值（collector读取的统计不受影响）"""
+    with _lock:
+        _values.clear()
+
+
+def _collect():
+    """所有数值：{名称: {标签元组: 数值或耗时分布}}"""
+    with _lock:
+        snapshot = {key: (list(value[:3]) + [list(value[3])] if isinstance(value, list) else value)
+                    for key, value in _values.items()}
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            print(f"警告: 读取运行指标失败: {e}")
+            continue
+        for name, labels, value in samples:
+            snapshot[_key(name, labels)] = value
+    result = {}
+    for (name, labels), value in snapshot.items():
+        result.setdefault(name, {})[labels] = value
+    return result
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    escaped = []
+    for k, v in items:
+        v = v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{k}="{v}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        return repr(value)
+    return str(value)
+
+
+def render_prometheus():
+    """Prometheus文本格式（0.0.4）"""
+    lines = []
+    for name, series in sorted(_collect().items()):
+        kind, help_text = DEFINITIONS[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series.items()):
+            if kind != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+                continue
+            count, total, _, buckets = value
+            for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', _format_number(float(bound)))])} {bucket_count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """
+    JSON摘要：{名称: [{"labels": 标签, "value": 数值}]}，
+    耗时分布为 {"labels", "count", "sum", "mean", "max"}，按总耗时从大到小排列
+    """
+    result = {}
+    for name, series in sorted(_collect().items()):
+        kind = DEFINITIONS[name][0]
+        rows = []
+        for labels, value in series.items():
+            row = {"labels": dict(labels)}
+            if kind == "histogram":
+                count, total, peak, _ = value
+                row.update(count=count, sum=total, mean=total / count if count else None, max=peak)
+            else:
+                row["value"] = value
+            rows.append(row)
+        sort_key = (lambda row: -row["sum"]) if kind == "histogram" else (lambda row: sorted(row["labels"].items()))
+        result[name] = sorted(rows, key=sort_key)
+    return result
@@ -0,0 +1,162 @@
+# JSON文件读取接口的HTTP缓存
+# 序列化后的响应体按文件缓存在内存中（以文件的修改时间和大小判断是否仍有效，通过API写入时主动清除），
+# 响应带ETag（响应体内容哈希）和Last-Modified，客户端带If-None-Match/If-Modified-Since再次请求且未变化时返回304；
+# 较大的响应体按客户端支持压缩为gzip（安装brotli时优先br），压缩结果同样缓存，不必每次重新压缩。
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi.responses import Response
+
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 最多缓存的文件数（超过时淘汰最久未使用的）
+MAX_ENTRIES = 64
+
+# 小于该字节数的响应体不压缩
+MIN_COMPRESS_SIZE = 1024
+
+# gzip压缩级别
+GZIP_LEVEL = 6
+
+# 是否启用缓存（关闭时每次请求都重新读取文件，仍然返回ETag）
+ENABLED = True
+
+
+def file_stamp(path):
+    """文件的 (修改时间, 大小)，不存在返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class CachedBody:
+    """一个文件对应的已序列化响应体及其各种压缩形式"""
+
+    def __init__(self, stamp, body):
+        self.stamp = stamp
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.last_modified = formatdate(stamp[0] / 1e9, usegmt=True) if stamp else None
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """按编码返回响应体（identity/gzip/br），压缩结果缓存"""
+        if encoding == "identity":
+            return self.body
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == "br":
+                    data = brotli.compress(self.body)
+                else:
+                    data = gzip.compress(self.body, compresslevel=GZIP_LEVEL)
+                self._encoded[encoding] = data
+            return data
+
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+# 命中统计
+stats = {"hits": 0, "misses": 0, "not_modified": 0}
+
+
+@metrics.register_collector
+def _collect_metrics():
+    return [("pdq_response_cache_total", {"result": name}, value) for name, value in stats.items()]
+
+
+def serialize(content):
+    """与FastAPI默认JSONResponse相同的序列化方式"""
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def get(path, build):
+    """
+    返回文件path对应的CachedBody：缓存有效时直接返回，否则调用build()生成响应内容并序列化后缓存。
+    build可以抛出HTTPException（如文件不存在），此时不缓存。
+    """
+    key = os.fspath(path)
+    stamp = file_stamp(key)
+    if ENABLED and stamp is not None:
+        with _lock:
+            entry = _entries.get(key)
+            if entry is not None and entry.stamp == stamp:
+                _entries.move_to_end(key)
+                stats["hits"] += 1
+                return entry
+    with _lock:
+        stats["misses"] += 1
+    entry = CachedBody(stamp, serialize(build()))
+    # build期间文件被修改时不缓存（下次请求重新读取）
+    if ENABLED and stamp is not None and file_stamp(key) == stamp:
+        with _lock:
+            _entries[key] = entry
+            _entries.move_to_end(key)
+            while len(_entries) > MAX_ENTRIES:
+                _entries.popitem(last=False)
+    return entry
+
+
+def invalidate(path=None):
+    """清除文件path的缓存（省略时清除全部）"""
+    with _lock:
+        if path is None:
+            _entries.clear()
+        else:
+            _entries.pop(os.fspath(path), None)
+
+
+def _not_modified(entry, headers):
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or entry.etag in tags or ("W/" + entry.etag) in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since and entry.stamp:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        # HTTP日期只精确到秒
+        return int(entry.stamp[0] / 1e9) <= since
+    return False
+
+
+def _choose_encoding(entry, headers):
+    if len(entry.body) < MIN_COMPRESS_SIZE:
+        return "identity"
+    accepted = {item.split(";")[0].strip().lower() for item in headers.get("accept-encoding", "").split(",")}
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return "identity"
+
+
+def respond(entry, headers):
+    """根据请求头生成响应：未变化时返回304，否则按客户端支持的编码返回响应体"""
+    response_headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if entry.last_modified:
+        response_headers["Last-Modified"] = entry.last_modified
+    if _not_modified(entry, headers):
+        with _lock:
+            stats["not_modified"] += 1
+        return Response(status_code=304, headers=response_headers)
+    encoding = _choose_encoding(entry, headers)
+    if encoding != "identity":
+        response_headers["Content-Encoding"] = encoding
+    return Response(content=entry.encoded(encoding), media_type="application/json", headers=response_headers)
@@ -0,0 +1,330 @@
+# 计算结果文件
+# 一次计算的所有指标和常量保存在一个结果文件（output/results.pdq）中，代替逐指标格式化写出的output/<指标>.json：
+#   8字节标识 + 头部长度 + 头部JSON（格式版本、写出时间、各指标的年份/国家索引、数据偏移、常量值）
+#   + 各逐单元指标的 年份×国家 float64矩阵和有效位图（与columnar_store相同的编码，按64字节对齐）。
+# 读取时以内存映射方式打开，可按指标、年份、国家随机读取，不解析整个文件；
+# 批量计算中的结果先暂存，计算结束时一次写出；旧格式的output/<指标>.json在请求时才从结果文件生成。
+import json
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+import atomic_io
+import columnar_store
+
+# 结果文件名（位于输出目录下）
+FILENAME = "results.pdq"
+
+# 文件标识和格式版本（格式变化时递增，旧格式的结果文件视为不存在）
+MAGIC = b"PDQRES\x00\x00"
+FORMAT_VERSION = 1
+
+# 数据块对齐字节数
+ALIGN = 64
+
+# 是否同时立即写出旧格式的output/<指标>.json（关闭时在请求时才生成）
+WRITE_LEGACY = False
+
+_HEADER = struct.Struct("<8sQ")
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+class ResultArtifact:
+    """打开的结果文件：指标名 -> 结果（逐单元指标为内存映射的只读数据集，其他为JSON对象）"""
+
+    def __init__(self, path, header, buffer):
+        self.path = path
+        self.format = header["format"]
+        self.created = header["created"]
+        self._buffer = buffer
+        self._axes = header["axes"]
+        self._entries = header["entries"]
+        self._datasets = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        """结果文件中的指标（写入顺序）"""
+        return list(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def data_version(self, name):
+        """指标结果对应的数据版本"""
+        return self._entries[name].get("data_version")
+
+    def written(self, name):
+        """指标结果写入的时间（纳秒）"""
+        return self._entries[name]["written"]
+
+    def _arrays(self, entry):
+        years, countries = self._axes[entry["axes"]]
+        shape = (len(years), len(countries))
+        size = shape[0] * shape[1]
+        values = self._buffer[entry["values"]:entry["values"] + size * 8].view(np.float64).reshape(shape)
+        flags = self._buffer[entry["flags"]:entry["flags"] + size].reshape(shape)
+        return years, countries, values, flags
+
+    def get(self, name):
+        """指标的完整结果（与旧格式输出文件内容相同的映射），不存在时抛出KeyError"""
+        entry = self._entries[name]
+        if entry["kind"] == "object":
+            return entry["data"]
+        with self._lock:
+            dataset = self._datasets.get(name)
+            if dataset is None:
+                years, countries, values, flags = self._arrays(entry)
+                meta = {
+                    "years": years,
+                    "countries": countries,
+                    "hash": None,
+                    "row_orders": entry.get("row_orders", {}),
+                    "extras": entry.get("extras", {}),
+                }
+                dataset = self._datasets[name] = columnar_store.ColumnarDataset(self.path, meta, values, flags)
+            return dataset
+
+    def to_dict(self, name):
+        """指标结果转换为普通字典"""
+        return columnar_store.to_dict(self.get(name))
+
+    def cell(self, name, year, country, default=None):
+        """随机读取一个单元格（只读取该位置的值和标记），不存在时返回default"""
+        entry = self._entries[name]
+        if entry["kind"] == "object":
+            return entry["data"].get(year, {}).get(country, default)
+        with self._lock:
+            index = self._indexes.get(entry["axes"])
+            if index is None:
+                years, countries = self._axes[entry["axes"]]
+                index = self._indexes[entry["axes"]] = (
+                    {y: i for i, y in enumerate(years)}, {c: j for j, c in enumerate(countries)}
+                )
+        i, j = index[0].get(year), index[1].get(country)
+        if i is None or j is None:
+            return default
+        extra = entry.get("extras", {}).get(year, {})
+        if country in extra:
+            return extra[country]
+        _, _, values, flags = self._arrays(entry)
+        flag = int(flags[i, j])
+        if not flag & columnar_store.PRESENT:
+            return default
+        if not flag & columnar_store.VALID:
+            return None
+        value = float(values[i, j])
+        return int(value) if flag & columnar_store.INT else value
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        magic, header_size = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC:
+            return None
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    if header.get("format") != FORMAT_VERSION:
+        return None
+    buffer = np.memmap(path, dtype=np.uint8, mode='r') if header["data_size"] else np.zeros(0, dtype=np.uint8)
+    data_start = _aligned(_HEADER.size + header_size)
+    return ResultArtifact(path, header, buffer[data_start:data_start + header["data_size"]])
+
+
+_opened = {}
+_opened_lock = threading.Lock()
+
+
+def open_artifact(path):
+    """打开结果文件（文件未变化时复用已打开的），不存在或格式不符返回None"""
+    path = os.fspath(path)
+    stamp = columnar_store._source_stamp(path)
+    if stamp is None:
+        return None
+    with _opened_lock:
+        cached = _opened.get(path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+    try:
+        artifact = _read(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        artifact = None
+    with _opened_lock:
+        _opened[path] = (stamp, artifact)
+    return artifact
+
+
+class _Layout:
+    """结果文件的数据区：依次追加各指标的矩阵，记录偏移"""
+
+    def __init__(self):
+        self.axes = {}
+        self.blocks = []
+        self.size = 0
+
+    def _append(self, array):
+        offset = self.size
+        self.blocks.append((offset, array.tobytes()))
+        self.size = _aligned(offset + array.nbytes)
+        return offset
+
+    def add_panel(self, entry, years, countries, values, flags):
+        key = json.dumps([years, countries], ensure_ascii=False)
+        if key not in self.axes:
+            self.axes[key] = len(self.axes)
+        entry["axes"] = self.axes[key]
+        entry["values"] = self._append(np.ascontiguousarray(values, dtype=np.float64))
+        entry["flags"] = self._append(np.ascontiguousarray(flags, dtype=np.uint8))
+        return entry
+
+    def add(self, data, data_version, written):
+        """编码一个新结果：面板数据按矩阵保存，其他（单值 {"value": 值} 等）保存在头部"""
+        entry = {"data_version": data_version, "written": written}
+        if not columnar_store._is_panel(data):
+            entry.update(kind="object", data=data)
+            return entry
+        meta, values, flags = columnar_store._panel_arrays(data)
+        entry["kind"] = "panel"
+        if meta["row_orders"]:
+            entry["row_orders"] = meta["row_orders"]
+        if meta["extras"]:
+            entry["extras"] = meta["extras"]
+        return self.add_panel(entry, meta["years"], meta["countries"], values, flags)
+
+    def copy(self, artifact, name):
+        """沿用已有结果文件中的一个结果（直接复制矩阵，不重新编码）"""
+        entry = dict(artifact._entries[name])
+        if entry["kind"] == "object":
+            return entry
+        years, countries, values, flags = artifact._arrays(entry)
+        return self.add_panel(entry, years, countries, values, flags)
+
+
+def write(path, updates):
+    """
+    把 {指标名: (结果, 数据版本)} 写入结果文件：与已有结果合并（同名替换，其余保留），整体原子替换。
+    """
+    existing = open_artifact(path)
+    names = existing.names() if existing is not None else []
+    names += [name for name in updates if name not in names]
+    written = time.time_ns()
+
+    layout = _Layout()
+    entries = {}
+    for name in names:
+        if name in updates:
+            entries[name] = layout.add(*updates[name], written)
+        else:
+            entries[name] = layout.copy(existing, name)
+    header = {
+        "format": FORMAT_VERSION,
+        "created": time.time(),
+        "axes": [json.loads(key) for key in layout.axes],
+        "entries": entries,
+        "data_size": layout.size,
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    data_start = _aligned(_HEADER.size + len(header_bytes))
+    content = bytearray(data_start + layout.size)
+    content[:_HEADER.size] = _HEADER.pack(MAGIC, len(header_bytes))
+    content[_HEADER.size:_HEADER.size + len(header_bytes)] = header_bytes
+    for offset, block in layout.blocks:
+        content[data_start + offset:data_start + offset + len(block)] = block
+    directory = os.path.dirname(os.fspath(path))
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 结果可以随时重新计算，无需等待写入磁盘
+    atomic_io.atomic_write(path, bytes(content), fsync=False)
+
+
+# ==================== 暂存与延迟写出 ====================
+class Staging:
+    """一个deferred()块暂存的结果：结果文件路径 -> {指标名: (结果, 数据版本)}"""
+
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+
+# 各线程当前使用的暂存（不在deferred()中时为None）
+_local = threading.local()
+
+# 写结果文件时持有：写入与已有结果合并，不同线程的写出依次进行
+_write_lock = threading.Lock()
+
+
+def stage(path, name, data, data_version=None):
+    """登记一个指标结果：当前线程在deferred()中时暂存到结束时写出，否则立即写入结果文件"""
+    staging = getattr(_local, 'staging', None)
+    if staging is None:
+        with _write_lock:
+            write(path, {name: (data, data_version)})
+        return
+    with staging.lock:
+        staging.pending.setdefault(os.fspath(path), {})[name] = (data, data_version)
+
+
+def _flush(staging):
+    """写出暂存的结果"""
+    with _write_lock, staging.lock:
+        while staging.pending:
+            path, updates = staging.pending.popitem()
+            write(path, updates)
+
+
+@contextmanager
+def deferred(staging=None):
+    """
+    当前线程在代码块中登记的结果暂存，结束时（包括出错时，已完成的结果仍然保存）一次写出；可以嵌套，
+    只影响当前线程。staging: 加入已有的暂存（线程池中的计算加入提交线程的暂存），由创建它的块写出。
+    """
+    previous = getattr(_local, 'staging', None)
+    owner = staging is None and previous is None
+    _local.staging = staging or previous or Staging()
+    try:
+        yield _local.staging
+    finally:
+        current, _local.staging = _local.staging, previous
+        if owner:
+            _flush(current)
+
+
+# ==================== 旧格式输出文件 ====================
+def legacy_json(data):
+    """与旧版本save_to_json相同的输出文件内容"""
+    return json.dumps(columnar_store.to_dict(data), ensure_ascii=False, indent=2)
+
+
+def materialize(path, name, target):
+    """
+    按需生成旧格式的输出文件target：文件不存在或比结果文件旧时从结果文件重新生成。
+    返回是否存在可用的文件（结果文件中没有该指标时沿用已有的文件）。
+    """
+    artifact = open_artifact(path)
+    if artifact is None or name not in artifact:
+        return os.path.exists(target)
+    target_stamp = columnar_store._source_stamp(target)
+    # 按该指标结果写入的时间判断（只更新其他指标时不覆盖通过API修改过的输出文件）
+    if target_stamp is None or target_stamp["mtime_ns"] <= artifact.written(name):
+        atomic_io.atomic_write(target, legacy_json(artifact.get(name)), fsync=False)
+    return True
+
+
+if __name__ == "__main__":
+    # python result_artifact.py [指标...]  从结果文件生成旧格式的output/<指标>.json（默认全部）
+    import sys
+    path = os.path.join("output", FILENAME)
+    artifact = open_artifact(path)
+    if artifact is None:
+        print(f"错误: 结果文件不存在: {path}")
+        sys.exit(1)
+    for name in sys.argv[1:] or artifact.names():
+        target = os.path.join("output", f"{name}.json")
+        materialize(path, name, target)
+        print(f"✓ {name} -> {target}")
@@ -0,0 +1,97 @@
+# 计算结果的持久化缓存
+# 以 指标名 + 其依赖的jsondata内容哈希 为键，把指标结果保存在本地SQLite中，
+# 服务重启或修改无关数据文件后仍可直接复用；输入内容变化后旧结果在读写时自动淘汰。
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# 数据库文件位置
+DB_PATH = os.path.join("cache", "results.sqlite")
+
+# 是否启用持久化缓存
+ENABLED = True
+
+# 计算公式或保存格式变化时递增，使旧版本的缓存全部失效
+# （2: 逐单元指标同时保存抛出异常的单元格）
+CACHE_VERSION = 2
+
+
+def hash_data(data):
+    """计算数据内容的哈希（与JSON文件的缩进、键顺序无关）"""
+    text = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _connect():
+    os.makedirs(os.path.dirname(DB_PATH) or '.', exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS results ("
+        " name TEXT NOT NULL,"
+        " input_hash TEXT NOT NULL,"
+        " value TEXT NOT NULL,"
+        " updated REAL NOT NULL,"
+        " PRIMARY KEY (name, input_hash))"
+    )
+    return conn
+
+
+def load(name, input_hash):
+    """
+    读取指标结果，返回 (是否命中, 值)。
+    该指标存在其他输入哈希的旧结果时一并删除。
+    """
+    if not ENABLED:
+        return False, None
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM results WHERE name = ? AND input_hash = ?",
+                (name, input_hash)
+            ).fetchone()
+            if row is None:
+                with conn:
+                    conn.execute("DELETE FROM results WHERE name = ? AND input_hash != ?", (name, input_hash))
+                return False, None
+            return True, json.loads(row[0])
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"警告: 读取持久化缓存失败 {name}: {e}")
+        return False, None
+
+
+def store(name, input_hash, value):
+    """保存指标结果，替换该指标的旧结果"""
+    if not ENABLED:
+        return
+    try:
+        text = json.dumps(value, ensure_ascii=False)
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM results WHERE name = ?", (name,))
+                conn.execute(
+                    "INSERT INTO results (name, input_hash, value, updated) VALUES (?, ?, ?, ?)",
+                    (name, input_hash, text, time.time())
+                )
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"警告: 写入持久化缓存失败 {name}: {e}")
+
+
+def clear():
+    """清空持久化缓存"""
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM results")
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"警告: 清空持久化缓存失败: {e}")
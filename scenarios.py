@@ -0,0 +1,137 @@
+# 权重情景分析
+# R = W_OA·R_oa_bar + W_OD·R_od_bar + W_OP·R_op_bar，三个分量都与权重无关。
+# 分量从当前快照的计算结果中读取（没有时用向量化引擎对整个面板计算一次，不写任何文件），
+# 一组或成千上万组权重组成 (情景数×3) 矩阵，与 (3×单元格数) 的分量矩阵做一次矩阵乘积得到所有情景的R，再计算各年排名。
+import numpy as np
+
+import calculate
+import calculate_vec
+
+# 权重键（与weight.json相同）和对应的分量指标
+WEIGHT_KEYS = ('W_OA', 'W_OD', 'W_OP')
+COMPONENTS = ('R_oa_bar', 'R_od_bar', 'R_op_bar')
+
+# 每次矩阵乘积最多生成的R值个数，情景很多时分块计算，内存占用不随情景数增长
+CHUNK_CELLS = 2_000_000
+
+# 网格最多包含的情景数
+MAX_SCENARIOS = 100_000
+
+
+def components(years=None, countries=None):
+    """
+    返回 (年份, 国家, 分量矩阵)：分量矩阵形状为 (3, 年份数, 国家数)，缺失为NaN。
+    years/countries默认为批量计算的全部年份和国家。
+    """
+    result = calculate.query_results(list(COMPONENTS), years, countries)
+    out_years, out_countries = result["years"], result["countries"]
+    if not result["stale"]:
+        matrix = np.array([
+            [[np.nan if result["values"][name][y][c] is None else result["values"][name][y][c]
+              for c in out_countries] for y in out_years]
+            for name in COMPONENTS
+        ], dtype=float).reshape(len(COMPONENTS), len(out_years), len(out_countries))
+        return out_years, out_countries, matrix
+
+    # 分量尚未计算：对整个面板做一次向量化计算（只在内存中）
+    with calculate.pin_snapshot():
+        calculate.preload_datasets()
+        panel = calculate_vec.Panel()
+        cells, _ = calculate_vec.compute_all(panel)
+    rows = [panel.year_index[y] for y in out_years]
+    cols = [panel.country_index[c] for c in out_countries]
+    matrix = np.stack([cells[name][np.ix_(rows, cols)] for name in COMPONENTS])
+    matrix[~np.isfinite(matrix)] = np.nan
+    return out_years, out_countries, matrix
+
+
+def weight_matrix(weights):
+    """把 [{"W_OA":..,"W_OD":..,"W_OP":..}] 转换为 (情景数×3) 矩阵"""
+    try:
+        return np.array([[float(w[key]) for key in WEIGHT_KEYS] for w in weights], dtype=float).reshape(-1, 3)
+    except KeyError as e:
+        raise ValueError(f"权重缺少 {e.args[0]}")
+
+
+def weight_grid(step):
+    """
+    权重网格：三个权重都是step的整数倍、非负且和为1的所有组合。
+    例如step=0.1时共66组。
+    """
+    if not 0 < step <= 1:
+        raise ValueError(f"步长必须大于0且不超过1: {step}")
+    n = int(round(1 / step))
+    if n <= 0 or abs(n * step - 1) > 1e-9:
+        raise ValueError(f"步长必须能整除1: {step}")
+    count = (n + 1) * (n + 2) // 2
+    if count > MAX_SCENARIOS:
+        raise ValueError(f"网格包含{count}个情景，超过上限{MAX_SCENARIOS}")
+    a, b = np.meshgrid(np.arange(n + 1), np.arange(n + 1), indexing='ij')
+    keep = a + b <= n
+    a, b = a[keep], b[keep]
+    return np.stack([a, b, n - a - b], axis=1) / n
+
+
+def rank(values):
+    """沿最后一个轴（国家）从大到小排名（1为最高），NaN的排名为0"""
+    valid = ~np.isnan(values)
+    order = np.argsort(np.where(valid, -values, np.inf), axis=-1, kind='stable')
+    ranks = np.empty(values.shape, dtype=np.int64)
+    positions = np.broadcast_to(np.arange(1, values.shape[-1] + 1), values.shape)
+    np.put_along_axis(ranks, order, positions, axis=-1)
+    return np.where(valid, ranks, 0)
+
+
+def evaluate(weights, matrix):
+    """
+    所有情景的R，返回 (情景数, 年份数, 国家数)；任一分量缺失时为NaN。
+    相当于 (情景数×3) @ (3×单元格数) 的矩阵乘积，按与R()相同的顺序逐项相加，当前权重的结果与R.json完全一致。
+    """
+    shape = matrix.shape[1:]
+    flat = matrix.reshape(len(COMPONENTS), -1)
+    result = weights[:, 0:1] * flat[0] + weights[:, 1:2] * flat[1] + weights[:, 2:3] * flat[2]
+    return result.reshape((len(weights),) + shape)
+
+
+def run(weights, years=None, countries=None, keep=100):
+    """
+    计算权重情景：weights为 (情景数×3) 矩阵。
+    返回 {"years", "countries", "weights", "values", "ranks", "rank_stats"}：
+    values/ranks为前keep个情景的R矩阵和排名矩阵；rank_stats为所有情景下各单元格排名的最小、最大和平均值
+    （R缺失的单元格最大值为0）。
+    """
+    weights = np.asarray(weights, dtype=float).reshape(-1, 3)
+    if len(weights) == 0:
+        raise ValueError("至少需要一组权重")
+    out_years, out_countries, matrix = components(years, countries)
+    cells = max(matrix[0].size, 1)
+    chunk = max(1, CHUNK_CELLS // cells)
+
+    kept_values, kept_ranks = [], []
+    rank_min = rank_max = rank_sum = None
+    for start in range(0, len(weights), chunk):
+        values = evaluate(weights[start:start + chunk], matrix)
+        ranks = rank(values)
+        if start == 0 or start < keep:
+            kept_values.append(values[:keep - start])
+            kept_ranks.append(ranks[:keep - start])
+        # 缺失单元格的排名为0，在所有情景中位置相同
+        low = np.where(ranks > 0, ranks, np.iinfo(np.int64).max).min(axis=0)
+        high, total = ranks.max(axis=0), ranks.sum(axis=0)
+        if rank_min is None:
+            rank_min, rank_max, rank_sum = low, high, total
+        else:
+            rank_min, rank_max, rank_sum = np.minimum(rank_min, low), np.maximum(rank_max, high), rank_sum + total
+
+    return {
+        "years": out_years,
+        "countries": out_countries,
+        "weights": weights,
+        "values": np.concatenate(kept_values),
+        "ranks": np.concatenate(kept_ranks),
+        "rank_stats": {
+            "min": rank_min,
+            "max": rank_max,
+            "mean": rank_sum / len(weights),
+        },
+    }
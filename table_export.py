@@ -0,0 +1,182 @@
+# 数据表的流式导出
+# 年份->国家->值 数据按行生成（第一列为年份，其余各列为国家），逐行写出为Excel（openpyxl只写模式）、CSV或Parquet，
+# 不在内存中构造整张表格或整个工作簿；可以只导出部分年份和国家。
+import csv
+import io
+import os
+import tempfile
+from collections.abc import Mapping
+
+from openpyxl import Workbook
+
+# 支持的导出格式：格式 -> (文件扩展名, MIME类型)
+FORMATS = {
+    "xlsx": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("csv", "text/csv; charset=utf-8"),
+    "parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# CSV和Parquet每次写出的行数
+CHUNK_ROWS = 500
+
+# 读取临时文件时每次返回的字节数
+READ_CHUNK_SIZE = 64 * 1024
+
+# Excel工作表名最长31个字符
+MAX_SHEET_NAME = 31
+
+
+def is_single_value(data):
+    """是否为单值文件（{"value": 值}）"""
+    return 'value' in data and len(data) == 1
+
+
+def table_axes(data, years=None, countries=None):
+    """
+    导出的年份和国家：默认为全部年份（排序）和所有年份中出现过的国家（排序）；
+    years/countries指定时只保留数据中存在的，顺序与指定的一致。
+    """
+    all_years = sorted(data.keys())
+    if years is not None:
+        existing = set(all_years)
+        all_years = [y for y in years if y in existing]
+    all_countries = set()
+    for year in all_years:
+        row = data[year]
+        if isinstance(row, Mapping):
+            all_countries.update(row.keys())
+    if countries is not None:
+        return all_years, [c for c in countries if c in all_countries]
+    return all_years, sorted(all_countries)
+
+
+def table(name, data, years=None, countries=None):
+    """返回 (表头, 行迭代器)；行在迭代时才生成"""
+    if is_single_value(data):
+        return ['函数名', '值'], iter([[name, data['value']]])
+    row_years, row_countries = table_axes(data, years, countries)
+
+    def rows():
+        for year in row_years:
+            row = data[year]
+            if isinstance(row, Mapping):
+                yield [year] + [row.get(country) for country in row_countries]
+            else:
+                yield [year]
+    return ['年份'] + row_countries, rows()
+
+
+def _read_and_remove(path):
+    """逐块读取临时文件，读完后删除"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def _temp_path(suffix):
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def stream_xlsx(sheets):
+    """
+    sheets: 可迭代的 (工作表名, 表头, 行迭代器)。
+    以只写模式逐行写入工作簿（openpyxl把行写入临时文件，内存占用与行数无关），再分块返回文件内容。
+    """
+    workbook = Workbook(write_only=True)
+    for sheet_name, header, rows in sheets:
+        sheet = workbook.create_sheet(title=str(sheet_name)[:MAX_SHEET_NAME])
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+    path = _temp_path(".xlsx")
+    try:
+        workbook.save(path)
+    except BaseException:
+        os.unlink(path)
+        raise
+    yield from _read_and_remove(path)
+
+
+def stream_csv(header, rows):
+    """逐块生成CSV（UTF-8，带BOM以便Excel正确识别中文）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _to_float(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return float(value)
+
+
+def stream_parquet(header, rows):
+    """
+    逐块写入Parquet文件（每CHUNK_ROWS行一个行组）后分块返回。
+    需要安装pyarrow；第一列为字符串，其余各列为float64（非数值的单元格写为空值）。
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(header[0], pa.string())] + [(str(name), pa.float64()) for name in header[1:]])
+    path = _temp_path(".parquet")
+    try:
+        with pq.ParquetWriter(path, schema) as writer:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == CHUNK_ROWS:
+                    writer.write_table(_parquet_chunk(pa, schema, chunk))
+                    chunk = []
+            if chunk:
+                writer.write_table(_parquet_chunk(pa, schema, chunk))
+    except BaseException:
+        os.unlink(path)
+        raise
+    yield from _read_and_remove(path)
+
+
+def _parquet_chunk(pa, schema, chunk):
+    columns = [pa.array([str(row[0]) for row in chunk], pa.string())]
+    for j in range(1, len(schema)):
+        columns.append(pa.array([_to_float(row[j]) if j < len(row) else None for row in chunk], pa.float64()))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def parquet_available():
+    """是否安装了pyarrow（Parquet导出需要）"""
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def stream(fmt, name, data, years=None, countries=None):
+    """按格式流式导出一个数据表，返回字节块迭代器"""
+    header, rows = table(name, data, years, countries)
+    if fmt == "xlsx":
+        return stream_xlsx([('数据', header, rows)])
+    if fmt == "csv":
+        return stream_csv(header, rows)
+    if fmt == "parquet":
+        return stream_parquet(header, rows)
+    raise ValueError(f"不支持的导出格式: {fmt}")
@@ -0,0 +1,43 @@
+# 测试公共设置：项目模块位于仓库根目录；计算在临时目录中进行（jsondata、output、cache均为相对路径）
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import calculate  # noqa: E402
+import result_store  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """复制项目的jsondata到临时目录并切换工作目录，关闭持久化缓存，结束后恢复"""
+    shutil.copytree(os.path.join(ROOT, "jsondata"), tmp_path / "jsondata")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(result_store, "ENABLED", False)
+    calculate.reload_data_cache()
+    yield tmp_path
+    calculate.reload_data_cache()
+
+
+@pytest.fixture
+def store(workspace, monkeypatch):
+    """在临时工作目录中启用持久化缓存（cache/results.sqlite为相对路径）"""
+    monkeypatch.setattr(result_store, "ENABLED", True)
+    return workspace
+
+
+@pytest.fixture
+def client(workspace):
+    """在临时工作目录中访问API的TestClient"""
+    from fastapi.testclient import TestClient
+
+    import api
+    import response_cache
+    # 响应缓存以相对路径为键，清除之前的测试留下的条目
+    response_cache.invalidate()
+    with TestClient(api.app) as test_client:
+        yield test_client
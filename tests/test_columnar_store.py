@@ -0,0 +1,55 @@
+# 列式存储与源JSON文件保持一致：源文件删除、同一时间精度内改写为相同大小时不返回旧数据
+import json
+import os
+
+import columnar_store
+
+DATA = {"2020": {"CN": 1.5, "US": None}, "2021": {"CN": 2, "US": 3.25}}
+
+
+def _write(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_load_roundtrip(workspace):
+    path = os.path.join("jsondata", "sample.json")
+    _write(path, DATA)
+    columnar_store.save(path, DATA)
+    assert columnar_store.to_dict(columnar_store.load(path)) == DATA
+
+
+def test_deleted_source_drops_store(workspace):
+    path = os.path.join("jsondata", "sample.json")
+    _write(path, DATA)
+    columnar_store.save(path, DATA)
+    os.remove(path)
+    assert columnar_store.load(path) is None
+    assert not os.path.exists(columnar_store.store_path(path))
+
+
+def test_same_stamp_rewrite_is_detected(workspace):
+    path = os.path.join("jsondata", "sample.json")
+    _write(path, DATA)
+    columnar_store.save(path, DATA)
+    stat = os.stat(path)
+    changed = {"2020": {"CN": 9.5, "US": None}, "2021": {"CN": 2, "US": 3.25}}
+    _write(path, changed)
+    # 改写为相同大小，并恢复原来的修改时间（模拟文件系统时间精度内的改写）
+    assert os.stat(path).st_size == stat.st_size
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert columnar_store.load(path) is None
+
+
+def test_save_replaces_previous_version(workspace):
+    path = os.path.join("jsondata", "sample.json")
+    _write(path, DATA)
+    columnar_store.save(path, DATA)
+    old = columnar_store.load(path)
+    changed = {"2020": {"CN": 7}}
+    _write(path, changed)
+    columnar_store.save(path, changed)
+    # 已打开的旧版本仍然可读，目录中只保留新版本的矩阵文件
+    assert columnar_store.to_dict(old) == DATA
+    assert columnar_store.to_dict(columnar_store.load(path)) == changed
+    assert len([n for n in os.listdir(columnar_store.store_path(path)) if n.endswith(".npy")]) == 2
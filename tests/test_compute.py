@@ -0,0 +1,46 @@
+# 按需计算只更新内存缓存，不写出结果文件
+import os
+
+import calculate
+import result_artifact
+
+
+def _artifact_state():
+    path = calculate.results_path()
+    with open(path, 'rb') as f:
+        content = f.read()
+    return os.stat(path).st_mtime_ns, content, dict(calculate._output_versions)
+
+
+def test_compute_cells_writes_no_outputs(workspace):
+    calculate.batch_calculate_and_save(max_workers=2)
+    before = _artifact_state()
+
+    calculate.reload_data_cache()
+    result = calculate.compute_cells('R', [(2010, 'China')])
+    assert result["results"][0]["value"] is not None
+    assert _artifact_state() == before
+
+
+def test_compute_endpoint_writes_no_outputs(client):
+    calculate.batch_calculate_and_save(max_workers=2)
+    before = _artifact_state()
+
+    calculate.reload_data_cache()
+    response = client.post("/api/results/compute", json={
+        "indicator": "R", "cells": [{"year": "2010", "country": "China"}],
+    })
+    assert response.status_code == 200
+    assert response.json()["results"][0]["components"]["S_od_t1"] is not None
+    response = client.post("/api/results/compute", json={"indicator": "r_open_t1"})
+    assert response.status_code == 200
+    assert _artifact_state() == before
+
+
+def test_batch_after_compute_writes_cached_constants(workspace):
+    calculate.compute_cells('R', [(2010, 'China')])
+    assert not os.path.exists(calculate.results_path())
+    calculate.batch_calculate_and_save(max_workers=2)
+    artifact = result_artifact.open_artifact(calculate.results_path())
+    for name in calculate.saved_indicators():
+        assert name in artifact, name
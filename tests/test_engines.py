@@ -0,0 +1,95 @@
+# 三种批量计算引擎（逐单元、向量化、多进程）结果一致，单元格增量计算与完整重算结果一致
+import json
+
+import pytest
+
+import calculate
+import columnar_store
+
+
+def _set_cell(key, year, country, value):
+    """修改临时目录中数据文件的一个单元格"""
+    path = calculate.json_files[key]
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    data[year][country] = value
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return data
+
+
+def _outputs():
+    """已保存的逐单元指标结果、内存中的常量，以及批量输出范围内已缓存的单元格（抛出异常的单元格不缓存）"""
+    cells = {name: _normalized(calculate._read_output(name)) for name, info in calculate.INDICATORS.items()
+             if info['kind'] == 'cell'}
+    constants = {name: calculate._results()['constants'].get(name, "未缓存")
+                 for name, info in calculate.INDICATORS.items() if info['kind'] == 'constant'}
+    years, countries = calculate.get_batch_axes()
+    functions = calculate._results()['functions']
+    cached = {
+        name: sorted((str(y), c) for y in years for c in countries if c in functions.get(name, {}).get(str(y), {}))
+        for name in cells
+    }
+    return cells, constants, cached
+
+
+def _run(engine):
+    """用指定引擎完整计算一次，返回 ({逐单元指标: 结果}, {常量: 值})"""
+    calculate.reload_data_cache()
+    calculate.batch_calculate_and_save(engine=engine, max_workers=2)
+    return _outputs()
+
+
+def _normalized(value):
+    return json.loads(json.dumps(columnar_store.to_dict(value)))
+
+
+# 注入的空值：(数据键, 年份, 国家)；None表示不修改
+NULL_CASES = [
+    None,
+    ("F2", "2000", "China"),
+    ("alpha_L", "2005", "EU27"),
+    ("cooperation", "2010", "STLCs"),
+    ("OA", "1999", "China"),
+    ("F3", "2012", "EU27"),
+    ("scientist", "2016", "China"),
+    ("OP", "2003", "STLCs"),
+]
+
+
+@pytest.mark.parametrize("null", NULL_CASES, ids=lambda case: "original" if case is None else "-".join(case))
+@pytest.mark.parametrize("engine", ["vectorized", "process"])
+def test_engine_matches_cell(workspace, engine, null):
+    if null is not None:
+        _set_cell(*null, None)
+    expected = _run("cell")
+    actual = _run(engine)
+    assert actual[1] == expected[1]
+    for name, results in expected[0].items():
+        assert actual[0][name] == results, name
+        assert actual[2][name] == expected[2][name], name
+
+
+@pytest.mark.parametrize("engine", ["cell", "vectorized", "process"])
+@pytest.mark.parametrize("change", [
+    ("OA", "2001", "China", 12345),
+    ("F2", "2010", "EU27", 2.5),
+    ("world_total", "2015", "word_scientist", 9000000),
+    ("OP", "2020", "STLCs", 0.9),
+    ("alpha_L", "2008", "China", None),
+    ("cooperation", "2012", "EU27", None),
+])
+def test_propagation_matches_full_recompute(workspace, change, engine):
+    key, year, country, value = change
+    calculate.batch_calculate_and_save(engine=engine, max_workers=2)
+    old_data = columnar_store.to_dict(calculate.get_dataset(key))
+    new_data = _set_cell(key, year, country, value)
+    cells = calculate.diff_data_cells(old_data, new_data)
+    assert cells == [(year, country)]
+    assert calculate.propagate_data_change(key, new_data, cells) is not None
+    propagated = _outputs()
+
+    expected = _run("cell")
+    assert propagated[1] == expected[1]
+    for name, results in expected[0].items():
+        assert propagated[0][name] == results, name
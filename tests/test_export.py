@@ -0,0 +1,34 @@
+# 流式导出：年份参数支持范围，工作簿导出每个指标一个工作表
+import csv
+import io
+
+import openpyxl
+
+import calculate
+
+
+def _csv_years(response):
+    rows = list(csv.reader(io.StringIO(response.content.decode('utf-8-sig'))))
+    return [row[0] for row in rows[1:]]
+
+
+def test_export_year_range(client):
+    response = client.get("/api/jsondata/OA.json/export", params={"format": "csv", "years": "2018-2019,2021"})
+    assert response.status_code == 200
+    assert _csv_years(response) == ["2018", "2019", "2021"]
+
+
+def test_export_invalid_years(client):
+    response = client.get("/api/jsondata/OA.json/export", params={"format": "csv", "years": "2018-x"})
+    assert response.status_code == 400
+
+
+def test_output_workbook_year_range(client):
+    calculate.batch_calculate_and_save(max_workers=2)
+    response = client.get("/api/output/workbook/export", params={"years": "2018-2019", "countries": "China"})
+    assert response.status_code == 200
+    workbook = openpyxl.load_workbook(io.BytesIO(response.content), read_only=True)
+    assert "R" in workbook.sheetnames
+    rows = list(workbook["R"].iter_rows(values_only=True))
+    assert [str(row[0]) for row in rows[1:]] == ["2018", "2019"]
+    assert len(rows[0]) == 2
@@ -0,0 +1,71 @@
+# 计算任务的Server-Sent Events：事件顺序，以及include_data附带的是任务计算时的结果
+import json
+import time
+
+import api
+import calculate
+import result_artifact
+
+
+def _wait(job_id, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = api.job_manager.get(job_id)
+        if job.status in api.FINISHED_STATES:
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"任务未在{timeout}秒内结束: {job_id}")
+
+
+def _events(client, job_id, **params):
+    """读取任务的事件流，返回 [(id, 事件类型, 数据)]"""
+    response = client.get(f"/api/calculate/jobs/{job_id}/events", params=params)
+    assert response.status_code == 200
+    events = []
+    for block in response.text.split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return events
+
+
+def _submit(client, **params):
+    response = client.post("/api/calculate/batch", params=params)
+    assert response.status_code == 200
+    return _wait(response.json()["job_id"])
+
+
+def test_event_order(client):
+    job = _submit(client)
+    assert job.status == "completed"
+    events = _events(client, job.id)
+    assert [event_id for event_id, _, _ in events] == list(range(len(events)))
+    kinds = [kind for _, kind, _ in events]
+    assert kinds[0] == "start" and kinds[-1] == "end"
+    assert set(kinds[1:-1]) == {"indicator"}
+    planned = [item["name"] for item in events[0][2]["indicators"]]
+    assert sorted(data["name"] for _, _, data in events[1:-1]) == sorted(planned)
+    assert events[-1][2]["status"] == "completed"
+
+    # 断线重连：从Last-Event-ID的下一条继续
+    response = client.get(f"/api/calculate/jobs/{job.id}/events", headers={"Last-Event-ID": "2"})
+    assert response.text.startswith("id: 3\n")
+
+
+def test_include_data_streams_the_jobs_results(client):
+    job = _submit(client, engine="vectorized")
+    artifact = result_artifact.open_artifact(calculate.results_path())
+    expected = {name: json.loads(json.dumps(artifact.to_dict(name))) for name in artifact.names()}
+
+    # 任务结束后修改数据并发布新快照，推送的仍是任务计算时的结果
+    response = client.patch("/api/jsondata/OP.json", json={"cells": [{"year": "2010", "country": "China", "value": 0.65}]})
+    assert response.json()["updated"] == 1
+    calculate.reload_data_cache()
+
+    events = _events(client, job.id, include_data="true")
+    streamed = {data["name"]: data["data"] for _, kind, data in events if kind == "indicator"}
+    for name, data in streamed.items():
+        if name in expected:
+            assert data == expected[name], name
+    assert streamed["R_op_bar"] == expected["R_op_bar"]
+    assert streamed["R_op_bar"] != calculate.get_indicator_result("R_op_bar")
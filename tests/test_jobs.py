@@ -0,0 +1,133 @@
+# 任务队列：按提交顺序执行、合并重复的排队任务、取消，以及supersede只取消指定类型的任务
+import threading
+import time
+
+import pytest
+
+from calculate import CalculationCancelled
+from jobs import CANCELLED, COMPLETED, FAILED, JobManager
+
+
+def _wait(job, timeout=10):
+    deadline = time.time() + timeout
+    while job.finished_at is None:
+        if time.time() > deadline:
+            raise AssertionError(f"任务未在{timeout}秒内结束: {job.id}")
+        time.sleep(0.01)
+    return job
+
+
+def _blocking(started, release, steps=1):
+    """在release之前一直报告进度（可被取消）的任务函数"""
+    def func(progress):
+        started.set()
+        while not release.is_set():
+            progress("step", 0, steps)
+            time.sleep(0.01)
+        progress("step", steps, steps)
+        return "done"
+    return func
+
+
+def _plan():
+    return [("step", 1)]
+
+
+@pytest.fixture
+def manager():
+    return JobManager()
+
+
+def test_jobs_run_in_submission_order(manager):
+    order = []
+    jobs = [manager.submit("batch", {"n": i}, lambda progress, i=i: order.append(i), _plan)[0] for i in range(3)]
+    for job in jobs:
+        _wait(job)
+    assert order == [0, 1, 2]
+    assert all(job.status == COMPLETED for job in jobs)
+    assert [event["event"] for event in jobs[0].events] == ["start", "end"]
+
+
+def test_duplicate_queued_job_is_merged(manager):
+    started, release = threading.Event(), threading.Event()
+    manager.submit("uncertainty", {}, _blocking(started, release), _plan)
+    started.wait(5)
+    queued, created = manager.submit("batch", {"engine": "cell"}, lambda progress: None, _plan)
+    again, created_again = manager.submit("batch", {"engine": "cell"}, lambda progress: None, _plan)
+    assert created and not created_again
+    assert again is queued
+    release.set()
+    _wait(queued)
+
+
+def test_cancel_running_and_queued(manager):
+    started, release = threading.Event(), threading.Event()
+    running, _ = manager.submit("batch", {"n": 1}, _blocking(started, release), _plan)
+    started.wait(5)
+    queued, _ = manager.submit("batch", {"n": 2}, lambda progress: None, _plan)
+    manager.cancel(queued.id)
+    manager.cancel(running.id)
+    assert _wait(running).status == CANCELLED
+    assert _wait(queued).status == CANCELLED
+    assert queued.message == "任务在开始前被取消"
+    assert manager.cancel("missing") is None
+
+
+def test_supersede_cancels_only_listed_kinds(manager):
+    started, release = threading.Event(), threading.Event()
+    other, _ = manager.submit("uncertainty", {}, _blocking(started, release), _plan)
+    started.wait(5)
+    old_batch, _ = manager.submit("batch", {"n": 1}, lambda progress: None, _plan)
+    old_incremental, _ = manager.submit("incremental", {}, lambda progress: None, _plan)
+    new_batch, _ = manager.submit("batch", {"n": 2}, lambda progress: "new", _plan,
+                                  supersede=("batch", "incremental"))
+    assert old_batch.superseded_by == new_batch.id
+    assert old_incremental.superseded_by == new_batch.id
+    assert not other.cancel_requested
+    release.set()
+    assert _wait(other).status == COMPLETED
+    assert _wait(old_batch).status == CANCELLED
+    assert _wait(new_batch).status == COMPLETED and new_batch.result == "new"
+
+
+def test_supersede_true_cancels_same_kind_only(manager):
+    started, release = threading.Event(), threading.Event()
+    running, _ = manager.submit("batch", {"n": 1}, _blocking(started, release), _plan)
+    started.wait(5)
+    other, _ = manager.submit("incremental", {}, lambda progress: None, _plan)
+    newer, _ = manager.submit("batch", {"n": 2}, lambda progress: None, _plan, supersede=True)
+    assert _wait(running).status == CANCELLED
+    assert running.message == f"已被任务 {newer.id} 取代"
+    assert _wait(other).status == COMPLETED
+    assert _wait(newer).status == COMPLETED
+
+
+def test_failed_job_reports_error(manager):
+    def fail(progress):
+        raise RuntimeError("boom")
+    job, _ = manager.submit("batch", {}, fail, _plan)
+    assert _wait(job).status == FAILED
+    assert "boom" in job.message
+
+
+def test_progress_and_indicator_events(manager):
+    def run(progress):
+        for done in range(1, 4):
+            progress("A", done, 3)
+        progress("B", 1, 1)
+    job, _ = manager.submit("batch", {}, run, lambda: [("A", 3), ("B", 1)])
+    _wait(job)
+    status = job.to_dict()
+    assert status["progress"] == 1.0
+    assert status["indicators_done"] == 2 and status["cells_done"] == 4
+    assert [event["data"]["name"] for event in job.events if event["event"] == "indicator"] == ["A", "B"]
+
+
+def test_cancelled_report_raises(manager):
+    started, release = threading.Event(), threading.Event()
+    job, _ = manager.submit("batch", {}, _blocking(started, release), _plan)
+    started.wait(5)
+    manager.cancel(job.id)
+    _wait(job)
+    with pytest.raises(CalculationCancelled):
+        job.report("step", 0, 1)
@@ -0,0 +1,71 @@
+# 运行指标：计数器和耗时分布的记录与导出，计算和接口请求的埋点
+import pytest
+
+import calculate
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def _rows(name, **labels):
+    wanted = {k: str(v) for k, v in labels.items()}
+    return [row for row in metrics.summary().get(name, []) if wanted.items() <= row["labels"].items()]
+
+
+def test_counter_and_histogram():
+    metrics.inc("pdq_file_reads_total", file="a")
+    metrics.inc("pdq_file_reads_total", 2, file="a")
+    metrics.observe("pdq_batch_seconds", 0.002, engine="cell")
+    metrics.observe("pdq_batch_seconds", 3.0, engine="cell")
+    assert _rows("pdq_file_reads_total", file="a")[0]["value"] == 3
+    row = _rows("pdq_batch_seconds", engine="cell")[0]
+    assert row["count"] == 2 and row["max"] == 3.0
+    assert row["mean"] == pytest.approx(1.501)
+
+    text = metrics.render_prometheus()
+    assert '# TYPE pdq_batch_seconds histogram' in text
+    assert 'pdq_batch_seconds_bucket{engine="cell",le="0.005"} 1' in text
+    assert 'pdq_batch_seconds_bucket{engine="cell",le="+Inf"} 2' in text
+    assert 'pdq_batch_seconds_count{engine="cell"} 2' in text
+    assert 'pdq_file_reads_total{file="a"} 3' in text
+
+
+def test_unregistered_metric_is_rejected():
+    with pytest.raises(KeyError):
+        metrics.inc("pdq_unknown_total")
+
+
+def test_label_values_are_escaped():
+    metrics.inc("pdq_file_reads_total", file='a"b\\c')
+    assert 'file="a\\"b\\\\c"' in metrics.render_prometheus()
+
+
+def test_timer_records_on_error():
+    with pytest.raises(RuntimeError):
+        with metrics.timer("pdq_reload_seconds", operation="test"):
+            raise RuntimeError
+    assert _rows("pdq_reload_seconds", operation="test")[0]["count"] == 1
+
+
+def test_batch_records_indicator_metrics(workspace):
+    years, countries = calculate.get_batch_axes()
+    calculate.batch_calculate_and_save(max_workers=2)
+    assert _rows("pdq_batch_seconds", engine="cell")[0]["count"] == 1
+    assert _rows("pdq_indicator_cells_total", indicator="R")[0]["value"] == len(years) * len(countries)
+    assert _rows("pdq_indicator_seconds", indicator="R", source="computed")[0]["count"] == 1
+    assert _rows("pdq_cache_hits_total")
+
+
+def test_endpoints(client):
+    assert client.get("/api/jsondata/OA.json").status_code == 200
+    text = client.get("/metrics").text
+    assert 'route="/api/jsondata/{filename}"' in text
+    assert "pdq_data_version" in text
+    summary = client.get("/api/metrics").json()
+    routes = [row["labels"]["route"] for row in summary["pdq_http_request_seconds"]]
+    assert "/api/jsondata/{filename}" in routes
@@ -0,0 +1,96 @@
+# PATCH /api/jsondata/{filename}：只更新已有单元格，增量计算结果与完整重算一致
+import json
+import os
+import threading
+
+import calculate
+import result_artifact
+
+
+def _read(name):
+    with open(os.path.join("jsondata", name), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _patch(client, name, *cells):
+    return client.patch(f"/api/jsondata/{name}", json={
+        "cells": [{"year": year, "country": country, "value": value} for year, country, value in cells],
+    })
+
+
+def _saved(name):
+    artifact = result_artifact.open_artifact(calculate.results_path())
+    return json.loads(json.dumps(artifact.to_dict(name)))
+
+
+def test_patch_updates_only_given_cells(client):
+    before = _read("OP.json")
+    response = _patch(client, "OP.json", ("2010", "China", 0.65), ("2011", "USA", 0.25))
+    assert response.status_code == 200
+    assert response.json()["updated"] == 2
+    after = _read("OP.json")
+    assert after["2010"]["China"] == 0.65 and after["2011"]["USA"] == 0.25
+    before["2010"]["China"], before["2011"]["USA"] = 0.65, 0.25
+    assert after == before
+
+
+def test_patch_unchanged_value_writes_nothing(client):
+    value = _read("OP.json")["2010"]["China"]
+    mtime = os.stat("jsondata/OP.json").st_mtime_ns
+    response = _patch(client, "OP.json", ("2010", "China", value))
+    assert response.json()["updated"] == 0
+    assert os.stat("jsondata/OP.json").st_mtime_ns == mtime
+
+
+def test_patch_rejects_missing_cells(client):
+    before = _read("OP.json")
+    assert _patch(client, "OP.json", ("1900", "China", 1)).status_code == 404
+    assert _patch(client, "OP.json", ("2010", "China", 1), ("2010", "Atlantis", 1)).status_code == 404
+    assert _patch(client, "OP.json").status_code == 400
+    assert _patch(client, "missing.json", ("2010", "China", 1)).status_code == 404
+    assert _read("OP.json") == before
+
+
+def test_patch_propagates_like_full_recompute(client):
+    calculate.batch_calculate_and_save(max_workers=2)
+    response = _patch(client, "OP.json", ("2010", "China", 0.65))
+    body = response.json()
+    assert body["changed_cells"]["R_op_bar"] >= 1
+    assert "R" in body["changed_cells"]
+    patched = {name: _saved(name) for name in calculate.saved_indicators()}
+
+    calculate.reload_data_cache()
+    calculate.batch_calculate_and_save(max_workers=2)
+    for name, data in patched.items():
+        assert data == _saved(name), name
+
+
+def test_patch_without_warm_cache_invalidates(client):
+    response = _patch(client, "OP.json", ("2010", "China", 0.65))
+    body = response.json()
+    assert body["changed_cells"] == {}
+    assert "R_op_bar" in body["invalidated"]
+
+
+def test_patch_keeps_external_edits(client):
+    calculate.batch_calculate_and_save(max_workers=2)
+    data = _read("OP.json")
+    data["2012"]["EU27"] = 0.75
+    with open("jsondata/OP.json", 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    assert _patch(client, "OP.json", ("2010", "China", 0.65)).status_code == 200
+    after = _read("OP.json")
+    assert after["2012"]["EU27"] == 0.75 and after["2010"]["China"] == 0.65
+    assert "R_op_bar" in calculate.get_stale_indicators()
+
+
+def test_concurrent_patches_are_all_kept(client):
+    countries = ["China", "USA", "EU27", "Japan", "India", "UK"]
+    threads = [threading.Thread(target=_patch, args=(client, "OP.json", ("2010", country, 0.1 * (i + 1))))
+               for i, country in enumerate(countries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    after = _read("OP.json")["2010"]
+    assert [after[country] for country in countries] == [0.1 * (i + 1) for i in range(len(countries))]
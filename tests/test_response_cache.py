@@ -0,0 +1,72 @@
+# 文件读取接口的HTTP缓存：ETag/Last-Modified条件请求、压缩，以及文件变化后不返回旧内容
+import gzip
+import json
+import os
+
+import response_cache
+
+
+def test_etag_and_not_modified(client):
+    first = client.get("/api/jsondata/OA.json")
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+    assert "last-modified" in first.headers
+
+    again = client.get("/api/jsondata/OA.json", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert again.content == b""
+    assert client.get("/api/jsondata/OA.json", headers={"If-None-Match": '"other"'}).status_code == 200
+    since = first.headers["last-modified"]
+    assert client.get("/api/jsondata/OA.json", headers={"If-Modified-Since": since}).status_code == 304
+
+
+def test_api_write_changes_etag(client):
+    etag = client.get("/api/jsondata/OP.json").headers["etag"]
+    response = client.patch("/api/jsondata/OP.json", json={"cells": [{"year": "2010", "country": "China", "value": 0.65}]})
+    assert response.json()["updated"] == 1
+    after = client.get("/api/jsondata/OP.json", headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.headers["etag"] != etag
+    assert after.json()["data"]["2010"]["China"] == 0.65
+
+
+def test_external_edit_is_not_served_from_cache(client):
+    client.get("/api/jsondata/OP.json")
+    with open("jsondata/OP.json", encoding='utf-8') as f:
+        data = json.load(f)
+    data["2010"]["China"] = 0.125
+    with open("jsondata/OP.json", 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    assert client.get("/api/jsondata/OP.json").json()["data"]["2010"]["China"] == 0.125
+
+
+def test_missing_file_is_not_cached(client):
+    assert client.get("/api/jsondata/missing.json").status_code == 404
+    assert client.get("/api/jsondata/OA.txt").status_code == 400
+
+
+def test_gzip_only_for_large_bodies(client):
+    response = client.get("/api/jsondata/OA.json", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    plain = client.get("/api/jsondata/OA.json", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert response.json() == plain.json()
+
+    small = response_cache.CachedBody((0, 0), b'{"value":1}')
+    assert response_cache.respond(small, {"accept-encoding": "gzip"}).headers.get("content-encoding") is None
+    large = response_cache.CachedBody((0, 0), b'{"v":"' + b"x" * 4096 + b'"}')
+    compressed = response_cache.respond(large, {"accept-encoding": "gzip"})
+    assert gzip.decompress(compressed.body) == large.body
+
+
+def test_cache_hits(client, monkeypatch):
+    monkeypatch.setattr(response_cache, "stats", {"hits": 0, "misses": 0, "not_modified": 0})
+    client.get("/api/jsondata/OA.json")
+    client.get("/api/jsondata/OA.json")
+    assert response_cache.stats["misses"] == 1 and response_cache.stats["hits"] == 1
+    response_cache.invalidate(os.path.join("jsondata", "OA.json"))
+    client.get("/api/jsondata/OA.json")
+    assert response_cache.stats["misses"] == 2
@@ -0,0 +1,122 @@
+# 结果文件：编码与读取、合并写入、暂存与延迟写出，以及按需生成旧格式的输出文件
+import json
+import os
+import threading
+
+import pytest
+
+import calculate
+import result_artifact
+
+PANEL = {
+    "2021": {"CN": 2, "US": None, "EU": "n/a"},
+    "2020": {"US": 3.25, "CN": 1.5},
+}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "output" / result_artifact.FILENAME)
+
+
+def test_roundtrip(path):
+    result_artifact.write(path, {"A": (PANEL, 3), "c": ({"value": 0.5}, 3)})
+    artifact = result_artifact.open_artifact(path)
+    assert artifact.names() == ["A", "c"]
+    assert artifact.to_dict("A") == PANEL
+    assert list(artifact.to_dict("A")["2020"]) == ["US", "CN"]
+    assert artifact.get("c") == {"value": 0.5}
+    assert artifact.data_version("A") == 3
+    assert artifact.cell("A", "2021", "CN") == 2
+    assert artifact.cell("A", "2021", "US") is None
+    assert artifact.cell("A", "2021", "EU") == "n/a"
+    assert artifact.cell("A", "2019", "CN", default="missing") == "missing"
+
+
+def test_write_merges_with_existing(path):
+    result_artifact.write(path, {"A": (PANEL, 1), "B": ({"value": 1}, 1)})
+    result_artifact.write(path, {"B": ({"value": 2}, 2), "C": ({"value": 3}, 2)})
+    artifact = result_artifact.open_artifact(path)
+    assert artifact.names() == ["A", "B", "C"]
+    assert artifact.to_dict("A") == PANEL
+    assert artifact.get("B") == {"value": 2}
+    assert artifact.data_version("A") == 1
+
+
+def test_invalid_file_is_ignored(path):
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b"not a result file")
+    assert result_artifact.open_artifact(path) is None
+    assert result_artifact.open_artifact(path + ".missing") is None
+
+
+def test_deferred_writes_once_at_exit(path):
+    with result_artifact.deferred():
+        result_artifact.stage(path, "A", PANEL)
+        with result_artifact.deferred():
+            result_artifact.stage(path, "B", {"value": 1})
+        assert not os.path.exists(path)
+    assert sorted(result_artifact.open_artifact(path).names()) == ["A", "B"]
+
+
+def test_deferred_flushes_on_error(path):
+    with pytest.raises(RuntimeError):
+        with result_artifact.deferred():
+            result_artifact.stage(path, "A", PANEL)
+            raise RuntimeError
+    assert result_artifact.open_artifact(path).names() == ["A"]
+
+
+def test_deferred_only_affects_its_thread(path):
+    inside, done = threading.Event(), threading.Event()
+
+    def batch():
+        with result_artifact.deferred():
+            result_artifact.stage(path, "A", PANEL)
+            inside.set()
+            done.wait(5)
+
+    thread = threading.Thread(target=batch)
+    thread.start()
+    inside.wait(5)
+    result_artifact.stage(path, "B", {"value": 1})
+    assert result_artifact.open_artifact(path).names() == ["B"]
+    done.set()
+    thread.join()
+    assert sorted(result_artifact.open_artifact(path).names()) == ["A", "B"]
+
+
+def test_materialize(path):
+    target = os.path.join(os.path.dirname(path), "A.json")
+    assert not result_artifact.materialize(path, "A", target)
+    result_artifact.write(path, {"A": (PANEL, 1)})
+    assert result_artifact.materialize(path, "A", target)
+    with open(target, encoding='utf-8') as f:
+        assert f.read() == json.dumps(PANEL, ensure_ascii=False, indent=2)
+
+    # 比结果新的文件（通过API修改过）保持不变，该指标重新写入结果文件后重新生成
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write('{"edited": true}')
+    written = result_artifact.open_artifact(path).written("A")
+    os.utime(target, ns=(written + 10 ** 9, written + 10 ** 9))
+    assert result_artifact.materialize(path, "A", target)
+    with open(target, encoding='utf-8') as f:
+        assert json.load(f) == {"edited": True}
+    os.utime(target, ns=(written, written))
+    result_artifact.write(path, {"A": (PANEL, 2)})
+    result_artifact.materialize(path, "A", target)
+    with open(target, encoding='utf-8') as f:
+        assert json.load(f) == PANEL
+
+
+def test_output_api_reads_artifact(client):
+    calculate.batch_calculate_and_save(max_workers=2)
+    assert not os.path.exists("output/R.json")
+    names = [item["filename"] for item in client.get("/api/output/files").json()["files"]]
+    assert "R.json" in names
+    response = client.get("/api/output/R.json")
+    assert response.status_code == 200
+    artifact = result_artifact.open_artifact(calculate.results_path())
+    assert response.json()["data"] == json.loads(json.dumps(artifact.to_dict("R")))
+    assert os.path.exists("output/R.json")
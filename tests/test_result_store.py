@@ -0,0 +1,62 @@
+# 持久化缓存命中时的输出与完整计算相同（包括抛出异常的单元格）
+import json
+import shutil
+
+import pytest
+
+import calculate
+import columnar_store
+import result_artifact
+
+
+def _saved_outputs():
+    """结果文件中的全部结果，读取后删除输出目录，下一次计算重新写出"""
+    artifact = result_artifact.open_artifact(calculate.results_path())
+    outputs = {name: json.loads(json.dumps(artifact.to_dict(name))) for name in artifact.names()}
+    shutil.rmtree("output")
+    return outputs
+
+
+def _set_null(key, year, country):
+    path = calculate.json_files[key]
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    data[year][country] = None
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+@pytest.mark.parametrize("engine", ["cell", "process"])
+@pytest.mark.parametrize("null", [None, ("F2", "2000", "China"), ("alpha_L", "2005", "EU27")])
+def test_warm_run_matches_cold_run(store, engine, null):
+    if null is not None:
+        _set_null(*null)
+    calculate.reload_data_cache()
+    calculate.batch_calculate_and_save(engine=engine, max_workers=2)
+    cold = _saved_outputs()
+
+    # 清空内存缓存，结果全部从持久化缓存读取
+    calculate.reload_data_cache()
+    calculate.batch_calculate_and_save(engine=engine, max_workers=2)
+    warm = _saved_outputs()
+    assert warm == cold
+
+
+def _missing_cells(name):
+    """批量输出范围内不在内存缓存中的单元格（抛出异常的单元格）"""
+    years, countries = calculate.get_batch_axes()
+    cache = calculate._results()['functions'].get(name, {})
+    return {(str(y), c) for y in years for c in countries if c not in cache.get(str(y), {})}
+
+
+def test_failed_cells_are_not_warmed_as_values(store):
+    _set_null("F2", "2000", "China")
+    calculate.reload_data_cache()
+    calculate.batch_calculate_and_save(engine="cell", max_workers=2)
+    failed = _missing_cells("R_od")
+    assert failed
+    assert "S_od_t1" not in calculate._results()['constants']
+
+    calculate.reload_data_cache()
+    assert calculate._warm_from_store("R_od")
+    assert _missing_cells("R_od") == failed
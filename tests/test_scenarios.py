@@ -0,0 +1,39 @@
+# 权重情景：网格参数检查，当前权重的情景与批量计算的R一致
+import json
+
+import numpy as np
+import pytest
+
+import calculate
+import scenarios
+
+
+def test_weight_grid():
+    grid = scenarios.weight_grid(0.1)
+    assert grid.shape == (66, 3)
+    assert np.allclose(grid.sum(axis=1), 1)
+    assert (grid >= 0).all()
+
+
+@pytest.mark.parametrize("step", [0, -0.1, 1.5, 0.3, float("nan")])
+def test_weight_grid_rejects_invalid_step(step):
+    with pytest.raises(ValueError):
+        scenarios.weight_grid(step)
+
+
+@pytest.mark.parametrize("step", [0, -0.1, 1.5, 0.3])
+def test_invalid_grid_step_is_bad_request(client, step):
+    response = client.post("/api/scenarios/weights", json={"grid_step": step})
+    assert response.status_code == 400
+
+
+def test_current_weights_reproduce_r(client):
+    calculate.batch_calculate_and_save(max_workers=2)
+    with open("jsondata/weight.json", encoding='utf-8') as f:
+        weights = json.load(f)
+    response = client.post("/api/scenarios/weights", json={"weights": [weights], "years": ["2010-2012"]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["years"] == ["2010", "2011", "2012"]
+    expected = calculate.query_results(["R"], body["years"])["values"]["R"]
+    assert body["scenarios"][0]["values"] == expected
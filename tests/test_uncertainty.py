@@ -0,0 +1,99 @@
+# 蒙特卡洛不确定性分析：流式统计与numpy一致，结果与进程数无关，无扰动时等于确定性计算结果
+import json
+import time
+
+import numpy as np
+import pytest
+
+import api
+import calculate
+import uncertainty
+
+
+def _samples(seed=1):
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(size=(200, 3, 4))
+    samples[rng.random(samples.shape) < 0.1] = np.nan
+    samples[:, 0, 0] = np.nan
+    return samples
+
+
+def test_summarize_matches_numpy():
+    samples = _samples()
+    stats = uncertainty.summarize(samples.copy(), confidence=0.9)
+    with np.errstate(invalid='ignore'), pytest.warns(RuntimeWarning):
+        assert np.allclose(stats["mean"], np.nanmean(samples, axis=0), equal_nan=True)
+        assert np.allclose(stats["std"], np.nanstd(samples, axis=0, ddof=1), equal_nan=True)
+        assert np.allclose(stats["lower"], np.nanquantile(samples, 0.05, axis=0), equal_nan=True)
+        assert np.allclose(stats["upper"], np.nanquantile(samples, 0.95, axis=0), equal_nan=True)
+    assert np.isnan(stats["mean"][0, 0])
+
+
+def test_accumulator_is_independent_of_blocks():
+    samples = _samples()
+    whole = uncertainty.summarize(samples.copy())
+    accumulator = uncertainty.Accumulator(samples.shape[1:], len(samples))
+    for start in range(0, len(samples), 37):
+        accumulator.add(samples[start:start + 37])
+    chunked = accumulator.summarize()
+    for key in ("mean", "std", "lower", "upper"):
+        assert np.allclose(chunked[key], whole[key], equal_nan=True), key
+
+
+def test_results_do_not_depend_on_workers(workspace):
+    single = uncertainty.run(samples=40, chunk_size=10, workers=1, save=False)
+    pooled = uncertainty.run(samples=40, chunk_size=10, workers=2, save=False)
+    assert single["results"] == pooled["results"]
+
+
+def test_zero_noise_reproduces_batch_results(workspace):
+    calculate.batch_calculate_and_save(max_workers=2)
+    expected = calculate.query_results(["R"])["values"]["R"]
+    result = uncertainty.run(samples=5, noise={}, indicators=["R"], workers=1, save=False)
+    for year, row in result["results"]["R"].items():
+        for country, stats in row.items():
+            if expected[year][country] is None:
+                assert stats["mean"] is None
+                continue
+            assert stats["mean"] == pytest.approx(expected[year][country])
+            assert stats["std"] == pytest.approx(0, abs=1e-12)
+            assert stats["lower"] == pytest.approx(stats["upper"])
+
+
+def test_quantile_memory_limit(workspace, monkeypatch):
+    years, countries = calculate.get_batch_axes()
+    per_sample = len(years) * len(countries) * 8
+    monkeypatch.setattr(uncertainty, "MIN_QUANTILE_SAMPLES", 10)
+    monkeypatch.setattr(uncertainty, "QUANTILE_MEMORY", per_sample * 20)
+    result = uncertainty.run(samples=50, indicators=["R"], workers=1, save=False)
+    assert result["meta"]["quantile_samples"] == 20
+    monkeypatch.setattr(uncertainty, "QUANTILE_MEMORY", per_sample * 5)
+    with pytest.raises(ValueError):
+        uncertainty.run(samples=50, indicators=["R"], workers=1, save=False)
+
+
+@pytest.mark.parametrize("params", [
+    {"samples": 1},
+    {"indicators": ["nope"]},
+    {"noise": {"nope": 0.1}},
+    {"noise": {"FWCI": -0.1}},
+    {"model": "uniform"},
+    {"confidence": 1},
+])
+def test_invalid_parameters_are_bad_request(client, params):
+    assert client.post("/api/calculate/uncertainty", json=params).status_code == 400
+
+
+def test_uncertainty_job(client):
+    assert client.get("/api/calculate/uncertainty/R").status_code == 404
+    response = client.post("/api/calculate/uncertainty", json={"samples": 20, "indicators": ["R"], "workers": 1})
+    assert response.status_code == 200
+    job = api.job_manager.get(response.json()["job_id"])
+    deadline = time.time() + 60
+    while job.status not in api.FINISHED_STATES and time.time() < deadline:
+        time.sleep(0.05)
+    assert job.status == "completed", job.message
+    result = client.get("/api/calculate/uncertainty/R").json()
+    assert result["meta"]["samples"] == 20
+    with open("output/uncertainty/R.json", encoding='utf-8') as f:
+        assert json.load(f) == result
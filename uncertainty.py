@@ -0,0 +1,302 @@
+# 指标不确定性分析（蒙特卡洛）
+# FWCI、科学家数量、alpha_L/alpha_F/alpha_I等输入带有测量误差。按给定的相对误差生成N份扰动后的输入面板，
+# 用向量化引擎（calculate_vec.compute_all，额外的前置样本轴）一次计算一批样本的全部指标，
+# 样本分块交给进程池并行计算，按块顺序累计每个 (年份, 国家) 单元格的均值、标准差，并统计置信区间，写入 output/uncertainty/。
+# 所有样本的结果不同时保存在内存中：均值和标准差逐块合并；置信区间的分位数需要保存样本，
+# 保存的样本数受QUANTILE_MEMORY限制（样本独立同分布，前K个样本就是一个随机子样本）。
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import atomic_io
+import calculate
+import calculate_vec
+
+# 默认扰动的输入及其相对标准差
+DEFAULT_NOISE = {
+    "FWCI": 0.05,
+    "scientist": 0.05,
+    "alpha_L": 0.05,
+    "alpha_F": 0.05,
+    "alpha_I": 0.05,
+}
+
+# 默认统计的指标
+DEFAULT_INDICATORS = ["R", "R_oa", "R_od"]
+
+# 扰动模型：lognormal（乘以均值为1的对数正态因子，保持非负）或 normal（乘以 1 + 相对误差×标准正态）
+NOISE_MODELS = ("lognormal", "normal")
+
+# 每个进程任务计算的样本数
+CHUNK_SIZE = 250
+
+# 每块样本最多包含的 样本数×面板单元格数（面板较大时减少每块的样本数，限制每个进程计算时的内存）
+CHUNK_CELLS = 1_500_000
+
+# 样本数上限
+MAX_SAMPLES = 100_000
+
+# 保存用于计算置信区间的样本最多占用的内存（字节）：样本数×指标数×单元格数×8字节超过时，只保存前面的样本
+QUANTILE_MEMORY = 512 * 1024 ** 2
+
+# 置信区间至少使用的样本数；面板太大、内存限制内保存不下时拒绝运行
+MIN_QUANTILE_SAMPLES = 1000
+
+# 结果目录
+OUTPUT_DIR = os.path.join("output", "uncertainty")
+
+# 工作进程中的面板（由initializer设置，避免每个任务重复传输）
+_panel = None
+
+
+def _init_worker(panel):
+    global _panel
+    _panel = panel
+
+
+def perturb(panel, rng, samples, noise, model="lognormal"):
+    """生成 samples 份扰动后的输入矩阵：{数据键: (样本数, 年份数, 国家数)}"""
+    values = {}
+    for key, sd in noise.items():
+        if key not in panel.values:
+            raise ValueError(f"不支持扰动的数据: {key}（可选 {', '.join(calculate_vec.PANEL_KEYS)}）")
+        base = panel.values[key]
+        z = rng.standard_normal((samples,) + base.shape)
+        if model == "lognormal":
+            factor = np.exp(sd * z - sd * sd / 2)
+        elif model == "normal":
+            factor = 1 + sd * z
+        else:
+            raise ValueError(f"不支持的扰动模型: {model}（可选 {', '.join(NOISE_MODELS)}）")
+        values[key] = base * factor
+    return values
+
+
+def _output_block(panel, matrix, samples):
+    """取出批量输出的年份和国家对应的块；不受扰动影响的指标没有样本轴，按样本数展开"""
+    rows = [panel.year_index[y] for y in panel.output_years]
+    cols = [panel.country_index[c] for c in panel.output_countries]
+    block = np.asarray(matrix)[..., rows, :][..., cols]
+    return np.broadcast_to(block, (samples,) + block.shape[-2:])
+
+
+def compute_samples(panel, seed, samples, noise, model, names):
+    """计算一块样本，返回 (样本数, 指标数, 年份数, 国家数) 的数组（缺失为NaN）"""
+    rng = np.random.default_rng(seed)
+    cells, _ = calculate_vec.compute_all(panel, perturb(panel, rng, samples, noise, model))
+    block = np.stack([_output_block(panel, cells[name], samples) for name in names], axis=1)
+    block[~np.isfinite(block)] = np.nan
+    return block
+
+
+def _compute_chunk(seed, samples, noise, model, names):
+    return compute_samples(_panel, seed, samples, noise, model, names)
+
+
+class Accumulator:
+    """
+    按样本块累计统计量：均值和离差平方和逐块合并（Chan等的并行算法），
+    前keep个样本保存下来用于计算分位数。块按样本顺序加入，结果与分块方式、进程数无关。
+    """
+
+    def __init__(self, shape, keep):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.kept = np.empty((keep,) + tuple(shape))
+        self.stored = 0
+
+    def add(self, block):
+        """加入一块样本 (样本数, ...)，缺失为NaN"""
+        valid = ~np.isnan(block)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(block, axis=0) / count, 0.0)
+            m2 = np.nansum((block - mean) ** 2, axis=0)
+            total = self.count + count
+            delta = mean - self.mean
+            ratio = np.where(total > 0, count / total, 0.0)
+            self.mean = self.mean + delta * ratio
+            self.m2 = self.m2 + m2 + delta ** 2 * self.count * ratio
+        self.count = total
+        take = min(len(block), len(self.kept) - self.stored)
+        if take > 0:
+            self.kept[self.stored:self.stored + take] = block[:take]
+            self.stored += take
+
+    def summarize(self, confidence=0.95):
+        """返回 mean、std、lower、upper（以及有效样本数count），全部缺失的位置为NaN；保存的样本就地排序"""
+        alpha = (1 - confidence) / 2
+        ordered = self.kept[:self.stored]
+        kept_count = (~np.isnan(ordered)).sum(axis=0)
+        ordered[np.isnan(ordered)] = np.inf
+        ordered.sort(axis=0)
+        # 按有效样本数取分位数（线性插值，与np.quantile相同）
+        lower = _quantile(ordered, kept_count, alpha)
+        upper = _quantile(ordered, kept_count, 1 - alpha)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / (self.count - 1))
+        mean = np.where(self.count > 0, self.mean, np.nan)
+        std = np.where(self.count > 1, std, np.nan)
+        return {"mean": mean, "std": std, "lower": lower, "upper": upper, "count": self.count}
+
+
+def summarize(samples, confidence=0.95):
+    """沿样本轴统计：返回 mean、std、lower、upper（以及有效样本数count），全部缺失的位置为NaN"""
+    accumulator = Accumulator(samples.shape[1:], len(samples))
+    accumulator.add(samples)
+    return accumulator.summarize(confidence)
+
+
+def _quantile(ordered, count, q):
+    position = (count - 1) * q
+    low = np.clip(np.floor(position).astype(np.int64), 0, None)
+    high = np.clip(np.ceil(position).astype(np.int64), 0, None)
+    low_values = np.take_along_axis(ordered, low[None], axis=0)[0]
+    high_values = np.take_along_axis(ordered, high[None], axis=0)[0]
+    # 全部缺失的位置保存的样本都是inf，结果由count > 0屏蔽
+    with np.errstate(invalid='ignore'):
+        result = low_values + (high_values - low_values) * (position - low)
+    return np.where(count > 0, result, np.nan)
+
+
+def _cell_value(value):
+    return None if value != value else value
+
+
+def validate(samples, noise=None, indicators=None, model="lognormal", confidence=0.95):
+    """检查参数，返回 (扰动设置, 指标列表)；参数错误时抛出ValueError"""
+    noise = dict(DEFAULT_NOISE if noise is None else noise)
+    names = list(indicators or DEFAULT_INDICATORS)
+    unknown = [name for name in names if name not in calculate_vec.CELL_FUNCTIONS]
+    if unknown:
+        raise ValueError(f"不支持的指标: {', '.join(unknown)}")
+    unsupported = [key for key in noise if key not in calculate_vec.PANEL_KEYS]
+    if unsupported:
+        raise ValueError(f"不支持扰动的数据: {', '.join(unsupported)}（可选 {', '.join(calculate_vec.PANEL_KEYS)}）")
+    if any(sd < 0 for sd in noise.values()):
+        raise ValueError("相对标准差不能为负")
+    if model not in NOISE_MODELS:
+        raise ValueError(f"不支持的扰动模型: {model}（可选 {', '.join(NOISE_MODELS)}）")
+    if not 2 <= samples <= MAX_SAMPLES:
+        raise ValueError(f"样本数必须在2到{MAX_SAMPLES}之间")
+    if not 0 < confidence < 1:
+        raise ValueError("置信水平必须在0和1之间")
+    years, countries = calculate.get_batch_axes()
+    quantile_samples(samples, (len(names), len(years), len(countries)))
+    return noise, names
+
+
+def quantile_samples(samples, shape):
+    """用于计算置信区间的样本数：QUANTILE_MEMORY内能保存的样本数（不超过总样本数），太少时抛出ValueError"""
+    per_sample = int(np.prod(shape)) * 8
+    keep = min(samples, QUANTILE_MEMORY // max(1, per_sample))
+    if keep < min(samples, MIN_QUANTILE_SAMPLES):
+        raise ValueError(
+            f"面板过大：每个样本的结果需要{per_sample / 1024 ** 2:.1f}MB，"
+            f"在{QUANTILE_MEMORY // 1024 ** 2}MB内无法保存计算置信区间所需的{MIN_QUANTILE_SAMPLES}个样本，请减少指标数"
+        )
+    return keep
+
+
+def run(samples=1000, noise=None, indicators=None, model="lognormal", confidence=0.95, seed=0,
+        workers=None, chunk_size=None, save=True, progress=None):
+    """
+    蒙特卡洛不确定性分析。
+    samples: 样本数；noise: {数据键: 相对标准差}（默认DEFAULT_NOISE）；indicators: 统计的指标（默认R、R_oa、R_od）
+    seed: 随机种子，相同种子和参数的结果相同（与进程数、分块无关）
+    workers: 进程数，1时在当前进程中计算；progress(name, done, total): 每完成一块样本报告一次
+    均值和标准差使用全部样本；置信区间使用前quantile_samples个样本（内存限制内能保存的样本数，记录在meta中）
+    返回 {"meta": 参数与耗时, "results": {指标名: 年份->国家->{"mean","std","lower","upper"}}}，
+    save为True时每个指标写入 output/uncertainty/<指标>.json（{"meta", "data"}）
+    """
+    noise, names = validate(samples, noise, indicators, model, confidence)
+
+    with calculate.pin_snapshot() as snapshot:
+        calculate.preload_datasets()
+        panel = calculate_vec.Panel()
+
+    shape = (len(names), len(panel.output_years), len(panel.output_countries))
+    keep = quantile_samples(samples, shape)
+    chunk_size = chunk_size or max(1, min(CHUNK_SIZE, CHUNK_CELLS // max(1, len(panel.years) * len(panel.countries))))
+
+    start_time = time.time()
+    sizes = [min(chunk_size, samples - start) for start in range(0, samples, chunk_size)]
+    # 每块使用独立的随机数流，结果与进程数无关
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    accumulator = Accumulator(shape, keep)
+    calculate._report_progress(progress, "uncertainty", 0, samples)
+
+    done = 0
+    if workers == 1 or len(sizes) == 1:
+        for i, size in enumerate(sizes):
+            accumulator.add(compute_samples(panel, seeds[i], size, noise, model, names))
+            done += size
+            calculate._report_progress(progress, "uncertainty", done, samples)
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(panel,)) as executor:
+            # 按块顺序提交和合并，同时进行中的块不超过进程数的2倍（已完成但未合并的结果不会堆积在内存中）
+            pending = deque()
+            submitted = 0
+            try:
+                while submitted < len(sizes) or pending:
+                    while submitted < len(sizes) and len(pending) < 2 * workers:
+                        pending.append(executor.submit(_compute_chunk, seeds[submitted], sizes[submitted],
+                                                       noise, model, names))
+                        submitted += 1
+                    block = pending.popleft().result()
+                    accumulator.add(block)
+                    done += len(block)
+                    calculate._report_progress(progress, "uncertainty", done, samples)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+    stats = accumulator.summarize(confidence)
+    output = {}
+    for k, name in enumerate(names):
+        table = {}
+        for r, year in enumerate(panel.output_years):
+            row = table[year] = {}
+            for c, country in enumerate(panel.output_countries):
+                row[country] = {
+                    "mean": _cell_value(float(stats["mean"][k, r, c])),
+                    "std": _cell_value(float(stats["std"][k, r, c])),
+                    "lower": _cell_value(float(stats["lower"][k, r, c])),
+                    "upper": _cell_value(float(stats["upper"][k, r, c])),
+                }
+        output[name] = table
+
+    meta = {
+        "samples": samples,
+        "model": model,
+        "noise": noise,
+        "confidence": confidence,
+        "seed": seed,
+        "quantile_samples": keep,
+        "data_version": snapshot.version,
+        "elapsed": time.time() - start_time,
+    }
+    if save:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        for name, table in output.items():
+            atomic_io.atomic_write(
+                os.path.join(OUTPUT_DIR, f"{name}.json"),
+                json.dumps({"meta": meta, "data": table}, ensure_ascii=False, indent=2),
+                fsync=False
+            )
+    print(f"不确定性分析完成: {samples}个样本，用时{meta['elapsed']:.2f}秒")
+    return {"meta": meta, "results": output}
+
+
+if __name__ == "__main__":
+    # python uncertainty.py [样本数] [进程数]
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+        workers=int(sys.argv[2]) if len(sys.argv) > 2 else None)